@@ -1,37 +1,289 @@
-import gradio as gr
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from apps.chat_session import ChatSession
 from apps.run_chain import SpendWise
 from apps.upload_file import PDFProcessor
-from apps.generate_plot import PlotGenerator
-import openai
-from langchain_openai import ChatOpenAI
-import os
+from apps.generate_plot import PANELS, PlotGenerator
+from apps.ingest_jobs import IngestionJobManager
+from apps.statement_catalog import StatementCatalog
+from apps.tracing import metrics, tracer
+
+# Bundled statements every session can pick from, as (label, value) dropdown choices
+SAMPLE_STATEMENTS = [("july", "july"), ("august", "august")]
+# Catalog owners of visitors who are neither logged in nor covered by the app's owner
+SESSION_OWNER_PREFIX = "session:"
+# Date ranges offered on the dashboard, as (label, preset) dropdown choices
+RANGE_CHOICES = [
+    ("All time", "all_time"),
+    ("Last 30 days", "last_30_days"),
+    ("Last quarter", "last_quarter"),
+    ("Year to date", "year_to_date"),
+    ("Last 12 months", "last_12_months"),
+    ("Custom dates", "custom"),
+]
 
 
 class SpendWiseApp:
-    def __init__(self):
-        self.llm = ChatOpenAI(
-            model="tiiuae/falcon-180B-chat",
-            api_key=os.getenv("AI71_API_KEY"),
-            base_url="https://api.ai71.ai/v1/",
-            temperature=0,
-        )
-        self.spendwise_instance = SpendWise()
+    def __init__(self, chat_concurrency=16, dashboard_concurrency=8, upload_concurrency=2, max_queue_size=256,
+                 show_metrics=False, profile_dir="./profiles", llm_backend=None, max_chat_sessions=1000,
+                 split_dashboard=False, owner=None, extract_workers=2, session_ttl=24 * 3600):
+        """
+        :param chat_concurrency: Chat requests served at once.
+        :param dashboard_concurrency: Dashboard renders served at once.
+        :param upload_concurrency: Statement uploads ingested at once by the background job pool,
+            so uploads can't take the workers chat traffic needs.
+        :param max_queue_size: Requests allowed to wait in the queue before new ones are rejected.
+        :param show_metrics: Add a Metrics tab with counters, recent traces and request profiling.
+            Off by default, since every visitor of the shared app would see it.
+        :param profile_dir: Where profiles of single requests are saved.
+        :param llm_backend: LLM backend for chat and merchant classification, e.g. "stub" for the
+            local stand-in of apps.llm_stub; defaults to the SPENDWISE_LLM_BACKEND environment variable.
+        :param max_chat_sessions: Conversations kept for follow-up questions; the least recently used
+            are dropped past it.
+        :param split_dashboard: Show the dashboard as six separate plots, of which only those whose
+            data changed are sent again, instead of one figure.
+        :param owner: Catalog owner of visitors who are not logged in, e.g. the ``--owner`` statements
+            were backfilled for with apps.batch_ingest; defaults to the SPENDWISE_OWNER environment
+            variable. Unset, each browser session has its own catalog, which a page reload starts
+            afresh.
+        :param extract_workers: Processes that extract the pages of an uploaded PDF. Extraction is
+            CPU-bound, so running it in-process would hold the GIL while chat requests are served.
+        :param session_ttl: Seconds a browser session's uploads stay in its catalog. Those sessions
+            can't be returned to after a reload, so their entries and stored PDFs are dropped once
+            they are this old.
+        """
+        self.chat_concurrency = chat_concurrency
+        self.dashboard_concurrency = dashboard_concurrency
+        self.upload_concurrency = upload_concurrency
+        self.max_queue_size = max_queue_size
+        self.show_metrics = show_metrics
+        self.profile_dir = profile_dir
+        self.spendwise_instance = SpendWise(llm_backend=llm_backend)
+        self.max_chat_sessions = max_chat_sessions
+        self.split_dashboard = split_dashboard
+        self.owner = owner or os.getenv("SPENDWISE_OWNER")
+        self.session_ttl = session_ttl
+        self._last_expiry = float("-inf")
+        self._chat_sessions = OrderedDict()
         self.plot_generator = PlotGenerator()
-        self.processor = PDFProcessor()
+        self.processor = PDFProcessor(llm_backend=llm_backend, extract_workers=extract_workers)
+        self.jobs = IngestionJobManager(self.processor, max_workers=upload_concurrency)
+        self.catalog = StatementCatalog(self.processor.store.db_path)
         self.title = "SpendWise"
         self.description = "Track Smart, Spend Wise!"
         self.demo = None
 
     def toggle_visibility(self, choice):
+        import gradio as gr
+
         if choice == "Upload a new file":
-            return gr.update(visible=True), gr.update(visible=False)
+            return gr.update(visible=True), gr.update(visible=False), gr.update(visible=True), gr.update(visible=True)
         elif choice == "Choose from existing":
-            return gr.update(visible=False), gr.update(visible=True)
+            return gr.update(visible=False), gr.update(visible=True), gr.update(visible=False), gr.update(visible=False)
+
+    def ingest_samples(self):
+        """
+        Loads the bundled sample statements into the expenses database, once per file content,
+        so date ranges and chat cover them as they do uploads.
+
+        :return: Number of transactions added.
+        """
+        import pandas as pd
+
+        store = self.processor.store
+        added = 0
+        for _, month in SAMPLE_STATEMENTS:
+            path = self.plot_generator.file_mapping[month]
+            if not os.path.exists(path):
+                continue
+            file_hash = store.file_hash(path)
+            if store.is_ingested(file_hash):
+                continue
+            df = pd.read_csv(path, index_col=0)
+            # The samples have no transaction ids; their row numbers keep re-ingests of an edited file idempotent
+            df["Transaction ID"] = df.index.astype(str)
+            added += store.ingest(df, self.plot_generator.statement_mapping[month], file_hash, os.path.basename(path))
+            self.plot_generator.invalidate(month)
+        return added
+
+    def _owner(self, request):
+        """Catalog owner of a request: the logged-in user, else the app's owner, else the browser session."""
+        if request is None:
+            return self.owner or "local"
+        return getattr(request, "username", None) or self.owner or SESSION_OWNER_PREFIX + request.session_hash
+
+    def statement_choices(self, owner):
+        """Dropdown choices for an owner: the samples followed by their uploads, newest first."""
+        return SAMPLE_STATEMENTS + [tuple(entry) for entry in self.catalog.list(owner)]
+
+    def _check_statement(self, owner, statement):
+        """Only lets an owner query the samples and the statements they uploaded."""
+        if statement in dict(SAMPLE_STATEMENTS).values() or self.catalog.owns(owner, statement):
+            return statement
+        raise ValueError("Choose one of your statements first.")
+
+    def _expire_sessions(self):
+        """Drop browser sessions' catalog entries older than session_ttl, at most once an hour."""
+        now = time.monotonic()
+        if now - self._last_expiry < 3600:
+            return
+        self._last_expiry = now
+        dropped = self.catalog.expire(SESSION_OWNER_PREFIX, self.session_ttl)
+        if dropped:
+            logging.info(f"Expired {dropped} statements of past browser sessions.")
+
+    def refresh_statements(self, owner):
+        import gradio as gr
+
+        # Runs on every page load, which is when earlier sessions get left behind
+        self._expire_sessions()
+        return gr.update(choices=self.statement_choices(owner))
+
+    async def upload_file(self, file_path, owner):
+        """
+        Registers the upload in the owner's catalog and ingests it as a background job.
+
+        Files are stored under their content hash, so an upload that was seen before, from
+        this owner or anyone else, is only added to the catalog and not ingested again.
+        Catalog work (hashing, copying, SQLite) runs in a thread, off the event loop.
+        """
+        import gradio as gr
+
+        entry = await asyncio.to_thread(
+            self.catalog.add, owner, file_path, label=os.path.splitext(os.path.basename(file_path))[0]
+        )
+        statement = entry["statement"]
+        job_id = self.jobs.submit(
+            entry["path"], new_file_name=None, on_done=lambda job: self.plot_generator.invalidate(statement)
+        )
+        async for status in self.jobs.watch(job_id):
+            yield status, job_id, gr.update()
+        if self.jobs.get(job_id).status == "done":
+            choices = await asyncio.to_thread(self.statement_choices, owner)
+            yield status, job_id, gr.update(choices=choices, value=statement)
+
+    def cancel_upload(self, job_id):
+        if job_id and self.jobs.cancel(job_id):
+            return f"Cancelling job {job_id}..."
+        return "No running upload to cancel."
+
+    async def generate_plot(self, statement, owner):
+        statement = await asyncio.to_thread(self._check_statement, owner, statement)
+        return await self.plot_generator.agenerate_plot(statement)
+
+    async def generate_range_plot(self, preset, start, end, freq, owner):
+        """Dashboard for a date range across every statement the owner can see."""
+        months = [statement for _, statement in await asyncio.to_thread(self.statement_choices, owner)]
+        if preset == "custom":
+            preset = None
+        else:
+            start = end = None
+        return await self.plot_generator.agenerate_range_plot(start or None, end or None, months, preset, freq)
+
+    def chat_session(self, owner, statement, choices):
+        """
+        The owner's conversation started from a statement, created on their first question about it.
+        Follow-ups may move it to any other statement the owner can see, i.e. in ``choices``.
+        """
+        key = (owner, statement)
+        session = self._chat_sessions.get(key)
+        if session is None:
+            session = self._chat_sessions[key] = ChatSession(self.spendwise_instance, statement)
+            while len(self._chat_sessions) > self.max_chat_sessions:
+                self._chat_sessions.popitem(last=False)
+        self._chat_sessions.move_to_end(key)
+        # Refreshed on every question, since the owner may have uploaded statements since
+        session.statements = dict(choices)
+        return session
+
+    def new_conversation(self, statement, owner):
+        self._chat_sessions.pop((owner, statement), None)
+        return "", ""
+
+    @staticmethod
+    def _panel_updates(panels, digests):
+        """Plot values for the panels, leaving unchanged ones as they are, followed by the new digests."""
+        import gradio as gr
+
+        return [gr.update() if fig is None else fig for fig in panels.values()] + [digests]
 
-    def display_sample(self, sample, dropdown):
-        return sample, self.spendwise_instance.run(sample, dropdown)
+    async def generate_panels(self, statement, known, owner):
+        statement = await asyncio.to_thread(self._check_statement, owner, statement)
+        return self._panel_updates(*await self.plot_generator.agenerate_panels(statement, known))
+
+    async def generate_range_panels(self, preset, start, end, freq, known, owner):
+        """Dashboard panels for a date range across every statement the owner can see."""
+        months = [statement for _, statement in await asyncio.to_thread(self.statement_choices, owner)]
+        if preset == "custom":
+            preset = None
+        else:
+            start = end = None
+        return self._panel_updates(*await self.plot_generator.agenerate_range_panels(
+            start or None, end or None, months, preset, freq, known
+        ))
+
+    async def chat(self, question, statement, show_result, owner):
+        await asyncio.to_thread(self._check_statement, owner, statement)
+        choices = await asyncio.to_thread(self.statement_choices, owner)
+        async for answer in self.chat_session(owner, statement, choices).aask_stream(question, show_result):
+            yield answer
+
+    async def display_sample(self, sample, dropdown, show_result, owner):
+        async for answer in self.chat(sample, dropdown, show_result, owner):
+            yield sample, answer
+
+    def metrics_report(self):
+        """Counters, stage timings and the latest traces, plus the same metrics in Prometheus format."""
+        return {"metrics": metrics.snapshot(), "recent_traces": tracer.recent_traces(limit=10)}, metrics.to_prometheus()
+
+    def profile_next(self, name):
+        tracer.profile_next(name, self.profile_dir)
+        return f"The next {name} request will be profiled and saved to {self.profile_dir}."
+
+    def last_profile(self):
+        if not tracer.profiles:
+            return "No request has been profiled yet."
+        profile = tracer.profiles[-1]
+        return f"{profile['name']} ({profile['ms']:.1f}ms), saved to {profile['path']}\n\n{profile['stats']}"
 
     def build_interface(self):
+        # Gradio is the heaviest import; it is only needed once the UI is built
+        import gradio as gr
+
+        # Gradio injects the request into handlers annotated with gr.Request; it identifies the catalog owner
+        async def upload_file(file_path, request: gr.Request):
+            async for update in self.upload_file(file_path, self._owner(request)):
+                yield update
+
+        def refresh_statements(request: gr.Request):
+            return self.refresh_statements(self._owner(request))
+
+        async def generate_plot(statement, request: gr.Request):
+            return await self.generate_plot(statement, self._owner(request))
+
+        async def generate_range_plot(preset, start, end, freq, request: gr.Request):
+            return await self.generate_range_plot(preset, start, end, freq, self._owner(request))
+
+        async def chat(question, statement, show_result, request: gr.Request):
+            async for answer in self.chat(question, statement, show_result, self._owner(request)):
+                yield answer
+
+        async def display_sample(sample, statement, show_result, request: gr.Request):
+            async for update in self.display_sample(sample, statement, show_result, self._owner(request)):
+                yield update
+
+        async def generate_panels(statement, known, request: gr.Request):
+            return await self.generate_panels(statement, known, self._owner(request))
+
+        async def generate_range_panels(preset, start, end, freq, known, request: gr.Request):
+            return await self.generate_range_panels(preset, start, end, freq, known, self._owner(request))
+
+        def new_conversation(statement, request: gr.Request):
+            return self.new_conversation(statement, self._owner(request))
+
         with gr.Blocks() as self.demo:
             gr.Markdown(f"""
             <div style="text-align: center;">  
@@ -49,36 +301,97 @@ class SpendWiseApp:
                             choices=["Upload a new file", "Choose from existing"], label="Select Action"
                         )
                         upload_button = gr.UploadButton("Upload a new file", visible=False)
-                        upload_button.upload(self.processor.upload_file, inputs=[upload_button])
-
+                        upload_status = gr.Textbox(label="Upload progress", interactive=False, visible=False)
+                        upload_job = gr.State(None)
+                        cancel_button = gr.Button("Cancel upload", visible=False)
                         dropdown = gr.Dropdown(
-                            choices=["july", "august", "uploaded_file"],
+                            choices=SAMPLE_STATEMENTS,
                             label="Choose from existing",
                             visible=False,
                             interactive=True,
                         )
+                        # Progress polling is cheap; the ingest itself is bounded by the job pool
+                        upload_button.upload(
+                            upload_file,
+                            inputs=[upload_button],
+                            outputs=[upload_status, upload_job, dropdown],
+                            concurrency_limit=None,
+                            concurrency_id="upload",
+                        )
+                        cancel_button.click(self.cancel_upload, inputs=[upload_job], outputs=[upload_status])
                         generate_plot_btn = gr.Button("Submit")
 
                         choice_button.change(
-                            self.toggle_visibility, inputs=[choice_button], outputs=[upload_button, dropdown]
+                            self.toggle_visibility,
+                            inputs=[choice_button],
+                            outputs=[upload_button, dropdown, upload_status, cancel_button],
                         )
 
-                    with gr.Row():
-                        output_plot = gr.Plot(label="Analytics Dashboard")
+                    if self.split_dashboard:
+                        # Digests of the panels this session shows, so unchanged ones aren't sent again
+                        panel_digests = gr.State({})
+                        panel_plots = []
+                        for row in (1, 2):
+                            with gr.Row():
+                                panel_plots += [gr.Plot(label=title) for _, title, panel_row, _, _ in PANELS
+                                                if panel_row == row]
                         generate_plot_btn.click(
-                                fn=self.plot_generator.generate_plot,
-                                inputs=[dropdown],  # Use the dropdown input for generating the plot
-                                outputs=[output_plot],
+                                fn=generate_panels,
+                                inputs=[dropdown, panel_digests],
+                                outputs=panel_plots + [panel_digests],
+                                concurrency_limit=self.dashboard_concurrency,
+                                concurrency_id="dashboard",
                         )
+                    else:
+                        with gr.Row():
+                            output_plot = gr.Plot(label="Analytics Dashboard")
+                            generate_plot_btn.click(
+                                    fn=generate_plot,
+                                    inputs=[dropdown],  # Use the dropdown input for generating the plot
+                                    outputs=[output_plot],
+                                    concurrency_limit=self.dashboard_concurrency,
+                                    concurrency_id="dashboard",
+                            )
+
+                    gr.Markdown("### Or analyze a date range across all your statements")
+                    with gr.Row():
+                        range_preset = gr.Dropdown(choices=RANGE_CHOICES, value="all_time", label="Date range")
+                        range_start = gr.Textbox(label="From (YYYY-MM-DD, custom dates only)")
+                        range_end = gr.Textbox(label="To (YYYY-MM-DD, custom dates only)")
+                        range_freq = gr.Radio(choices=["day", "week", "month"], value="day", label="Group by")
+                        range_button = gr.Button("Show range")
+                        if self.split_dashboard:
+                            range_button.click(
+                                fn=generate_range_panels,
+                                inputs=[range_preset, range_start, range_end, range_freq, panel_digests],
+                                outputs=panel_plots + [panel_digests],
+                                concurrency_limit=self.dashboard_concurrency,
+                                concurrency_id="dashboard",
+                            )
+                        else:
+                            range_button.click(
+                                fn=generate_range_plot,
+                                inputs=[range_preset, range_start, range_end, range_freq],
+                                outputs=[output_plot],
+                                concurrency_limit=self.dashboard_concurrency,
+                                concurrency_id="dashboard",
+                            )
 
                 # Chatbot Tab
                 with gr.Tab("Chat"):
                     gr.Markdown("### Ask SpendWise")
                     text_input = gr.Textbox(label="Enter text here")
+                    show_result = gr.Checkbox(label="Show the SQL result before the answer", value=False)
                     text_output = gr.Textbox(label="Output")
                     text_button = gr.Button("Submit")
+                    new_conversation_button = gr.Button("New conversation")
+                    new_conversation_button.click(new_conversation, inputs=[dropdown], outputs=[text_input, text_output])
                     text_button.click(
-                        fn=self.spendwise_instance.run, inputs=[text_input, dropdown], outputs=text_output
+                        fn=chat,
+                        inputs=[text_input, dropdown, show_result],
+                        outputs=text_output,
+                        concurrency_limit=self.chat_concurrency,
+                        concurrency_id="chat",
                     )
 
                     gr.Markdown("<h3>Sample Questions:</h3>")
@@ -92,13 +405,36 @@ class SpendWiseApp:
                     for sample in samples:
                         sample_button = gr.Button(sample)
                         sample_button.click(
-                            fn=self.display_sample,
-                            inputs=[gr.State(sample), dropdown],  # Pass sample as state and dropdown as input
+                            fn=display_sample,
+                            inputs=[gr.State(sample), dropdown, show_result],  # Pass sample as state and dropdown as input
                             outputs=[text_input, text_output],
+                            concurrency_limit=self.chat_concurrency,
+                            concurrency_id="chat",
                         )
 
+                if self.show_metrics:
+                    with gr.Tab("Metrics"):
+                        refresh_button = gr.Button("Refresh")
+                        metrics_json = gr.JSON(label="Counters, stage timings and recent traces")
+                        prometheus_text = gr.Code(label="Prometheus format")
+                        refresh_button.click(self.metrics_report, outputs=[metrics_json, prometheus_text])
+                        with gr.Row():
+                            profile_chat = gr.Button("Profile the next chat request")
+                            profile_upload = gr.Button("Profile the next upload")
+                            show_profile = gr.Button("Show the last profile")
+                        profile_output = gr.Textbox(label="Profile", lines=20)
+                        profile_chat.click(lambda: self.profile_next("chat"), outputs=[profile_output])
+                        profile_upload.click(lambda: self.profile_next("upload"), outputs=[profile_output])
+                        show_profile.click(self.last_profile, outputs=[profile_output])
+
+            # Each session sees the samples plus the statements in its own catalog
+            self.demo.load(refresh_statements, outputs=[dropdown])
+
     def launch(self):
+        self.ingest_samples()
         self.build_interface()
+        # Each event group has its own concurrency_id and limit; everything else shares the default
+        self.demo.queue(max_size=self.max_queue_size, default_concurrency_limit=self.dashboard_concurrency)
         self.demo.launch(share=True)
 
 
@@ -0,0 +1,259 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from apps.statement_catalog import StatementCatalog
+from apps.statement_files import write_statement
+from apps.tracing import metrics, span
+from apps.upload_file import PDFProcessor, _parse_statement
+
+
+def find_statements(inputs):
+    """
+    Expand directories and glob patterns into statement PDFs.
+
+    Args:
+        inputs (iterable): Files, directories (searched recursively) or glob patterns.
+
+    Returns:
+        list: Paths of the PDFs found, sorted, without duplicates.
+    """
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(glob.glob(os.path.join(item, "**", "*.pdf"), recursive=True))
+            paths.extend(glob.glob(os.path.join(item, "**", "*.PDF"), recursive=True))
+        elif glob.has_magic(item):
+            paths.extend(glob.glob(item, recursive=True))
+        elif os.path.isfile(item):
+            paths.append(item)
+        else:
+            logging.warning(f"No statement found at '{item}'.")
+    return sorted({os.path.abspath(path) for path in paths if os.path.isfile(path)})
+
+
+def _parse_file(path):
+    """Parse one statement in a worker process; errors are returned rather than raised."""
+    try:
+        csv_path, df = _parse_statement(path)
+    except Exception as e:
+        return path, None, None, f"{type(e).__name__}: {e}"
+    if df is None:
+        return path, None, None, "No tables found in the PDF."
+    if df.empty:
+        return path, None, None, "No transactions found in the PDF."
+    return path, csv_path, df, None
+
+
+class BatchIngester:
+    """
+    Backfills many statements into the expenses database at once.
+
+    Statements are parsed across a process pool, their merchants are
+    deduplicated across the whole batch and categorized once (merchant cache,
+    local classifier, then the LLM for the rest), and the transactions are
+    bulk-loaded in transactions of ``commit_every`` statements.
+
+    Re-running the same batch resumes it: statements are recognized by the
+    SHA-256 of their PDF, so those committed by an earlier run, even an
+    interrupted one, are skipped without being parsed again. Statements are
+    named after that hash too, as uploads are, so files sharing a name in
+    different directories stay separate statements, and each one is added to
+    ``owner``'s statement catalog so it shows up in the app.
+    """
+
+    def __init__(self, processor=None, workers=None, commit_every=50, write_files=True, owner="local",
+                 catalog=None):
+        """
+        Initialize the ingester.
+
+        Args:
+            processor (PDFProcessor): Processor whose store, merchant cache and
+                classifiers are used; defaults to one on ``expenses.db``.
+            workers (int): Parsing processes; defaults to the CPU count.
+            commit_every (int): Statements loaded per database transaction.
+            write_files (bool): Write each statement's categorized file next to its
+                PDF, as single uploads do.
+            owner (str): Catalog owner the statements are listed for, i.e. the user name
+                they log in to the app with.
+            catalog (StatementCatalog): Catalog to register them in; defaults to the one in
+                the processor's database.
+        """
+        self.processor = processor or PDFProcessor()
+        self.store = self.processor.store
+        self.workers = workers or os.cpu_count() or 1
+        self.commit_every = max(commit_every, 1)
+        self.write_files = write_files
+        self.owner = owner
+        self.catalog = catalog or StatementCatalog(self.store.db_path)
+
+    def _register(self, path):
+        """List a statement in the owner's catalog; repeated calls for the same file are no-ops."""
+        return self.catalog.add(self.owner, path)["statement"]
+
+    def _pending(self, paths, report):
+        """Hash the statements and drop those already ingested or repeated in the batch."""
+        pending, seen = [], {}
+        for path in paths:
+            file_hash = self.store.file_hash(path)
+            if file_hash in seen:
+                report["duplicates"].append({"path": path, "same_as": seen[file_hash]})
+            elif self.store.is_ingested(file_hash):
+                # Still listed, in case an earlier run stopped between loading and registering it
+                self._register(path)
+                report["skipped"].append(path)
+            else:
+                pending.append((path, file_hash))
+            seen.setdefault(file_hash, path)
+        return pending
+
+    def _parse_all(self, pending, report):
+        """Parse the pending statements across the process pool, in completion order."""
+        hashes = dict(pending)
+        parsed = []
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(pending))) as executor:
+            futures = [executor.submit(_parse_file, path) for path, _ in pending]
+            for done, future in enumerate(as_completed(futures), start=1):
+                path, csv_path, df, error = future.result()
+                if error:
+                    report["failed"].append({"path": path, "error": error})
+                    logging.warning(f"Could not parse '{path}': {error}")
+                else:
+                    parsed.append((path, hashes[path], csv_path, df))
+                if done % 10 == 0 or done == len(futures):
+                    logging.info(f"Parsed {done} of {len(futures)} statements.")
+        # Load in input order, so the report does not depend on which worker finished first
+        order = {path: i for i, (path, _) in enumerate(pending)}
+        return sorted(parsed, key=lambda item: order[item[0]])
+
+    def _load(self, parsed, category_map, report):
+        """Categorize and bulk-load parsed statements, commit_every per transaction."""
+        for start in range(0, len(parsed), self.commit_every):
+            chunk = parsed[start:start + self.commit_every]
+            items = []
+            for path, file_hash, _, df in chunk:
+                statement = StatementCatalog.statement_name(file_hash)
+                items.append((self.processor.apply_categories(df, category_map), statement, file_hash,
+                              os.path.basename(path)))
+            with span("bulk_load", statements=len(items)) as current:
+                added = self.store.ingest_many(items)
+                current.set(rows=sum(added))
+            metrics.inc("rows_ingested", sum(added))
+            metrics.inc("statements_ingested", len(items))
+
+            for (path, _, csv_path, df), (_, statement, _, _), count in zip(chunk, items, added):
+                report["ingested"].append({"path": path, "statement": statement, "rows": len(df), "added": count})
+                report["rows_added"] += count
+                self._register(path)
+                if self.write_files:
+                    write_statement(self.store.read_statement(statement), csv_path, self.processor.storage_format)
+            logging.info(f"Committed {start + len(chunk)} of {len(parsed)} statements "
+                         f"({report['rows_added']} transactions so far).")
+
+    def run(self, paths):
+        """
+        Ingest a batch of statements.
+
+        Args:
+            paths (list): Statement PDFs, e.g. from find_statements.
+
+        Returns:
+            dict: Summary report: ingested, skipped, duplicate and failed
+            statements, transactions added, merchant categorization counts and
+            seconds spent per phase.
+        """
+        report = {"found": len(paths), "ingested": [], "skipped": [], "duplicates": [], "failed": [],
+                  "rows_added": 0, "merchants": {}, "seconds": {}}
+        started = time.perf_counter()
+        with span("batch_ingest", files=len(paths)):
+            phase = time.perf_counter()
+            pending = self._pending(paths, report)
+            report["seconds"]["hash"] = time.perf_counter() - phase
+            logging.info(f"{len(pending)} of {len(paths)} statements to ingest, "
+                         f"{len(report['skipped'])} already ingested, {len(report['duplicates'])} duplicates.")
+            if pending:
+                phase = time.perf_counter()
+                parsed = self._parse_all(pending, report)
+                report["seconds"]["parse"] = time.perf_counter() - phase
+
+                phase = time.perf_counter()
+                merchants = list(dict.fromkeys(m for _, _, _, df in parsed for m in df["Merchant"].dropna()))
+                category_map = self.processor.categorize_merchants(merchants)
+                report["merchants"] = {"unique": len(merchants), "categorized": len(category_map),
+                                       "uncategorized": len(merchants) - len(category_map)}
+                report["seconds"]["categorize"] = time.perf_counter() - phase
+
+                phase = time.perf_counter()
+                self._load(parsed, category_map, report)
+                report["seconds"]["load"] = time.perf_counter() - phase
+        report["seconds"]["total"] = time.perf_counter() - started
+        return report
+
+
+def format_report(report):
+    """
+    Render a batch report as text.
+
+    Args:
+        report (dict): Result of BatchIngester.run.
+
+    Returns:
+        str: Summary lines followed by any failures.
+    """
+    seconds = report["seconds"]
+    merchants = report["merchants"]
+    lines = [
+        f"Statements found:     {report['found']}",
+        f"Ingested:             {len(report['ingested'])} ({report['rows_added']:,} transactions added)",
+        f"Already ingested:     {len(report['skipped'])}",
+        f"Duplicates in batch:  {len(report['duplicates'])}",
+        f"Failed:               {len(report['failed'])}",
+    ]
+    if merchants:
+        lines.append(f"Merchants:            {merchants['unique']} unique, {merchants['categorized']} categorized, "
+                     f"{merchants['uncategorized']} uncategorized")
+    lines.append("Time:                 " + ", ".join(f"{phase} {value:.1f}s" for phase, value in seconds.items()))
+    if report["ingested"] and seconds.get("total"):
+        lines.append(f"Throughput:           {len(report['ingested']) / seconds['total']:.1f} statements/s")
+    for failure in report["failed"]:
+        lines.append(f"  FAILED {failure['path']}: {failure['error']}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backfill many statement PDFs into the expenses database.")
+    parser.add_argument("inputs", nargs="+", help="Statement PDFs, directories or glob patterns.")
+    parser.add_argument("--db", default="expenses.db", help="SQLite database to load into.")
+    parser.add_argument("--workers", type=int, default=None, help="Parsing processes; defaults to the CPU count.")
+    parser.add_argument("--commit-every", type=int, default=50, help="Statements per database transaction.")
+    parser.add_argument("--storage-format", default="csv", choices=["csv", "parquet", "feather"])
+    parser.add_argument("--no-files", action="store_true", help="Skip writing per-statement files.")
+    parser.add_argument("--llm-backend", default=None, help="LLM backend for merchants classified remotely.")
+    parser.add_argument("--owner", default="local",
+                        help="User the statements are listed for in the app (their login name).")
+    parser.add_argument("--report", help="Write the summary report as JSON to this path.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    paths = find_statements(args.inputs)
+    if not paths:
+        parser.error("no statement PDFs found")
+
+    processor = PDFProcessor(db_path=args.db, storage_format=args.storage_format, llm_backend=args.llm_backend)
+    ingester = BatchIngester(processor, workers=args.workers, commit_every=args.commit_every,
+                             write_files=not args.no_files, owner=args.owner)
+    report = ingester.run(paths)
+    print(format_report(report))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
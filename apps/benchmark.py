@@ -0,0 +1,403 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from apps.clients import STUB_MODEL, LLMBackend
+from apps.llm_stub import StubLLMServer
+from apps.synthetic import make_raw_statement, make_transactions, write_statement_pdf
+
+# Transactions per size; PDFs are kept smaller since pdfplumber reads a few pages a second.
+# The tiny size matches the bundled 15-row sample statements.
+SIZES = {
+    "tiny": {"rows": 15, "pdf_rows": 15},
+    "small": {"rows": 10_000, "pdf_rows": 400},
+    "medium": {"rows": 100_000, "pdf_rows": 2_000},
+    "large": {"rows": 1_000_000, "pdf_rows": 12_000},
+}
+ROWS_PER_PAGE = 40
+STATEMENT = "bench"
+# Questions whose SQL comes from the templates, so execute_query runs without an LLM
+QUESTIONS = [
+    "Total expenditure pls?",
+    "Give me a summary report of my expenses",
+    "What was my biggest purchase",
+    "How much did I spend on groceries?",
+]
+BASELINE_PATH = "benchmark_baseline.json"
+
+
+class BenchmarkContext:
+    """
+    Synthetic inputs for one size, generated on first use and shared by the cases.
+    """
+
+    def __init__(self, size, workdir, seed=0, llm_backend=None, workers=None):
+        """
+        Args:
+            size (str): One of SIZES.
+            workdir (str): Directory for generated files and databases.
+            seed (int): Random seed for the generators.
+            llm_backend (LLMBackend): Backend classifying merchants, normally a StubLLMServer.
+            workers (int): Page-extraction processes; None extracts in-process.
+        """
+        self.size = size
+        self.rows = SIZES[size]["rows"]
+        self.pdf_rows = SIZES[size]["pdf_rows"]
+        self.pdf_pages = -(-self.pdf_rows // ROWS_PER_PAGE)
+        self.workdir = workdir
+        self.seed = seed
+        self.llm_backend = llm_backend
+        self.workers = workers
+        self._cache = {}
+        self._runs = 0
+
+    def _fixture(self, name, build):
+        if name not in self._cache:
+            self._cache[name] = build()
+        return self._cache[name]
+
+    def fresh_dir(self):
+        """A new empty directory for one run."""
+        self._runs += 1
+        path = os.path.join(self.workdir, f"{self.size}-run{self._runs}")
+        os.makedirs(path)
+        return path
+
+    def transactions(self):
+        return self._fixture("transactions", lambda: make_transactions(self.rows, seed=self.seed))
+
+    def raw_statement(self):
+        return self._fixture("raw", lambda: make_raw_statement(self.rows, seed=self.seed))
+
+    def pdf(self):
+        def build():
+            path = os.path.join(self.workdir, f"{self.size}.pdf")
+            write_statement_pdf(path, self.pdf_rows, ROWS_PER_PAGE, seed=self.seed)
+            return path
+        return self._fixture("pdf", build)
+
+    def category_map(self, rows=None):
+        tx = make_transactions(rows, seed=self.seed) if rows else self.transactions()
+        return dict(zip(tx["Merchant"], tx["Category_freetext"]))
+
+    def database(self):
+        """SQLite database holding the transactions under the statement STATEMENT."""
+        def build():
+            from apps.expense_store import ExpenseStore
+
+            path = os.path.join(self.workdir, f"{self.size}.db")
+            df = self.transactions().copy()
+            df["Date"] = df["Date"].dt.strftime("%Y-%m-%d")
+            ExpenseStore(path).ingest(df, STATEMENT, f"{self.size}-{self.seed}")
+            return path
+        return self._fixture("database", build)
+
+    def processor(self, db_path):
+        """PDFProcessor whose LLM calls go to the benchmark's LLM backend."""
+        from apps.upload_file import PDFProcessor
+
+        return PDFProcessor(db_path=db_path, extract_workers=self.workers, llm_backend=self.llm_backend)
+
+
+def _extract(ctx):
+    from apps.upload_file import PDFProcessor
+
+    path = os.path.join(ctx.fresh_dir(), "statement.pdf")
+    shutil.copy(ctx.pdf(), path)
+
+    def run():
+        PDFProcessor.extract_table_from_pdf(path, workers=ctx.workers)
+        return ctx.pdf_pages
+    return run
+
+
+def _parse(ctx):
+    from apps.upload_file import PDFProcessor
+
+    raw = ctx.raw_statement()
+    return lambda: len(PDFProcessor.parse_transactions(raw))
+
+
+def _categorize(ctx):
+    processor = ctx.processor(os.path.join(ctx.fresh_dir(), "expenses.db"))
+    merchants = list(ctx.transactions()["Merchant"].str.lower().unique())
+    return lambda: len(processor.classify_merchants(merchants))
+
+
+def _sqlite_write(ctx):
+    directory = ctx.fresh_dir()
+    processor = ctx.processor(os.path.join(directory, "expenses.db"))
+    df = ctx.transactions().drop(columns=["Category_freetext", "Category"])
+    category_map = ctx.category_map()
+    pdf_path = os.path.join(directory, "statement.pdf")
+    csv_path = os.path.join(directory, "statement.csv")
+    return lambda: processor._store_statement(df.copy(), category_map, csv_path, pdf_path, f"{ctx.size}-{ctx.seed}")
+
+
+def _ingest(ctx):
+    directory = ctx.fresh_dir()
+    processor = ctx.processor(os.path.join(directory, "expenses.db"))
+    path = os.path.join(directory, "statement.pdf")
+    shutil.copy(ctx.pdf(), path)
+    return lambda: processor.generate_sqldb(path)
+
+
+def _execute_query(ctx):
+    from apps.question_router import rule_based_sql
+    from apps.run_chain import SpendWise
+
+    spendwise = SpendWise(db_path=f"sqlite:///{ctx.database()}")
+    queries = [rule_based_sql(question, STATEMENT) for question in QUESTIONS]
+    spendwise.executor.run("SELECT 1")  # open the read-only connection outside the timed run
+
+    def run():
+        for query in queries:
+            result = spendwise.execute_query(query)
+            if result.startswith("Error"):
+                raise RuntimeError(result)
+        return len(queries)
+    return run
+
+
+def _generate_plot(ctx):
+    from apps.generate_plot import PlotGenerator
+
+    # A new generator per run, so the figure cache is cold
+    plot_generator = PlotGenerator(file_mapping={}, statement_mapping={STATEMENT: STATEMENT}, db_path=ctx.database())
+
+    def run():
+        plot_generator.generate_plot(STATEMENT)
+        return ctx.rows
+    return run
+
+
+def _range_plot(ctx):
+    from apps.generate_plot import PlotGenerator
+
+    plot_generator = PlotGenerator(file_mapping={}, statement_mapping={}, db_path=ctx.database())
+
+    def run():
+        plot_generator.generate_range_plot(preset="all_time", freq="week")
+        return ctx.rows
+    return run
+
+
+# Case name -> (unit of work, setup returning the timed callable); the callable returns units processed
+CASES = {
+    "extract": ("pages", _extract),
+    "parse": ("rows", _parse),
+    "categorize": ("merchants", _categorize),
+    "sqlite_write": ("rows", _sqlite_write),
+    "ingest": ("rows", _ingest),
+    "execute_query": ("queries", _execute_query),
+    "generate_plot": ("rows", _generate_plot),
+    "range_plot": ("rows", _range_plot),
+}
+
+
+def measure(case, ctx, repeat=5, warmup=1):
+    """
+    Time one case.
+
+    Every run gets fresh state from the case's setup, which is not timed. Peak
+    memory comes from one extra run under tracemalloc, so tracing does not
+    slow the timed runs; it only covers this process, not extraction workers.
+
+    Args:
+        case (str): One of CASES.
+        ctx (BenchmarkContext): Inputs for the size being measured.
+        repeat (int): Timed runs.
+        warmup (int): Untimed runs before the timed ones.
+
+    Returns:
+        dict: unit, units per run, latency percentiles in seconds, throughput
+        in units per second and peak traced memory in MiB.
+    """
+    unit, setup = CASES[case]
+    for _ in range(warmup):
+        setup(ctx)()
+
+    latencies = []
+    for _ in range(repeat):
+        run = setup(ctx)
+        gc.collect()
+        start = time.perf_counter()
+        units = run()
+        latencies.append(time.perf_counter() - start)
+
+    run = setup(ctx)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "unit": unit,
+        "units": units,
+        "runs": repeat,
+        "p50": p50,
+        "p95": p95,
+        "p99": p99,
+        "min": min(latencies),
+        "max": max(latencies),
+        "throughput": units / p50 if p50 else float("inf"),
+        "peak_mib": peak / 2 ** 20,
+    }
+
+
+def run_benchmarks(sizes=("tiny", "small"), cases=None, repeat=5, warmup=1, seed=0, llm_latency=0.05,
+                   workers=None, workdir=None):
+    """
+    Run the benchmark cases over synthetic statements of the given sizes.
+
+    Args:
+        sizes (iterable): Names from SIZES.
+        cases (iterable): Names from CASES; None runs all of them.
+        repeat (int): Timed runs per case.
+        warmup (int): Untimed runs per case.
+        seed (int): Random seed for the generators.
+        llm_latency (float): Seconds the local LLM stub takes per classification request.
+        workers (int): Page-extraction processes; None extracts in-process.
+        workdir (str): Directory for generated files; a temporary one by default.
+
+    Returns:
+        dict: "meta" describing the run and "results" keyed "case/size".
+    """
+    cases = list(cases or CASES)
+    own_workdir = workdir is None
+    workdir = workdir or tempfile.mkdtemp(prefix="spendwise-bench-")
+    results = {}
+    stub = StubLLMServer(port=0, latency=llm_latency, seed=seed).start()
+    backend = LLMBackend("benchmark-stub", stub.base_url, STUB_MODEL)
+    try:
+        for size in sizes:
+            ctx = BenchmarkContext(size, os.path.join(workdir, size), seed, backend, workers)
+            os.makedirs(ctx.workdir, exist_ok=True)
+            for case in cases:
+                try:
+                    results[f"{case}/{size}"] = measure(case, ctx, repeat, warmup)
+                except ImportError as e:
+                    results[f"{case}/{size}"] = {"skipped": f"missing dependency: {e.name}"}
+    finally:
+        stub.stop()
+        if own_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "seed": seed,
+            "llm_latency": llm_latency,
+            "workers": workers,
+        },
+        "results": results,
+    }
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    Find regressions against a baseline.
+
+    Args:
+        results (dict): Output of run_benchmarks.
+        baseline (dict): Earlier output of run_benchmarks.
+        tolerance (float): Allowed relative increase of median latency and peak memory.
+
+    Returns:
+        list: One message per regression.
+    """
+    regressions = []
+    for key, current in results["results"].items():
+        previous = baseline["results"].get(key)
+        if not previous or "skipped" in current or "skipped" in previous:
+            continue
+        if current["p50"] > previous["p50"] * (1 + tolerance):
+            regressions.append(
+                f"{key}: median {current['p50'] * 1000:.1f}ms vs baseline {previous['p50'] * 1000:.1f}ms "
+                f"(+{current['p50'] / previous['p50'] - 1:.0%})"
+            )
+        # Ignore sub-MiB noise in peak memory
+        if current["peak_mib"] > previous["peak_mib"] * (1 + tolerance) + 1:
+            regressions.append(
+                f"{key}: peak memory {current['peak_mib']:.1f}MiB vs baseline {previous['peak_mib']:.1f}MiB"
+            )
+    return regressions
+
+
+def format_report(results):
+    """
+    Format results as a table.
+
+    Args:
+        results (dict): Output of run_benchmarks.
+
+    Returns:
+        str: One line per case and size.
+    """
+    lines = [f"{'case/size':<26}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'throughput':>22}{'peak MiB':>10}"]
+    for key, result in results["results"].items():
+        if "skipped" in result:
+            lines.append(f"{key:<26}  skipped: {result['skipped']}")
+            continue
+        throughput = f"{result['throughput']:,.1f} {result['unit']}/s"
+        lines.append(
+            f"{key:<26}{result['p50'] * 1000:>10.1f}{result['p95'] * 1000:>10.1f}{result['p99'] * 1000:>10.1f}"
+            f"{throughput:>22}{result['peak_mib']:>10.1f}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark SpendWise ingestion, query and dashboard paths offline.")
+    parser.add_argument("--sizes", default="tiny,small", help=f"Comma-separated sizes from {', '.join(SIZES)}.")
+    parser.add_argument("--cases", default=",".join(CASES), help=f"Comma-separated cases from {', '.join(CASES)}.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Seconds per stubbed LLM request.")
+    parser.add_argument("--workers", type=int, default=None, help="Page-extraction processes.")
+    parser.add_argument("--output", help="Write the results as JSON to this path.")
+    parser.add_argument("--save-baseline", nargs="?", const=BASELINE_PATH, help="Save the results as the baseline.")
+    parser.add_argument("--baseline", nargs="?", const=BASELINE_PATH, help="Compare against this baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown before flagging.")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(
+        sizes=args.sizes.split(","), cases=args.cases.split(","), repeat=args.repeat, warmup=args.warmup,
+        seed=args.seed, llm_latency=args.llm_latency, workers=args.workers,
+    )
+    print(format_report(results))
+
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions:")
+            print("\n".join(f"  {line}" for line in regressions))
+            return 1
+        print(f"\nNo regressions against {args.baseline}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
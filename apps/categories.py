@@ -0,0 +1,4 @@
+CATEGORIES = [
+    'fitness', 'groceries', 'restaurants and cafes', 'healthcare', 'clothing', 'jewelry',
+    'transportation', 'phone and internet', 'miscellaneous', 'others', 'e-commerce', 'food delivery'
+]
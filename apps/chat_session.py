@@ -0,0 +1,184 @@
+import re
+
+from apps.question_router import normalize_question
+from apps.tracing import span, tracer
+
+# Openings and references that make a question depend on the ones before it
+FOLLOW_UP_PATTERN = re.compile(
+    r"^(and|but|also|so|then|now|ok|okay|what about|how about|same|only|just|instead|compared)\b"
+    r"|\b(that|those|these|them|it|its|same|previous|earlier|instead|again|else|other)\b"
+)
+
+
+def is_follow_up(question):
+    """
+    Whether a question reads as a follow-up to the previous ones, e.g. "and in August?".
+
+    Args:
+        question (str): The user's question.
+
+    Returns:
+        bool: True if the question refers back to the conversation.
+    """
+    return bool(FOLLOW_UP_PATTERN.search(question.lower().strip()))
+
+
+def _shorten(text, max_chars):
+    text = " ".join(str(text).split())
+    return text if len(text) <= max_chars else text[:max_chars - 3] + "..."
+
+
+class ChatSession:
+    """
+    A conversation about a user's statements, kept around a shared SpendWise instance.
+
+    Standalone questions are answered from the statement the session was
+    started on. A follow-up that names another of the user's statements, such
+    as "and in August?", is answered from that statement, with the earlier
+    turns still in context, and further follow-ups stay on it; the reply then
+    says which statement it used.
+
+    The last ``max_turns`` questions are kept with the SQL and answer they got;
+    older turns are folded into a short running summary of what was asked, so
+    the context sent with follow-ups stays bounded however long the
+    conversation runs. Standalone questions are sent without any context, so
+    they keep using SpendWise's SQL templates and cache, and the table's cached
+    system prompt comes first in every request.
+    """
+
+    def __init__(self, spendwise, table_name, statements=None, max_turns=4, max_summary_chars=600,
+                 max_answer_chars=300):
+        """
+        Initialize the session.
+
+        Args:
+            spendwise (SpendWise): Shared chatbot that generates and runs the SQL.
+            table_name (str): Statement the conversation starts on, and standalone questions use.
+            statements (dict): Statements follow-ups may move to, by label, e.g. {"august": "august"}.
+            max_turns (int): Turns kept verbatim in the context.
+            max_summary_chars (int): Longest summary of the older turns.
+            max_answer_chars (int): Longest answer quoted from a previous turn.
+        """
+        self.spendwise = spendwise
+        self.table_name = table_name
+        self.statements = statements or {}
+        self.max_turns = max_turns
+        self.max_summary_chars = max_summary_chars
+        self.max_answer_chars = max_answer_chars
+        self.turns = []
+        self.summary = ""
+
+    def _summarize(self, turn):
+        """Fold a turn leaving the window into the summary, dropping the oldest entries past the limit."""
+        entries = self.summary.split(" | ") if self.summary else []
+        entries.append(f"{_shorten(turn['question'], 120)} -> {_shorten(turn['sql'], 200)}")
+        while len(entries) > 1 and len(" | ".join(entries)) > self.max_summary_chars:
+            entries.pop(0)
+        self.summary = " | ".join(entries)
+
+    def _remember(self, question, statement, sql_query, answer):
+        self.turns.append({"question": question, "statement": statement, "sql": sql_query, "answer": answer})
+        while len(self.turns) > self.max_turns:
+            self._summarize(self.turns.pop(0))
+
+    def _statement_for(self, question):
+        """
+        Statement to answer a question from.
+
+        Standalone questions use the session's statement. A follow-up uses the statement it
+        names by label, else the one the previous turn used.
+        """
+        if not self.turns or not is_follow_up(question):
+            return self.table_name
+        words = f" {normalize_question(question)} "
+        for label, statement in self.statements.items():
+            if f" {normalize_question(label)} " in words:
+                return statement
+        return self.turns[-1]["statement"]
+
+    def _note(self, statement):
+        """Line telling the user that an answer came from another statement than the selected one."""
+        if statement == self.table_name:
+            return ""
+        label = next((label for label, value in self.statements.items() if value == statement), statement)
+        return f"(From your {label} statement.)\n\n"
+
+    def _context(self, question):
+        """
+        Context messages for a question: (SQL context, answer context), both None for standalone questions.
+
+        The SQL context replays earlier questions with the SQL they got, so the LLM can adjust the
+        last query; the answer context replays them with the answers.
+        """
+        if not (self.turns or self.summary) or not is_follow_up(question):
+            return None, None
+        from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+        earlier = [SystemMessage(content=f"Earlier questions and their SQL: {self.summary}")] if self.summary else []
+        sql_context, answer_context = list(earlier), list(earlier)
+        for turn in self.turns:
+            sql_context += [HumanMessage(content=f"Question: {turn['question']}\nAnswer:"),
+                            AIMessage(content=turn["sql"])]
+            answer_context += [HumanMessage(content=f"Question: {turn['question']}"),
+                               AIMessage(content=_shorten(turn["answer"], self.max_answer_chars))]
+        return sql_context, answer_context
+
+    def ask(self, question):
+        """
+        Answer a question in the context of the conversation.
+
+        Args:
+            question (str): The user's question.
+
+        Returns:
+            str: The answer.
+        """
+        statement = self._statement_for(question)
+        sql_context, answer_context = self._context(question)
+        with span("chat", table=statement, follow_up=sql_context is not None):
+            sql_query = self.spendwise.generate_sql_query(question, statement, sql_context)
+            result = self.spendwise.execute_query(sql_query, statement)
+            answer = self.spendwise.generate_answer(question, result, answer_context)
+        self._remember(question, statement, sql_query, answer)
+        return self._note(statement) + answer
+
+    async def aask(self, question):
+        """Async counterpart of ask."""
+        statement = self._statement_for(question)
+        sql_context, answer_context = self._context(question)
+        with span("chat", table=statement, follow_up=sql_context is not None):
+            sql_query = await self.spendwise.agenerate_sql_query(question, statement, sql_context)
+            result = await self.spendwise.aexecute_query(sql_query, statement)
+            answer = await self.spendwise.agenerate_answer(question, result, answer_context)
+        self._remember(question, statement, sql_query, answer)
+        return self._note(statement) + answer
+
+    async def aask_stream(self, question, show_result=False):
+        """
+        Answer a question in the context of the conversation, yielding the answer text so far
+        each time a token arrives, as SpendWise.arun_stream does.
+
+        The turn is only remembered once the answer is complete.
+        """
+        statement = self._statement_for(question)
+        sql_context, answer_context = self._context(question)
+        trace = tracer.start("chat", table=statement, follow_up=sql_context is not None)
+        error = None
+        try:
+            with tracer.activate(trace):
+                sql_query = await self.spendwise.agenerate_sql_query(question, statement, sql_context)
+                result = await self.spendwise.aexecute_query(sql_query, statement)
+            prefix = self._note(statement) + (f"SQL result: {result}\n\n" if show_result else "")
+            if prefix:
+                yield prefix
+            answer = ""
+            async for token in self.spendwise.astream_answer(question, result, parent=trace,
+                                                             context=answer_context):
+                answer += token
+                yield prefix + answer
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            tracer.finish(trace, error)
+        self._remember(question, statement, sql_query, answer)
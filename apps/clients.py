@@ -0,0 +1,161 @@
+import os
+import threading
+
+AI71_BASE_URL = "https://api.ai71.ai/v1/"
+DEFAULT_MODEL = "tiiuae/falcon-180B-chat"
+# Address apps.llm_stub listens on by default
+STUB_BASE_URL = "http://127.0.0.1:8971/v1/"
+STUB_MODEL = "spendwise-stub"
+
+_lock = threading.Lock()
+_env_loaded = False
+_llms = {}
+_databases = {}
+
+
+class LLMBackend:
+    """
+    An OpenAI-compatible chat completions endpoint: where it is, which model
+    to ask for and which environment variable holds its API key.
+    """
+
+    def __init__(self, name, base_url, model, api_key_env=None):
+        """
+        Args:
+            name (str): Name the backend is selected by.
+            base_url (str): API root, ending in a slash, e.g. ``https://api.ai71.ai/v1/``.
+            model (str): Model requested from the endpoint.
+            api_key_env (str): Environment variable holding the API key; None for
+                endpoints without authentication.
+        """
+        self.name = name
+        self.base_url = base_url
+        self.model = model
+        self.api_key_env = api_key_env
+
+    @property
+    def chat_url(self):
+        """Chat completions endpoint."""
+        return self.base_url + "chat/completions"
+
+    @property
+    def api_key(self):
+        """API key from the environment; local endpoints get a placeholder, as OpenAI clients require one."""
+        load_env()
+        return os.getenv(self.api_key_env) if self.api_key_env else "local"
+
+
+BACKENDS = {
+    "ai71": LLMBackend("ai71", AI71_BASE_URL, DEFAULT_MODEL, "AI71_API_KEY"),
+    "stub": LLMBackend("stub", STUB_BASE_URL, STUB_MODEL),
+}
+
+
+def register_backend(backend):
+    """
+    Make a backend selectable by name, replacing any backend of the same name.
+
+    Args:
+        backend (LLMBackend): The backend.
+    """
+    with _lock:
+        BACKENDS[backend.name] = backend
+        for key in [key for key in _llms if key[0] == backend.name]:
+            del _llms[key]
+
+
+def get_backend(backend=None):
+    """
+    Resolve the LLM backend to use.
+
+    Args:
+        backend (str | LLMBackend): A backend, or the name of a registered one.
+            Defaults to the ``SPENDWISE_LLM_BACKEND`` environment variable, then ``ai71``.
+            ``SPENDWISE_LLM_BASE_URL`` points the stub backend at another address.
+
+    Returns:
+        LLMBackend: The backend.
+
+    Raises:
+        ValueError: If no backend has that name.
+    """
+    if isinstance(backend, LLMBackend):
+        return backend
+    load_env()
+    name = backend or os.getenv("SPENDWISE_LLM_BACKEND", "ai71")
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown LLM backend: {name}. Choose from {', '.join(BACKENDS)}.")
+    if name == "stub" and os.getenv("SPENDWISE_LLM_BASE_URL"):
+        return LLMBackend(name, os.getenv("SPENDWISE_LLM_BASE_URL"), BACKENDS[name].model)
+    return BACKENDS[name]
+
+
+def load_env():
+    """Loads the .env file once per process."""
+    global _env_loaded
+    if _env_loaded:
+        return
+    with _lock:
+        if not _env_loaded:
+            from dotenv import load_dotenv
+            load_dotenv()
+            _env_loaded = True
+
+
+def get_llm(model=None, temperature=0, backend=None):
+    """
+    Returns the process-wide chat model client, creating it on first use.
+
+    Args:
+        model (str): Model name served by the backend; defaults to the backend's model.
+        temperature (float): Sampling temperature.
+        backend (str | LLMBackend): Backend to talk to; see get_backend.
+
+    Returns:
+        ChatOpenAI: Shared client for this backend, model and temperature.
+    """
+    backend = get_backend(backend)
+    model = model or backend.model
+    key = (backend.name, backend.base_url, model, temperature)
+    llm = _llms.get(key)
+    if llm is None:
+        from langchain_openai import ChatOpenAI
+        with _lock:
+            llm = _llms.get(key)
+            if llm is None:
+                llm = ChatOpenAI(
+                    model=model,
+                    api_key=backend.api_key,
+                    base_url=backend.base_url,
+                    temperature=temperature,
+                )
+                _llms[key] = llm
+    return llm
+
+
+def get_sql_database(db_uri="sqlite:///expenses.db"):
+    """
+    Returns the process-wide SQLDatabase for a URI, creating it on first use.
+
+    Tables are reflected lazily, since the chat only runs raw SQL against it.
+
+    Args:
+        db_uri (str): SQLAlchemy database URI.
+
+    Returns:
+        SQLDatabase: Shared handle on the database.
+    """
+    db = _databases.get(db_uri)
+    if db is None:
+        from langchain_community.utilities import SQLDatabase
+        from sqlalchemy import create_engine, event
+        from apps.expense_store import ExpenseStore
+        with _lock:
+            db = _databases.get(db_uri)
+            if db is None:
+                engine = create_engine(db_uri)
+                if engine.dialect.name == "sqlite":
+                    event.listen(engine, "connect", ExpenseStore.configure_connection)
+                db = SQLDatabase(engine, lazy_table_reflection=True)
+                _databases[db_uri] = db
+    return db
@@ -0,0 +1,468 @@
+import hashlib
+import logging
+import sqlite3
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+
+class ExpenseStore:
+    """
+    Unified transactions table in the expenses SQLite database.
+
+    Every statement is appended to one typed, indexed ``transactions`` table
+    tagged with its statement name and month, and a view named after the
+    statement keeps the per-statement tables the chat queries working.
+    Statements are recorded by the SHA-256 of their PDF so that re-uploading
+    one is a no-op, and transactions are deduplicated on their natural key
+    within their statement, so statements that overlap each keep all their rows.
+    Daily, category, merchant and location totals per statement are kept in
+    rollup tables that are refreshed with every ingest, so the dashboard never
+    has to scan raw transactions.
+    The schema version lives in ``PRAGMA user_version``; opening an older
+    database migrates it, including tables written by ``DataFrame.to_sql``.
+    """
+
+    TABLE = "transactions"
+    STATEMENTS_TABLE = "ingested_statements"
+    SCHEMA_VERSION = 4
+    COLUMN_TYPES = {
+        "Statement": "TEXT NOT NULL",
+        "Month": "TEXT NOT NULL",
+        "Transaction ID": "TEXT",
+        "Merchant": "TEXT",
+        "Location": "TEXT",
+        # ISO dates sort and compare correctly as text and work with SQLite's date functions
+        "Date": "TEXT NOT NULL CHECK (Date GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]')",
+        "Amount": "REAL NOT NULL",
+        "Category_freetext": "TEXT",
+        "Category": "TEXT",
+    }
+    COLUMNS = list(COLUMN_TYPES)
+    VIEW_COLUMNS = ["Merchant", "Location", "Date", "Amount", "Category_freetext", "Category"]
+    NATURAL_KEY = ["Statement", "Transaction ID", "Date", "Amount"]
+    INDEXES = {
+        "idx_transactions_category": ["Category_freetext", "Amount"],
+        "idx_transactions_merchant": ["Merchant"],
+        "idx_transactions_date": ["Date"],
+        "idx_transactions_location": ["Location"],
+        "idx_transactions_statement": ["Statement", "Date"],
+        "idx_transactions_statement_category": ["Statement", "Category_freetext", "Amount"],
+    }
+    # Rollup table -> grouping column; each holds per-statement totals
+    ROLLUPS = {
+        "rollup_daily": "Date",
+        "rollup_category": "Category_freetext",
+        "rollup_merchant": "Merchant",
+        "rollup_location": "Location",
+    }
+    PRAGMAS = [
+        ("journal_mode", "WAL"),
+        ("synchronous", "NORMAL"),
+        ("temp_store", "MEMORY"),
+        ("cache_size", -16000),
+        ("mmap_size", 64 * 1024 * 1024),
+        ("busy_timeout", 5000),
+    ]
+
+    def __init__(self, db_path='expenses.db'):
+        """
+        Initialize the store, creating or migrating its schema if needed.
+
+        Args:
+            db_path (str): Path to the SQLite database.
+        """
+        self.db_path = db_path
+        with self._connect() as conn:
+            self._ensure_schema(conn)
+
+    @classmethod
+    def configure_connection(cls, conn, *args):
+        """
+        Apply the store's pragmas to a new SQLite connection.
+
+        Usable directly or as a SQLAlchemy ``connect`` event listener.
+
+        Args:
+            conn: A DB-API SQLite connection.
+        """
+        cursor = conn.cursor()
+        for name, value in cls.PRAGMAS:
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path)
+        self.configure_connection(conn)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _quote(name):
+        return '"' + name.replace('"', '""') + '"'
+
+    def _table_exists(self, conn, name):
+        return conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+        ).fetchone() is not None
+
+    def _create_transactions_table(self, conn, name):
+        columns = ", ".join(f"{self._quote(c)} {t}" for c, t in self.COLUMN_TYPES.items())
+        key = ", ".join(self._quote(c) for c in self.NATURAL_KEY)
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {name} ({columns}, UNIQUE ({key}))")
+
+    def _create_view(self, conn, statement):
+        view_columns = ", ".join(self._quote(c) for c in self.VIEW_COLUMNS)
+        literal = "'" + statement.replace("'", "''") + "'"
+        conn.execute(
+            f"CREATE VIEW IF NOT EXISTS {self._quote(statement)} AS "
+            f"SELECT {view_columns} FROM {self.TABLE} WHERE Statement = {literal}"
+        )
+
+    def _ensure_schema(self, conn):
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < self.SCHEMA_VERSION and self._table_exists(conn, self.TABLE):
+            self._rebuild_transactions_table(conn)
+        self._create_transactions_table(conn, self.TABLE)
+        for name, columns in self.INDEXES.items():
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS {name} ON {self.TABLE} ({', '.join(self._quote(c) for c in columns)})"
+            )
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.STATEMENTS_TABLE} ("
+            "file_hash TEXT PRIMARY KEY, statement TEXT NOT NULL, file_name TEXT, "
+            "rows_added INTEGER NOT NULL, ingested_at REAL NOT NULL)"
+        )
+        for table, column in self.ROLLUPS.items():
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} (Statement TEXT NOT NULL, {self._quote(column)} TEXT NOT NULL, "
+                f"Amount REAL NOT NULL, Transactions INTEGER NOT NULL, PRIMARY KEY (Statement, {self._quote(column)}))"
+            )
+        if version < self.SCHEMA_VERSION:
+            self._migrate_legacy_tables(conn)
+            statements = [row[0] for row in conn.execute(f"SELECT DISTINCT Statement FROM {self.TABLE}")]
+            self._refresh_rollups(conn, statements)
+            conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+            conn.execute("ANALYZE")
+
+    def _rebuild_transactions_table(self, conn):
+        """Copy an older transactions table into the current schema, types and natural key."""
+        views = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'view' AND sql LIKE ?",
+            (f"%FROM {self.TABLE} WHERE Statement =%",)
+        )]
+        for view in views:
+            conn.execute(f"DROP VIEW {self._quote(view)}")
+
+        self._create_transactions_table(conn, f"{self.TABLE}_typed")
+        columns = ", ".join(self._quote(c) for c in self.COLUMNS)
+        conn.execute(
+            f"INSERT OR IGNORE INTO {self.TABLE}_typed ({columns}) "
+            "SELECT Statement, COALESCE(Month, substr(Date, 1, 7)), \"Transaction ID\", Merchant, Location, "
+            "substr(Date, 1, 10), CAST(Amount AS REAL), Category_freetext, Category "
+            f"FROM {self.TABLE} WHERE Amount IS NOT NULL AND Date IS NOT NULL"
+        )
+        conn.execute(f"DROP TABLE {self.TABLE}")
+        conn.execute(f"ALTER TABLE {self.TABLE}_typed RENAME TO {self.TABLE}")
+
+        for view in views:
+            self._create_view(conn, view)
+        logging.info(f"Migrated '{self.TABLE}' to schema version {self.SCHEMA_VERSION}.")
+
+    def _migrate_legacy_tables(self, conn):
+        """Fold every pre-existing per-statement table into the unified table."""
+        for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall():
+            if name.startswith("sqlite_"):
+                continue
+            columns = {row[1] for row in conn.execute(f"PRAGMA table_info({self._quote(name)})")}
+            if {"Merchant", "Date", "Amount"} <= columns and "Statement" not in columns:
+                self._adopt_legacy_table(conn, name)
+
+    @staticmethod
+    def file_hash(file_path, chunk_size=1 << 20):
+        """
+        Compute the SHA-256 of a file's content.
+
+        Args:
+            file_path (str): Path to the file.
+            chunk_size (int): Bytes read at a time.
+
+        Returns:
+            str: Hex digest of the file.
+        """
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def is_ingested(self, file_hash):
+        """
+        Check whether a statement with this content hash was already ingested.
+
+        Args:
+            file_hash (str): SHA-256 of the statement PDF.
+
+        Returns:
+            bool: True if the statement is already in the store.
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                f"SELECT 1 FROM {self.STATEMENTS_TABLE} WHERE file_hash = ?", (file_hash,)
+            ).fetchone()
+        return row is not None
+
+    def _adopt_legacy_table(self, conn, statement):
+        """Move rows of a pre-existing per-statement table into the unified table."""
+        if not self._table_exists(conn, statement):
+            return
+        legacy = pd.read_sql_query(f"SELECT * FROM {self._quote(statement)}", conn)
+        legacy = legacy.reindex(columns=self.COLUMNS)
+        legacy['Statement'] = statement
+        legacy['Date'] = pd.to_datetime(legacy['Date'], format='mixed').dt.strftime('%Y-%m-%d')
+        legacy['Month'] = legacy['Date'].str[:7]
+        self._insert(conn, legacy)
+        conn.execute(f"DROP TABLE {self._quote(statement)}")
+        self._create_view(conn, statement)
+        logging.info(f"Migrated legacy table '{statement}' into '{self.TABLE}'.")
+
+    def _refresh_rollups(self, conn, statements):
+        """Recompute the rollup rows of the given statements from their transactions."""
+        for statement in statements:
+            for table, column in self.ROLLUPS.items():
+                key = self._quote(column)
+                conn.execute(f"DELETE FROM {table} WHERE Statement = ?", (statement,))
+                conn.execute(
+                    f"INSERT INTO {table} (Statement, {key}, Amount, Transactions) "
+                    f"SELECT Statement, {key}, SUM(Amount), COUNT(*) FROM {self.TABLE} "
+                    f"WHERE Statement = ? AND {key} IS NOT NULL GROUP BY {key}",
+                    (statement,)
+                )
+
+    def _insert(self, conn, df):
+        placeholders = ", ".join("?" * len(self.COLUMNS))
+        rows = df[self.COLUMNS].astype(object).where(df[self.COLUMNS].notna(), None).itertuples(index=False)
+        before = conn.total_changes
+        conn.executemany(f"INSERT OR IGNORE INTO {self.TABLE} VALUES ({placeholders})", rows)
+        return conn.total_changes - before
+
+    def ingest(self, df, statement, file_hash, file_name=None):
+        """
+        Append a parsed, categorized statement in a single transaction.
+
+        Transactions whose natural key is already stored for the statement are skipped, and the
+        statement's hash is recorded in the same transaction.
+
+        Args:
+            df (pd.DataFrame): Parsed transactions with categories.
+            statement (str): Statement name; also the name of its view.
+            file_hash (str): SHA-256 of the statement PDF.
+            file_name (str): Original file name, kept for reference.
+
+        Returns:
+            int: Number of transactions added.
+        """
+        return self.ingest_many([(df, statement, file_hash, file_name)])[0]
+
+    def _ingest(self, conn, df, statement, file_hash, file_name):
+        df = df.copy()
+        df['Statement'] = statement
+        dates = pd.to_datetime(df['Date'])
+        df['Date'] = dates.dt.strftime('%Y-%m-%d')
+        df['Month'] = dates.dt.strftime('%Y-%m')
+        df = df.reindex(columns=self.COLUMNS)
+
+        self._adopt_legacy_table(conn, statement)
+        added = self._insert(conn, df)
+        self._create_view(conn, statement)
+        conn.execute(
+            f"INSERT OR REPLACE INTO {self.STATEMENTS_TABLE} VALUES (?, ?, ?, ?, ?)",
+            (file_hash, statement, file_name, added, time.time())
+        )
+        return added
+
+    def ingest_many(self, statements):
+        """
+        Append several parsed, categorized statements in a single transaction.
+
+        Used for bulk loads: the rollups of every statement that gained rows
+        are refreshed once, at the end, and either all statements are stored
+        or none are.
+
+        Args:
+            statements (iterable): (df, statement, file_hash, file_name) tuples,
+                as the arguments of ingest.
+
+        Returns:
+            list: Number of transactions added per statement.
+        """
+        statements = list(statements)
+        added = []
+        with self._connect() as conn:
+            for df, statement, file_hash, file_name in statements:
+                added.append(self._ingest(conn, df, statement, file_hash, file_name))
+            changed = list(dict.fromkeys(
+                statement for (_, statement, _, _), count in zip(statements, added) if count
+            ))
+            self._refresh_rollups(conn, changed)
+            conn.execute("PRAGMA optimize")
+        return added
+
+    def read_statement(self, statement):
+        """
+        Read all transactions of a statement.
+
+        Args:
+            statement (str): Statement name.
+
+        Returns:
+            pd.DataFrame: The statement's transactions, oldest first.
+        """
+        view_columns = ", ".join(self._quote(c) for c in self.VIEW_COLUMNS)
+        with self._connect() as conn:
+            return pd.read_sql_query(
+                f"SELECT {view_columns} FROM {self.TABLE} WHERE Statement = ? ORDER BY Date, rowid",
+                conn, params=(statement,)
+            )
+
+    def read_rollups(self, statement):
+        """
+        Read the pre-aggregated totals of a statement.
+
+        Args:
+            statement (str): Statement name.
+
+        Returns:
+            dict: Rollup name ("daily", "category", "merchant", "location") ->
+            Series of amounts indexed by the grouping column, or None if the
+            statement has no transactions in the store.
+        """
+        rollups = {}
+        with self._connect() as conn:
+            for table, column in self.ROLLUPS.items():
+                frame = pd.read_sql_query(
+                    f"SELECT {self._quote(column)}, Amount FROM {table} WHERE Statement = ? "
+                    f"ORDER BY {self._quote(column)}",
+                    conn, params=(statement,)
+                )
+                rollups[table[len("rollup_"):]] = frame.set_index(column)['Amount']
+        if rollups["daily"].empty:
+            return None
+        rollups["daily"].index = pd.to_datetime(rollups["daily"].index)
+        return rollups
+
+    def read_range(self, start=None, end=None, statements=None):
+        """
+        Aggregate the transactions of a date range across statements.
+
+        Daily totals come from the daily rollup; the other totals are grouped
+        in SQL over the date-indexed transactions table.
+
+        Args:
+            start (str): First ISO date included, or None for no lower bound.
+            end (str): Last ISO date included, or None for no upper bound.
+            statements (list): Statements to include; None includes all of them.
+
+        Returns:
+            dict: Same keys and Series as read_rollups, or None if the range
+            has no transactions.
+        """
+        conditions, params = [], []
+        if start is not None:
+            conditions.append("Date >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append("Date <= ?")
+            params.append(end)
+        if statements is not None:
+            if not statements:
+                return None
+            conditions.append(f"Statement IN ({', '.join('?' * len(statements))})")
+            params.extend(statements)
+        where = " AND ".join(conditions) or "1"
+
+        totals = {}
+        with self._connect() as conn:
+            for table, column in self.ROLLUPS.items():
+                key = self._quote(column)
+                source = table if column == "Date" else self.TABLE
+                frame = pd.read_sql_query(
+                    f"SELECT {key}, SUM(Amount) AS Amount FROM {source} "
+                    f"WHERE {where} AND {key} IS NOT NULL GROUP BY {key} ORDER BY {key}",
+                    conn, params=params
+                )
+                totals[table[len("rollup_"):]] = frame.set_index(column)['Amount']
+        if totals["daily"].empty:
+            return None
+        totals["daily"].index = pd.to_datetime(totals["daily"].index)
+        return totals
+
+    def date_bounds(self, statements=None):
+        """
+        Find the first and last transaction dates.
+
+        Args:
+            statements (list): Statements to include; None includes all of them.
+
+        Returns:
+            tuple: (first, last) ISO dates, or (None, None) if there are no transactions.
+        """
+        query, params = "SELECT MIN(Date), MAX(Date) FROM rollup_daily", []
+        if statements is not None:
+            if not statements:
+                return None, None
+            query += f" WHERE Statement IN ({', '.join('?' * len(statements))})"
+            params = list(statements)
+        with self._connect() as conn:
+            return conn.execute(query, params).fetchone()
+
+    def version(self, statements=None):
+        """
+        Identify the current contents of several statements, for cache keys.
+
+        Args:
+            statements (list): Statements to include; None includes all of them.
+
+        Returns:
+            tuple: Changes whenever any of their transactions change.
+        """
+        rollup_where = statements_where = ""
+        params = []
+        if statements is not None:
+            placeholders = ", ".join("?" * len(statements))
+            rollup_where = f" WHERE Statement IN ({placeholders})"
+            statements_where = f" WHERE statement IN ({placeholders})"
+            params = list(statements)
+        with self._connect() as conn:
+            count = conn.execute("SELECT SUM(Transactions) FROM rollup_daily" + rollup_where, params).fetchone()[0]
+            ingests, last_ingested = conn.execute(
+                f"SELECT COUNT(*), MAX(ingested_at) FROM {self.STATEMENTS_TABLE}" + statements_where, params
+            ).fetchone()
+        return count, ingests, last_ingested
+
+    def statement_version(self, statement):
+        """
+        Identify the current contents of a statement, for cache keys.
+
+        Args:
+            statement (str): Statement name.
+
+        Returns:
+            tuple: Changes whenever the statement's transactions change, or
+            None if the statement has no transactions in the store.
+        """
+        with self._connect() as conn:
+            count = conn.execute(
+                "SELECT SUM(Transactions) FROM rollup_daily WHERE Statement = ?", (statement,)
+            ).fetchone()[0]
+            if not count:
+                return None
+            ingests, last_ingested = conn.execute(
+                f"SELECT COUNT(*), MAX(ingested_at) FROM {self.STATEMENTS_TABLE} WHERE statement = ?", (statement,)
+            ).fetchone()
+        return count, ingests, last_ingested
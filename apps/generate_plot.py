@@ -1,115 +1,481 @@
+import asyncio
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
 import pandas as pd
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
+from apps.expense_store import ExpenseStore
+from apps.statement_catalog import StatementCatalog
+from apps.statement_files import DASHBOARD_COLUMNS, find_statement, read_statement
+
+# Resampling rules for the Date vs Amount panel
+FREQUENCIES = {"day": "D", "week": "W", "month": "MS"}
+# Named date ranges accepted by range_totals and generate_range_plot
+RANGE_PRESETS = ["last_30_days", "last_quarter", "year_to_date", "last_12_months", "all_time"]
+# Dashboard panels, in the order of the figure's subplots, as (name, title, row, col, subplot type)
+PANELS = [
+    ("amount_over_time", "Date vs Amount", 1, 1, "xy"),
+    ("total", "Total Expenditure", 1, 2, "indicator"),
+    ("categories", "Category-wise Amount Spent", 1, 3, "domain"),
+    ("merchants", "Merchant-wise Amount Spent", 2, 1, "xy"),
+    ("average_daily", "Average Daily Spending", 2, 2, "indicator"),
+    ("locations", "Location-wise Amount Spent", 2, 3, "xy"),
+]
+
+
+def lttb(x, y, threshold):
+    """
+    Picks the points of a series to keep with Largest-Triangle-Three-Buckets downsampling.
+    The first and last points are kept, and from each bucket in between the point forming the
+    largest triangle with the previously kept point and the next bucket's average, which keeps
+    the series' peaks and dips.
+    :param x: Increasing x values (numeric array).
+    :param y: y values (numeric array).
+    :param threshold: Number of points to keep.
+    :return: Indices of the kept points, increasing.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    # threshold - 2 buckets between the first and last points
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, stop = edges[i], edges[i + 1]
+        next_stop = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[stop:next_stop].mean(), y[stop:next_stop].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:stop] - y[a]) - (x[a] - x[start:stop]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        kept[i + 1] = a
+    return kept
 
 
 class PlotGenerator:
-    def __init__(self, file_mapping=None):
+    def __init__(self, file_mapping=None, statement_mapping=None, db_path="expenses.db", cache_size=32,
+                 max_points=500):
         """
         Initializes the PlotGenerator with a file mapping.
         :param file_mapping: Dictionary mapping months to file paths.
+        :param statement_mapping: Dictionary mapping months to statements in the expenses database.
+        :param db_path: Path to the SQLite database holding the rollup tables.
+        :param cache_size: Number of built figures kept in the LRU cache.
+        :param max_points: Most points sent for the Date vs Amount panel; longer series are
+            downsampled with LTTB, so the figure's size stops growing with the data's history.
         """
         self.file_mapping = file_mapping or {
             "july": "./data/bank_statement_july.csv",
             "august": "./data/bank_statement_august.csv",
             "uploaded_file": "./upload_data/new_file.csv"
         }
+        self.statement_mapping = statement_mapping or {
+            "july": "bank_statement_july",
+            "august": "bank_statement_august",
+            "uploaded_file": "new_file"
+        }
+        self.db_path = db_path
+        self._store = None
+        self.cache_size = cache_size
+        self.max_points = max_points
+        self._figure_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
 
-    def _read_csv(self, file_name):
+    def _read_statement(self, file_name):
         """
-        Reads a CSV file and ensures the 'Date' column is in datetime format.
-        :param file_name: Path to the CSV file.
+        Reads the dashboard columns of a statement file (CSV, Parquet or Feather) with 'Date' as datetimes.
+        :param file_name: Path to the statement file.
         :return: DataFrame with processed data.
         """
         try:
-            data = pd.read_csv(file_name)
-            data['Date'] = pd.to_datetime(data['Date'])
-            return data
+            return read_statement(file_name, columns=DASHBOARD_COLUMNS)
         except FileNotFoundError:
             raise FileNotFoundError(f"File {file_name} not found.")
         except Exception as e:
             raise ValueError(f"Error reading file: {e}")
 
+    @staticmethod
+    def _aggregate(data):
+        """
+        Computes the dashboard totals from raw transactions.
+        :param data: DataFrame of transactions.
+        :return: Dictionary of Series keyed like ExpenseStore.read_rollups.
+        """
+        return {
+            "daily": data.groupby(data['Date'].dt.normalize())['Amount'].sum(),
+            "category": data.groupby('Category_freetext')['Amount'].sum(),
+            "merchant": data.groupby('Merchant')['Amount'].sum(),
+            "location": data.groupby('Location')['Amount'].sum(),
+        }
+
+    def _get_store(self):
+        """
+        Opens the expenses database on first use.
+        :return: ExpenseStore.
+        """
+        if self._store is None:
+            self._store = ExpenseStore(self.db_path)
+        return self._store
+
+    def _statement(self, month):
+        """
+        Maps a dropdown entry to its statement in the expenses database.
+        :param month: The month selected from the dropdown (str), or the name of an uploaded statement.
+        :return: Statement name, or None if the entry has no statement.
+        """
+        statement = self.statement_mapping.get(month)
+        if statement is None and StatementCatalog.is_statement(month):
+            statement = month
+        return statement
+
+    def _data_version(self, month):
+        """
+        Identifies the data behind a dropdown entry: the statement's version in the expenses
+        database when it has been ingested, and its file's mtime and size otherwise. A Parquet or
+        Feather copy next to the CSV file is preferred when it is up to date.
+        :param month: The month selected from the dropdown (str), or the name of an uploaded statement.
+        :return: Hashable tuple whose first item is "db" or "file".
+        """
+        statement = self._statement(month)
+        if statement and os.path.exists(self.db_path):
+            version = self._get_store().statement_version(statement)
+            if version is not None:
+                return ("db", statement, version)
+
+        file_name = self.file_mapping.get(month)
+        if not file_name and statement == month:
+            raise ValueError(f"Statement {month} has not finished ingesting.")
+        if not file_name:
+            raise ValueError("Invalid month selected or no file uploaded.")
+        file_name = find_statement(file_name)
+        try:
+            stat = os.stat(file_name)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"File {file_name} not found.")
+        return ("file", file_name, stat.st_mtime_ns, stat.st_size)
+
+    def _load_totals(self, version):
+        """
+        Loads the dashboard totals, from the rollup tables when the statement has been ingested
+        and from its statement file otherwise.
+        :param version: Data version returned by _data_version.
+        :return: Dictionary of Series with daily, category, merchant and location totals.
+        """
+        if version[0] == "db":
+            rollups = self._store.read_rollups(version[1])
+            if rollups is not None:
+                return rollups
+            raise ValueError(f"No transactions found for statement {version[1]}.")
+        return self._aggregate(self._read_statement(version[1]))
+
+    def invalidate(self, month=None):
+        """
+        Drops cached figures.
+        :param month: Only drop the figures of this dropdown entry; None clears the cache.
+        """
+        with self._cache_lock:
+            if month is None:
+                self._figure_cache.clear()
+            else:
+                for key in [key for key in self._figure_cache if key[0] == month]:
+                    del self._figure_cache[key]
+
     def generate_plot(self, month=None):
         """
         Generates a plot based on the selected month or uploaded file.
         :param month: The month selected from the dropdown (str).
         :return: Plotly figure object.
+        Figures are cached per dropdown entry and data version, so repeated renders of
+        unchanged data skip the rebuild.
         """
-        file_name = self.file_mapping.get(month)
-        if not file_name:
-            raise ValueError("Invalid month selected or no file uploaded.")
+        key = (month, self._data_version(month))
+        return self._cached_figure(key, lambda: self._build_figure(month, self._load_totals(key[1])))
 
-        data = self._read_csv(file_name)
+    def generate_panels(self, month=None, known=None):
+        """
+        Generates the dashboard as six separate figures, so a UI can update only the panels whose
+        data changed instead of resending the whole dashboard.
+        :param month: The month selected from the dropdown (str).
+        :param known: Dictionary of panel name to digest, as returned by an earlier call, for the
+            panels the caller already shows.
+        :return: (panels, digests): dictionaries keyed by the names in PANELS, of each panel's figure,
+            or None where it matches the known digest, and of each panel's digest.
+        """
+        key = (month, self._data_version(month), "panels")
+        panels = self._cached_figure(key, lambda: self._build_panels(self._load_totals(key[1])))
+        return self._changed_panels(panels, known)
 
-        # Create a subplot figure with 2 rows and 3 columns
-        fig = make_subplots(
-            rows=2, cols=3,
-            subplot_titles=(
-                "Date vs Amount",
-                "Total Expenditure",
-                "Category-wise Amount Spent",
-                "Merchant-wise Amount Spent",
-                "Average Daily Spending",
-                "Location-wise Amount Spent"
-            ),
-            specs=[[{"type": "xy"}, {"type": "indicator"}, {"type": "domain"}],  # First row
-                   [{"type": "xy"}, {"type": "indicator"}, {"type": "xy"}]]  # Second row
-        )
+    def _cached_figure(self, key, build):
+        """
+        Returns the cached figure for a key, building and caching it on a miss.
+        :param key: Hashable cache key that includes the data version.
+        :param build: Callable returning the figure.
+        :return: Plotly figure object.
+        """
+        with self._cache_lock:
+            if key in self._figure_cache:
+                self._figure_cache.move_to_end(key)
+                return self._figure_cache[key]
 
-        # Plot 1: Line Graph - Date vs Amount
-        fig.add_trace(
-            go.Scatter(x=data['Date'], y=data['Amount'], mode='lines+markers', name='Amount'),
-            row=1, col=1
-        )
+        fig = build()
+        with self._cache_lock:
+            self._figure_cache[key] = fig
+            self._figure_cache.move_to_end(key)
+            while len(self._figure_cache) > self.cache_size:
+                self._figure_cache.popitem(last=False)
+        return fig
+
+    async def agenerate_plot(self, month=None):
+        """
+        Generates the plot in a worker thread so the event loop stays free.
+        :param month: The month selected from the dropdown (str).
+        :return: Plotly figure object.
+        """
+        return await asyncio.to_thread(self.generate_plot, month)
+
+    @staticmethod
+    def preset_range(preset, anchor):
+        """
+        Turns a named date range into dates.
+        :param preset: One of RANGE_PRESETS.
+        :param anchor: Date the range is relative to, e.g. today or the latest transaction.
+        :return: (start, end) Timestamps, both included; None for an open end.
+        """
+        anchor = pd.Timestamp(anchor).normalize()
+        if preset == "all_time":
+            return None, None
+        if preset == "last_30_days":
+            return anchor - pd.Timedelta(days=29), anchor
+        if preset == "last_quarter":
+            quarter = anchor.to_period("Q") - 1
+            return quarter.start_time, quarter.end_time.normalize()
+        if preset == "year_to_date":
+            return pd.Timestamp(year=anchor.year, month=1, day=1), anchor
+        if preset == "last_12_months":
+            return anchor - pd.DateOffset(years=1) + pd.Timedelta(days=1), anchor
+        raise ValueError(f"Unknown date range: {preset}")
+
+    def _range_query(self, start=None, end=None, months=None, preset=None, today=None):
+        """
+        Resolves a range request into statements and ISO date bounds.
+        :param start: First date included (str or Timestamp), or None.
+        :param end: Last date included (str or Timestamp), or None.
+        :param months: Dropdown entries to include; None includes every ingested statement.
+        :param preset: One of RANGE_PRESETS; overrides start and end.
+        :param today: Anchor for the preset; defaults to the latest transaction, so historical statements work.
+        :return: (statements, start, end) with dates as ISO strings or None.
+        """
+        store = self._get_store()
+        statements = None
+        if months is not None:
+            statements = [statement for statement in map(self._statement, months) if statement]
+        if preset:
+            anchor = today or store.date_bounds(statements)[1]
+            if anchor is None:
+                raise ValueError("No transactions have been ingested yet.")
+            start, end = self.preset_range(preset, anchor)
+        start = pd.Timestamp(start).strftime("%Y-%m-%d") if start else None
+        end = pd.Timestamp(end).strftime("%Y-%m-%d") if end else None
+        return statements, start, end
+
+    def _range_totals(self, statements, start, end):
+        """
+        Aggregates resolved range bounds; see range_totals.
+        """
+        store = self._get_store()
+        totals = store.read_range(start, end, statements)
+        if totals is None:
+            raise ValueError("No transactions in this date range.")
+        first, last = store.date_bounds(statements)
+        span_start = max(pd.Timestamp(start or first), pd.Timestamp(first))
+        span_end = min(pd.Timestamp(end or last), pd.Timestamp(last))
+        totals["span_days"] = (span_end - span_start).days + 1
+        totals["title"] = f"{span_start:%Y-%m-%d} to {span_end:%Y-%m-%d}"
+        return totals
+
+    def range_totals(self, start=None, end=None, months=None, preset=None, today=None):
+        """
+        Aggregates a date range across ingested statements, e.g. last quarter or year to date.
+        Totals are grouped in SQL over the unified transactions table rather than per file.
+        :param start: First date included (str or Timestamp), or None.
+        :param end: Last date included (str or Timestamp), or None.
+        :param months: Dropdown entries to include; None includes every ingested statement.
+        :param preset: One of RANGE_PRESETS; overrides start and end.
+        :param today: Anchor for the preset; defaults to the latest transaction.
+        :return: Dictionary of Series like _load_totals, plus "span_days", the days from the first to
+            the last day of the range that has data, which averages are taken over, and "title".
+        """
+        return self._range_totals(*self._range_query(start, end, months, preset, today))
+
+    def generate_range_plot(self, start=None, end=None, months=None, preset=None, freq="day", today=None):
+        """
+        Generates the dashboard for a date range across statements.
+        :param start: First date included (str or Timestamp), or None.
+        :param end: Last date included (str or Timestamp), or None.
+        :param months: Dropdown entries to include; None includes every ingested statement.
+        :param preset: One of RANGE_PRESETS; overrides start and end.
+        :param freq: Resampling of the Date vs Amount panel: "day", "week" or "month".
+        :param today: Anchor for the preset; defaults to the latest transaction.
+        :return: Plotly figure object.
+        """
+        key, load = self._range_request(start, end, months, preset, freq, today)
+
+        def build():
+            totals = load()
+            return self._build_figure(totals["title"], totals, freq=freq, span_days=totals["span_days"])
+        return self._cached_figure(key, build)
+
+    def generate_range_panels(self, start=None, end=None, months=None, preset=None, freq="day", today=None,
+                              known=None):
+        """
+        Generates the range dashboard as six separate figures; see generate_panels.
+        :param start: First date included (str or Timestamp), or None.
+        :param end: Last date included (str or Timestamp), or None.
+        :param months: Dropdown entries to include; None includes every ingested statement.
+        :param preset: One of RANGE_PRESETS; overrides start and end.
+        :param freq: Resampling of the Date vs Amount panel: "day", "week" or "month".
+        :param today: Anchor for the preset; defaults to the latest transaction.
+        :param known: Dictionary of panel name to digest of the panels the caller already shows.
+        :return: (panels, digests) as in generate_panels.
+        """
+        key, load = self._range_request(start, end, months, preset, freq, today)
+
+        def build():
+            totals = load()
+            return self._build_panels(totals, freq=freq, span_days=totals["span_days"])
+        return self._changed_panels(self._cached_figure(key + ("panels",), build), known)
+
+    def _range_request(self, start, end, months, preset, freq, today):
+        """
+        Resolves a range request into its cache key and a loader of its totals.
+        :return: (key, load) where load() returns the totals of range_totals.
+        """
+        if freq not in FREQUENCIES:
+            raise ValueError(f"Unknown frequency: {freq}")
+        statements, start, end = self._range_query(start, end, months, preset, today)
+        key = ("range", start, end, None if statements is None else tuple(statements), freq,
+               self._get_store().version(statements))
+        return key, lambda: self._range_totals(statements, start, end)
+
+    async def agenerate_range_plot(self, start=None, end=None, months=None, preset=None, freq="day"):
+        """
+        Generates the range dashboard in a worker thread so the event loop stays free.
+        :param start: First date included (str or Timestamp), or None.
+        :param end: Last date included (str or Timestamp), or None.
+        :param months: Dropdown entries to include; None includes every ingested statement.
+        :param preset: One of RANGE_PRESETS; overrides start and end.
+        :param freq: Resampling of the Date vs Amount panel: "day", "week" or "month".
+        :return: Plotly figure object.
+        """
+        return await asyncio.to_thread(self.generate_range_plot, start, end, months, preset, freq)
+
+    async def agenerate_panels(self, month=None, known=None):
+        """
+        Generates the dashboard panels in a worker thread so the event loop stays free.
+        :param month: The month selected from the dropdown (str).
+        :param known: Dictionary of panel name to digest of the panels the caller already shows.
+        :return: (panels, digests) as in generate_panels.
+        """
+        return await asyncio.to_thread(self.generate_panels, month, known)
+
+    async def agenerate_range_panels(self, start=None, end=None, months=None, preset=None, freq="day", known=None):
+        """
+        Generates the range dashboard panels in a worker thread so the event loop stays free.
+        :return: (panels, digests) as in generate_range_panels.
+        """
+        return await asyncio.to_thread(self.generate_range_panels, start, end, months, preset, freq, None, known)
+
+    def _amounts(self, daily_totals, freq):
+        """
+        The Date vs Amount series: daily, weekly or monthly totals, downsampled with LTTB past
+        max_points and rounded to the fils.
+        :param daily_totals: Series of daily totals indexed by date.
+        :param freq: "day", "week" or "month".
+        :return: (Series, whether it was downsampled).
+        """
+        amounts = daily_totals if freq == "day" else daily_totals.resample(FREQUENCIES[freq]).sum()
+        downsampled = len(amounts) > self.max_points
+        if downsampled:
+            days = (amounts.index - amounts.index[0]) / pd.Timedelta(days=1)
+            amounts = amounts.iloc[lttb(days, amounts.values, self.max_points)]
+        return amounts.round(2), downsampled
+
+    def _panel_traces(self, totals, freq="day", span_days=None):
+        """
+        Builds the trace of each dashboard panel.
+        :param totals: Dictionary of Series with daily, category, merchant and location totals.
+        :param freq: Resampling of the Date vs Amount panel: "day", "week" or "month".
+        :param span_days: Days the average daily spending is taken over; defaults to the days from the
+            first to the last transaction.
+        :return: List of traces in the order of PANELS.
+        """
+        import plotly.graph_objects as go
+
+        daily_totals = totals["daily"]
+
+        # Plot 1: Line Graph - Date vs Amount (daily, weekly or monthly totals)
+        amounts, downsampled = self._amounts(daily_totals, freq)
+        amount_trace = go.Scatter(x=amounts.index, y=amounts.values, mode='lines' if downsampled else 'lines+markers',
+                                  name='Amount')
 
         # Plot 2: Total Expenditure
-        total_expenditure = data['Amount'].sum()
-        fig.add_trace(
-            go.Indicator(
-                mode="number",
-                value=total_expenditure,
-                title={"text": "Total Expenditure"},
-                number={"prefix": "AED:"}
-            ),
-            row=1, col=2
+        total_expenditure = daily_totals.sum()
+        total_trace = go.Indicator(
+            mode="number",
+            value=total_expenditure,
+            title={"text": "Total Expenditure"},
+            number={"prefix": "AED:"}
         )
 
         # Plot 3: Pie Chart - Category-wise Amount Spent
-        category_sum = data.groupby('Category_freetext')['Amount'].sum()
-        fig.add_trace(
-            go.Pie(labels=category_sum.index, values=category_sum.values, name="Categories"),
-            row=1, col=3
-        )
+        category_sum = totals["category"].round(2)
+        category_trace = go.Pie(labels=category_sum.index, values=category_sum.values, name="Categories")
 
         # Plot 4: Bar Chart - Merchant-wise Amount Spent
-        merchant_sum = data.groupby('Merchant')['Amount'].sum()
-        top_merchants = merchant_sum.sort_values(ascending=False).head(10)
-        fig.add_trace(
-            go.Bar(x=top_merchants.values, y=top_merchants.index, orientation='h', name='Merchants'),
-            row=2, col=1
-        )
+        top_merchants = totals["merchant"].sort_values(ascending=False).head(10).round(2)
+        merchant_trace = go.Bar(x=top_merchants.values, y=top_merchants.index, orientation='h', name='Merchants')
 
         # Plot 5: Average Daily Spending
-        daily_totals = data.groupby('Date')['Amount'].sum()
-        average_daily_spent = daily_totals.sum()/30
-        fig.add_trace(
-            go.Indicator(
-                mode="number",
-                value=average_daily_spent,
-                title={"text": "Average Daily Spending"},
-                number={"prefix": "AED:"}
-            ),
-            row=2, col=2
+        if span_days is None:
+            span_days = (daily_totals.index.max() - daily_totals.index.min()).days + 1
+        average_daily_spent = daily_totals.sum() / span_days
+        average_trace = go.Indicator(
+            mode="number",
+            value=average_daily_spent,
+            title={"text": "Average Daily Spending"},
+            number={"prefix": "AED:"}
         )
 
         # Plot 6: Bar Chart - Location-wise Amount Spent
-        location_sum = data.groupby('Location')['Amount'].sum()
-        top_locations = location_sum.sort_values(ascending=False).head(10)
-        fig.add_trace(
-            go.Bar(x=top_locations.values, y=top_locations.index, orientation='h', name='Locations'),
-            row=2, col=3
+        top_locations = totals["location"].sort_values(ascending=False).head(10).round(2)
+        location_trace = go.Bar(x=top_locations.values, y=top_locations.index, orientation='h', name='Locations')
+
+        return [amount_trace, total_trace, category_trace, merchant_trace, average_trace, location_trace]
+
+    def _build_figure(self, month, totals, freq="day", span_days=None):
+        """
+        Builds the six-panel dashboard figure.
+        :param month: The month selected from the dropdown (str), or a date range, used in the title.
+        :param totals: Dictionary of Series with daily, category, merchant and location totals.
+        :param freq: Resampling of the Date vs Amount panel: "day", "week" or "month".
+        :param span_days: Days the average daily spending is taken over; defaults to the days from the
+            first to the last transaction.
+        :return: Plotly figure object.
+        """
+        from plotly.subplots import make_subplots
+
+        # Create a subplot figure with 2 rows and 3 columns
+        fig = make_subplots(
+            rows=2, cols=3,
+            subplot_titles=[title for _, title, _, _, _ in PANELS],
+            specs=[[{"type": kind} for _, _, row, _, kind in PANELS if row == 1],  # First row
+                   [{"type": kind} for _, _, row, _, kind in PANELS if row == 2]]  # Second row
         )
+        for (_, _, row, col, _), trace in zip(PANELS, self._panel_traces(totals, freq, span_days)):
+            fig.add_trace(trace, row=row, col=col)
 
         # Update layout for better spacing and aesthetics
         fig.update_layout(
@@ -127,6 +493,45 @@ class PlotGenerator:
 
         return fig
 
+    def _build_panels(self, totals, freq="day", span_days=None):
+        """
+        Builds each dashboard panel as its own figure.
+        :param totals: Dictionary of Series with daily, category, merchant and location totals.
+        :param freq: Resampling of the Date vs Amount panel: "day", "week" or "month".
+        :param span_days: Days the average daily spending is taken over.
+        :return: Dictionary of panel name to (digest, figure), in the order of PANELS; the digest
+            is a hash of the figure's JSON, so equal panels have equal digests.
+        """
+        import plotly.graph_objects as go
+
+        panels = OrderedDict()
+        for (name, title, _, _, kind), trace in zip(PANELS, self._panel_traces(totals, freq, span_days)):
+            fig = go.Figure(trace)
+            fig.update_layout(
+                height=400,
+                # Indicators carry their own title
+                title_text=None if kind == "indicator" else title,
+                title_x=0.5,
+                showlegend=kind == "domain",
+                margin=dict(t=60, b=40, l=150 if kind == "xy" and name != "amount_over_time" else 50, r=30),
+                font=dict(size=12),
+            )
+            panels[name] = (hashlib.sha1(fig.to_json().encode("utf-8")).hexdigest(), fig)
+        return panels
+
+    @staticmethod
+    def _changed_panels(panels, known):
+        """
+        Splits built panels into the figures to send and their digests.
+        :param panels: Dictionary of panel name to (digest, figure), from _build_panels.
+        :param known: Dictionary of panel name to digest of the panels already shown, or None.
+        :return: (panels, digests): figure or None for an unchanged panel, and digest per panel.
+        """
+        known = known or {}
+        figures = OrderedDict((name, None if known.get(name) == digest else fig)
+                              for name, (digest, fig) in panels.items())
+        return figures, OrderedDict((name, digest) for name, (digest, _) in panels.items())
+
 
 if __name__ == "__main__":
     # Example usage
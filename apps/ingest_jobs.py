@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from apps.upload_file import IngestionCancelled
+
+STAGES = ["pages_extracted", "rows_parsed", "merchants_classified", "rows_written"]
+FINISHED = ("done", "failed", "cancelled")
+
+
+class IngestionJob:
+    """State of one background statement ingest."""
+
+    def __init__(self, file_path):
+        self.id = uuid.uuid4().hex[:12]
+        self.file_path = file_path
+        self.status = "queued"
+        self.stage = None
+        self.progress = {stage: 0 for stage in STAGES}
+        self.rows_added = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.future = None
+
+    @property
+    def finished(self):
+        return self.status in FINISHED
+
+    def to_dict(self):
+        """
+        Snapshot the job for display or JSON.
+
+        Returns:
+            dict: Job id, status, current stage, per-stage counts and result.
+        """
+        return {
+            "id": self.id,
+            "file": self.file_path,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": dict(self.progress),
+            "rows_added": self.rows_added,
+            "error": self.error,
+        }
+
+    def describe(self):
+        """
+        Summarize the job on one line.
+
+        Returns:
+            str: Human-readable status.
+        """
+        counts = ", ".join(f"{stage.replace('_', ' ')}: {count}" for stage, count in self.progress.items())
+        if self.status == "done":
+            return f"Job {self.id} done, {self.rows_added} new transactions ({counts})"
+        if self.status == "failed":
+            return f"Job {self.id} failed: {self.error}"
+        return f"Job {self.id} {self.status}" + (f" at {self.stage.replace('_', ' ')}" if self.stage else "") + f" ({counts})"
+
+
+class IngestionJobManager:
+    """
+    Runs statement ingests in a bounded background worker pool.
+
+    Each upload becomes a job with an id, per-stage progress, and a
+    cancellation flag that is checked every time the pipeline reports
+    progress, so a cancelled job stops before anything is written. A cancel
+    that arrives once the rows are being written is too late: the job
+    finishes as done.
+    """
+
+    def __init__(self, processor, max_workers=2, max_finished_jobs=200):
+        """
+        Initialize the manager.
+
+        Args:
+            processor (PDFProcessor): Processor that runs the ingests.
+            max_workers (int): Ingests run at the same time; later jobs wait in the queue.
+            max_finished_jobs (int): Finished jobs kept for status lookups.
+        """
+        self.processor = processor
+        self.max_finished_jobs = max_finished_jobs
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, file_path, new_file_name="new_file.pdf", on_done=None):
+        """
+        Queue an upload for ingestion.
+
+        Args:
+            file_path (str): Path to the uploaded PDF.
+            new_file_name (str): Name the upload is stored under; None ingests file_path where it is,
+                for files already placed in statement storage.
+            on_done (callable): Called with the job once it finishes successfully.
+
+        Returns:
+            str: Job id.
+        """
+        job = IngestionJob(file_path)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        job.future = self._executor.submit(self._run, job, new_file_name, on_done)
+        return job.id
+
+    def _run(self, job, new_file_name, on_done):
+        if job.cancel_event.is_set():
+            job.status = "cancelled"
+            job.finished_at = time.time()
+            return
+
+        def progress(stage, count):
+            if job.cancel_event.is_set():
+                raise IngestionCancelled(job.id)
+            job.stage = stage
+            job.progress[stage] = count
+
+        job.status = "running"
+        try:
+            if new_file_name is None:
+                job.rows_added = self.processor.generate_sqldb(job.file_path, progress=progress)
+            else:
+                job.rows_added = self.processor.upload_file(job.file_path, new_file_name, progress=progress)
+            job.status = "done"
+            if on_done:
+                on_done(job)
+        except IngestionCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            logging.exception(f"Ingestion job {job.id} failed")
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(len(finished) - self.max_finished_jobs, 0)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        """
+        Look up a job.
+
+        Args:
+            job_id (str): Job id.
+
+        Returns:
+            IngestionJob: The job, or None if unknown.
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        Ask a job to stop. Queued jobs never start; running jobs stop at their next progress update.
+
+        Args:
+            job_id (str): Job id.
+
+        Returns:
+            bool: True if the job existed and had not finished.
+        """
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return False
+        job.cancel_event.set()
+        if job.future is not None and job.future.cancel():
+            job.status = "cancelled"
+            job.finished_at = time.time()
+        return True
+
+    def jobs(self):
+        """
+        Snapshot every tracked job.
+
+        Returns:
+            list: Job dictionaries, oldest first.
+        """
+        with self._lock:
+            return [job.to_dict() for job in self._jobs.values()]
+
+    async def watch(self, job_id, interval=0.5):
+        """
+        Yield the job's status line until it finishes.
+
+        Args:
+            job_id (str): Job id.
+            interval (float): Seconds between polls.
+
+        Yields:
+            str: Current status of the job.
+        """
+        job = self.get(job_id)
+        if job is None:
+            yield f"Unknown job {job_id}"
+            return
+        last = None
+        while True:
+            line = job.describe()
+            if line != last:
+                yield line
+                last = line
+            if job.finished:
+                return
+            await asyncio.sleep(interval)
+
+    def shutdown(self, wait=True):
+        """Cancel queued jobs and stop the worker pool."""
+        with self._lock:
+            for job in self._jobs.values():
+                job.cancel_event.set()
+        self._executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,258 @@
+import hashlib
+import json
+import logging
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from apps.categories import CATEGORIES
+from apps.clients import STUB_MODEL
+from apps.merchant_classifier import rule_category
+from apps.question_router import rule_based_sql
+
+# Markers of the prompts SpendWise and PDFProcessor send
+CLASSIFY_MARKER = "classify them to one of the following"
+TABLE_PATTERN = re.compile(r'Use the table "([^"]+)"')
+QUESTION_PATTERN = re.compile(r'Question:\s*(.*?)\s*Answer:', re.DOTALL)
+RESULT_PATTERN = re.compile(r'SQL Result:\s*(.*?)\s*Answer:', re.DOTALL)
+
+
+def _digest(text):
+    return int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:8], 16)
+
+
+def stub_category(merchant):
+    """
+    Deterministic category of a merchant: by keyword, else picked by the hash of its name.
+
+    Args:
+        merchant (str): Merchant name.
+
+    Returns:
+        str: One of CATEGORIES.
+    """
+    return rule_category(merchant) or CATEGORIES[_digest(merchant.lower()) % len(CATEGORIES)]
+
+
+def stub_reply(messages):
+    """
+    Deterministic reply to a chat request, by the kind of prompt it carries.
+
+    Classification prompts get a JSON object of merchant categories, SQL prompts
+    the query the templates give (or a per-category summary), and answer prompts
+    a sentence quoting the SQL result. Anything else is echoed back.
+
+    Args:
+        messages (list): Chat messages, as dicts with "role" and "content".
+
+    Returns:
+        str: Reply text.
+    """
+    system = " ".join(m.get("content") or "" for m in messages if m.get("role") == "system")
+    # Earlier turns of a conversation come first; the request itself is the last user message
+    user = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+    if CLASSIFY_MARKER in system:
+        merchants = [name.strip() for name in user.split(",") if name.strip()]
+        return json.dumps({name: stub_category(name) for name in merchants})
+
+    table = TABLE_PATTERN.search(system) or TABLE_PATTERN.search(user)
+    if table:
+        question = QUESTION_PATTERN.search(user)
+        question = question.group(1) if question else ""
+        sql = rule_based_sql(question, table.group(1))
+        return sql or (f'SELECT Category_freetext, SUM(Amount) AS Total FROM "{table.group(1)}" '
+                       f'GROUP BY Category_freetext ORDER BY Total DESC')
+
+    result = RESULT_PATTERN.search(user)
+    if result:
+        return f"Based on your statement, here is what I found: {result.group(1)[:300]} (amounts in AED)."
+    return f"You said: {user.strip()[:300]}"
+
+
+def _token_count(text):
+    return max(len(text.split()), 1)
+
+
+class StubLLMServer:
+    """
+    Local stand-in for an OpenAI-compatible chat completions API.
+
+    Serves ``POST <prefix>/chat/completions``, streamed or not, with the
+    deterministic replies of stub_reply after a configurable delay, so the
+    chat and upload paths can be load-tested offline through their real HTTP
+    clients. Select it with ``llm_backend="stub"`` or
+    ``SPENDWISE_LLM_BACKEND=stub``.
+    """
+
+    def __init__(self, host="127.0.0.1", port=8971, latency=0.2, jitter=0.0, token_delay=0.0,
+                 error_rate=0.0, seed=0):
+        """
+        Args:
+            host (str): Interface to listen on.
+            port (int): Port to listen on; 0 picks a free one.
+            latency (float): Seconds before each reply starts.
+            jitter (float): Extra seconds added at random, up to this much, per request.
+            token_delay (float): Seconds between streamed chunks.
+            error_rate (float): Share of requests answered with HTTP 503, for retry testing.
+            seed (int): Seed of the jitter and error draws.
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.token_delay = token_delay
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self.requests = 0
+
+    @property
+    def base_url(self):
+        """API root to configure clients with, e.g. ``http://127.0.0.1:8971/v1/``."""
+        return f"http://{self.host}:{self.port}/v1/"
+
+    def _draw(self):
+        """Delay and failure of the next request."""
+        with self._random_lock:
+            self.requests += 1
+            delay = self.latency + self._random.uniform(0, self.jitter) if self.jitter else self.latency
+            return delay, self._random.random() < self.error_rate
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                logging.debug(f"LLM stub: {format % args}")
+
+            def _send_json(self, status, body):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/models"):
+                    self._send_json(200, {"object": "list", "data": [{"id": STUB_MODEL, "object": "model"}]})
+                else:
+                    self._send_json(404, {"error": {"message": "Not found"}})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    request = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    self._send_json(400, {"error": {"message": "Body is not JSON"}})
+                    return
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": "Not found"}})
+                    return
+
+                delay, fail = server._draw()
+                time.sleep(delay)
+                if fail:
+                    self._send_json(503, {"error": {"message": "Stub overloaded"}})
+                    return
+
+                messages = request.get("messages") or []
+                reply = stub_reply(messages)
+                model = request.get("model") or STUB_MODEL
+                usage = {"prompt_tokens": _token_count(" ".join(m.get("content") or "" for m in messages)),
+                         "completion_tokens": _token_count(reply)}
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                completion_id = f"chatcmpl-stub{server.requests}"
+                if request.get("stream"):
+                    self._stream(completion_id, model, reply, usage)
+                else:
+                    self._send_json(200, {
+                        "id": completion_id, "object": "chat.completion", "created": int(time.time()),
+                        "model": model, "usage": usage,
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": reply}}],
+                    })
+
+            def _stream(self, completion_id, model, reply, usage):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                words = re.findall(r'\S+\s*', reply) or [reply]
+                for i, word in enumerate(words):
+                    last = i == len(words) - 1
+                    chunk = {
+                        "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                        "model": model,
+                        "choices": [{"index": 0, "finish_reason": "stop" if last else None,
+                                     "delta": {"role": "assistant", "content": word} if i == 0 else {"content": word}}],
+                    }
+                    if last:
+                        chunk["usage"] = usage
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                    if server.token_delay and not last:
+                        time.sleep(server.token_delay)
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+        return Handler
+
+    def start(self):
+        """
+        Start serving in a background thread.
+
+        Returns:
+            StubLLMServer: self, with ``port`` set to the bound port.
+        """
+        self._server = ThreadingHTTPServer((self.host, self.port), self._handler())
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="llm-stub", daemon=True)
+        self._thread.start()
+        logging.info(f"LLM stub serving on {self.base_url}")
+        return self
+
+    def stop(self):
+        """Stop serving."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve deterministic OpenAI-compatible LLM replies locally.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8971)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds before each reply.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random extra seconds per reply, at most.")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Seconds between streamed chunks.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests failing with 503.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    stub = StubLLMServer(args.host, args.port, args.latency, args.jitter, args.token_delay, args.error_rate, args.seed)
+    stub.start()
+    print(f"Serving on {stub.base_url}; run the app with SPENDWISE_LLM_BACKEND=stub"
+          + ("" if args.port == 8971 and args.host == "127.0.0.1" else f" SPENDWISE_LLM_BASE_URL={stub.base_url}"))
+    try:
+        stub._thread.join()
+    except KeyboardInterrupt:
+        stub.stop()
@@ -0,0 +1,172 @@
+import sqlite3
+import time
+import threading
+from contextlib import contextmanager
+
+
+class MerchantCategoryCache:
+    """
+    Persistent merchant -> category store kept in the expenses SQLite database.
+
+    Merchants are keyed by the same normalized form ``generate_sqldb`` writes
+    (stripped and lower-cased). Entries older than ``ttl`` seconds are treated
+    as misses, and the least recently used entries are evicted once the store
+    grows past ``max_entries``.
+    """
+
+    TABLE = "merchant_categories"
+    # SQLite's default limit on host parameters per statement is 999
+    _BATCH = 500
+
+    def __init__(self, db_path='expenses.db', ttl=180 * 24 * 3600, max_entries=50000):
+        """
+        Initialize the cache and create its table if needed.
+
+        Args:
+            db_path (str): Path to the SQLite database.
+            ttl (float): Seconds an entry stays valid; None keeps entries forever.
+            max_entries (int): Entries kept before least recently used ones are evicted.
+        """
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.TABLE} ("
+                "merchant TEXT PRIMARY KEY, category TEXT NOT NULL, "
+                "updated_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def normalize(merchant):
+        """
+        Normalize a merchant name to its cache key.
+
+        Args:
+            merchant (str): Merchant name.
+
+        Returns:
+            str: Stripped, lower-cased name.
+        """
+        return merchant.strip().lower()
+
+    def get_many(self, merchants):
+        """
+        Look up the cached categories of several merchants.
+
+        Args:
+            merchants (iterable): Merchant names.
+
+        Returns:
+            dict: Normalized merchant name -> category for every fresh hit.
+        """
+        keys = list(dict.fromkeys(self.normalize(m) for m in merchants))
+        now = time.time()
+        found = {}
+        with self._connect() as conn:
+            for i in range(0, len(keys), self._BATCH):
+                batch = keys[i:i + self._BATCH]
+                placeholders = ", ".join("?" * len(batch))
+                query = f"SELECT merchant, category FROM {self.TABLE} WHERE merchant IN ({placeholders})"
+                params = list(batch)
+                if self.ttl is not None:
+                    query += " AND updated_at >= ?"
+                    params.append(now - self.ttl)
+                found.update(conn.execute(query, params).fetchall())
+            if found:
+                conn.executemany(
+                    f"UPDATE {self.TABLE} SET last_used = ? WHERE merchant = ?",
+                    [(now, merchant) for merchant in found]
+                )
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, category_map):
+        """
+        Store merchant categories, replacing existing entries.
+
+        Args:
+            category_map (dict): Merchant name -> category.
+        """
+        now = time.time()
+        rows = [
+            (self.normalize(merchant), category, now, now)
+            for merchant, category in category_map.items()
+            if isinstance(merchant, str) and isinstance(category, str)
+        ]
+        if not rows:
+            return
+        with self._connect() as conn:
+            conn.executemany(f"INSERT OR REPLACE INTO {self.TABLE} VALUES (?, ?, ?, ?)", rows)
+        self.evict()
+
+    def items(self):
+        """
+        Every fresh entry, for tools that learn from the known merchants.
+
+        Returns:
+            dict: Normalized merchant name -> category, most recently updated last.
+        """
+        query = f"SELECT merchant, category FROM {self.TABLE}"
+        params = []
+        if self.ttl is not None:
+            query += " WHERE updated_at >= ?"
+            params.append(time.time() - self.ttl)
+        with self._connect() as conn:
+            return dict(conn.execute(query + " ORDER BY updated_at", params).fetchall())
+
+    def version(self):
+        """
+        Cheap marker that changes whenever entries are stored or evicted.
+
+        Returns:
+            tuple: (number of entries, latest update time).
+        """
+        with self._connect() as conn:
+            return tuple(conn.execute(f"SELECT COUNT(*), MAX(updated_at) FROM {self.TABLE}").fetchone())
+
+    def evict(self):
+        """
+        Remove expired entries and trim the store to ``max_entries``.
+
+        Returns:
+            int: Number of entries removed.
+        """
+        with self._connect() as conn:
+            removed = 0
+            if self.ttl is not None:
+                removed += conn.execute(
+                    f"DELETE FROM {self.TABLE} WHERE updated_at < ?", (time.time() - self.ttl,)
+                ).rowcount
+            if self.max_entries is not None:
+                removed += conn.execute(
+                    f"DELETE FROM {self.TABLE} WHERE merchant IN ("
+                    f"SELECT merchant FROM {self.TABLE} ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                ).rowcount
+        return removed
+
+    def stats(self):
+        """
+        Report cache counters.
+
+        Returns:
+            dict: Hits, misses and number of stored entries.
+        """
+        with self._connect() as conn:
+            size = conn.execute(f"SELECT COUNT(*) FROM {self.TABLE}").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "size": size}
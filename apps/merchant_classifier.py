@@ -0,0 +1,396 @@
+import glob
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from apps.categories import CATEGORIES
+
+# Known merchants sharing a trigram beyond this many are not scored through it, which keeps
+# lookups fast on large stores and can only lower a similarity, never raise it
+MAX_POSTINGS = 2000
+# Keyword rules, checked in order, so "careem food" is food delivery before "careem" is transportation
+# and "gold's gym" is fitness before "gold" is jewelry. Keywords match whole words of the merchant name.
+KEYWORD_RULES = [
+    (("careem food", "noon food", "talabat", "deliveroo", "zomato", "instashop", "smiles"), "food delivery"),
+    (("gym", "gyms", "fitness", "yoga", "crossfit", "pilates", "gold's gym", "fitness first"), "fitness"),
+    (("coop", "co op", "co-op", "carrefour", "lulu", "spinneys", "waitrose", "choithrams", "grandiose", "viva",
+      "supermarket", "hypermarket", "grocery", "groceries", "baqala", "minimart", "market"), "groceries"),
+    (("cafe", "caffe", "coffee", "starbucks", "costa", "tim hortons", "mcdonald's", "mcdonalds", "kfc", "burger",
+      "pizza", "restaurant", "grill", "shawarma", "bakery", "kitchen", "bistro", "eatery"), "restaurants and cafes"),
+    (("pharmacy", "aster", "clinic", "hospital", "medical", "medicare", "dental", "boots", "life pharmacy"),
+     "healthcare"),
+    (("zara", "h&m", "max fashion", "splash", "centrepoint", "uniqlo", "adidas", "nike", "fashion", "apparel",
+      "shoes", "footwear"), "clothing"),
+    (("jewel", "jewels", "jewellery", "jewelry", "jewellers", "damas", "malabar gold", "joyalukkas", "tanishq",
+      "gold"), "jewelry"),
+    (("uber", "careem", "taxi", "rta", "salik", "enoc", "adnoc", "eppco", "emarat", "nol", "parking", "metro",
+      "petrol"), "transportation"),
+    (("etisalat", "e&", "du", "virgin mobile", "telecom", "internet"), "phone and internet"),
+    (("amazon", "amazon.ae", "noon", "noon.com", "noon.ae", "namshi", "aliexpress", "shein", "temu", "ebay"),
+     "e-commerce"),
+]
+_RULE_PATTERNS = [
+    (re.compile(r'(?<![\w&])(?:' + '|'.join(re.escape(k) for k in keywords) + r')(?![\w&])'), category)
+    for keywords, category in KEYWORD_RULES
+]
+_CLEAN_PATTERN = re.compile(r'[^a-z0-9&]+')
+
+
+def clean_name(merchant):
+    """
+    Reduce a merchant name to lower-case words, dropping punctuation and numbers.
+
+    Args:
+        merchant (str): Merchant name.
+
+    Returns:
+        str: e.g. "amazon ae" for "Amazon.ae #2231".
+    """
+    words = _CLEAN_PATTERN.sub(' ', merchant.lower()).split()
+    return ' '.join(word for word in words if not word.isdigit())
+
+
+def rule_category(merchant):
+    """
+    Category of a merchant by the first keyword rule that matches it.
+
+    Args:
+        merchant (str): Merchant name.
+
+    Returns:
+        str: A category from CATEGORIES, or None if no rule matches.
+    """
+    name = merchant.lower()
+    for pattern, category in _RULE_PATTERNS:
+        if pattern.search(name):
+            return category
+    return None
+
+
+def _trigrams(name):
+    padded = f"  {name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _features(name):
+    """Word and character 3-4 gram features of a cleaned merchant name."""
+    features = []
+    for word in name.split():
+        features.append("w:" + word)
+        padded = f" {word} "
+        for n in (3, 4):
+            features.extend("c:" + padded[i:i + n] for i in range(len(padded) - n + 1))
+    return features
+
+
+def bundled_examples(data_dir="./data"):
+    """
+    Merchant categories of the already categorized sample statements.
+
+    Args:
+        data_dir (str): Directory holding ``bank_statement_*.csv`` files.
+
+    Returns:
+        dict: Normalized merchant name -> category.
+    """
+    examples = {}
+    for path in sorted(glob.glob(os.path.join(data_dir, "bank_statement_*.csv"))):
+        try:
+            df = pd.read_csv(path, usecols=["Merchant", "Category_freetext"]).dropna()
+        except (ValueError, OSError) as e:
+            logging.warning(f"Skipping {path} as training data: {e}")
+            continue
+        examples.update(zip(df["Merchant"].str.strip().str.lower(), df["Category_freetext"]))
+    return examples
+
+
+class TfidfLinearModel:
+    """
+    Softmax regression over TF-IDF weighted word and character n-gram features.
+
+    Small enough to train in-process on every change of the merchant store:
+    rows are kept as sparse index and value arrays, and training is
+    full-batch AdaGrad in numpy, whose per-feature step sizes suit the many
+    rare n-grams of merchant names.
+    """
+
+    def __init__(self, iterations=40, learning_rate=0.5, l2=1e-4):
+        """
+        Args:
+            iterations (int): Gradient descent steps.
+            learning_rate (float): Step size.
+            l2 (float): Weight decay.
+        """
+        self.iterations = iterations
+        self.learning_rate = learning_rate
+        self.l2 = l2
+        self.classes = []
+        self.vocabulary = {}
+        self.idf = None
+        self.weights = None
+        self.bias = None
+
+    def _rows(self, names):
+        """Sparse TF-IDF rows of names: (row of each value, feature indices, values)."""
+        rows, indices, values = [], [], []
+        for row, name in enumerate(names):
+            counts = Counter(self.vocabulary[f] for f in _features(name) if f in self.vocabulary)
+            if not counts:
+                continue
+            idx = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+            val = np.fromiter(counts.values(), dtype=np.float32, count=len(counts)) * self.idf[idx]
+            val /= np.linalg.norm(val)
+            rows.append(np.full(len(idx), row))
+            indices.append(idx)
+            values.append(val)
+        if not rows:
+            return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float32)
+        return np.concatenate(rows), np.concatenate(indices), np.concatenate(values)
+
+    @staticmethod
+    def _segments(keys):
+        """Start of each run of equal values in a sorted array."""
+        return np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else keys
+
+    def _scores(self, rows, indices, values, count, starts=None):
+        scores = np.tile(self.bias, (count, 1))
+        if len(rows):
+            starts = self._segments(rows) if starts is None else starts
+            scores[rows[starts]] += np.add.reduceat(self.weights[indices] * values[:, None], starts, axis=0)
+        return scores
+
+    @staticmethod
+    def _softmax(scores):
+        scores = scores - scores.max(axis=1, keepdims=True)
+        exp = np.exp(scores)
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    def fit(self, names, labels):
+        """
+        Train on cleaned merchant names and their categories.
+
+        Args:
+            names (list): Cleaned merchant names.
+            labels (list): Category of each name.
+
+        Returns:
+            TfidfLinearModel: self.
+        """
+        self.classes = sorted(set(labels))
+        document_frequency = Counter(f for name in names for f in set(_features(name)))
+        self.vocabulary = {feature: i for i, feature in enumerate(document_frequency)}
+        self.idf = np.array([math.log((1 + len(names)) / (1 + df)) + 1 for df in document_frequency.values()],
+                            dtype=np.float32)
+        self.weights = np.zeros((len(self.vocabulary), len(self.classes)), dtype=np.float32)
+        self.bias = np.zeros(len(self.classes), dtype=np.float32)
+        if len(self.classes) < 2:
+            return self
+
+        class_index = {label: i for i, label in enumerate(self.classes)}
+        targets = np.zeros((len(names), len(self.classes)), dtype=np.float32)
+        targets[np.arange(len(names)), [class_index[label] for label in labels]] = 1
+        rows, indices, values = self._rows(names)
+        row_starts = self._segments(rows)
+        # Every vocabulary feature occurs in training, so sorting by feature gives one segment per weight row
+        order = np.argsort(indices, kind="stable")
+        feature_starts = self._segments(indices[order])
+        rows_by_feature, values_by_feature = rows[order], values[order, None]
+        weight_squares = np.full_like(self.weights, 1e-8)
+        bias_squares = np.full_like(self.bias, 1e-8)
+        for _ in range(self.iterations):
+            scores = self._scores(rows, indices, values, len(names), row_starts)
+            errors = (self._softmax(scores) - targets) / len(names)
+            gradient = np.add.reduceat(errors[rows_by_feature] * values_by_feature, feature_starts, axis=0)
+            gradient += self.l2 * self.weights
+            bias_gradient = errors.sum(axis=0)
+            weight_squares += gradient * gradient
+            bias_squares += bias_gradient * bias_gradient
+            self.weights -= self.learning_rate * gradient / np.sqrt(weight_squares)
+            self.bias -= self.learning_rate * bias_gradient / np.sqrt(bias_squares)
+        return self
+
+    def predict(self, names):
+        """
+        Predict categories of cleaned merchant names.
+
+        Args:
+            names (list): Cleaned merchant names.
+
+        Returns:
+            list: (category, confidence) per name; (None, 0.0) when the model is
+            untrained. The confidence is the class probability scaled by the share
+            of the name's features seen in training, so a name that is mostly new
+            words is not trusted on the strength of the few it shares.
+        """
+        if len(self.classes) < 2:
+            return [(None, 0.0)] * len(names)
+        rows, indices, values = self._rows(names)
+        probabilities = self._softmax(self._scores(rows, indices, values, len(names)))
+        best = probabilities.argmax(axis=1)
+        predictions = []
+        for i, (name, b) in enumerate(zip(names, best)):
+            features = _features(name)
+            coverage = sum(f in self.vocabulary for f in features) / len(features) if features else 0.0
+            predictions.append((self.classes[b], float(probabilities[i, b]) * coverage) if coverage else (None, 0.0))
+        return predictions
+
+
+class MerchantClassifier:
+    """
+    Categorizes merchants locally, so only the uncertain ones go to the LLM.
+
+    Each merchant is tried against, in order: the known merchants (exact, then
+    fuzzy by character trigrams), the keyword rules, and a TF-IDF linear model
+    trained on the known merchants. Known merchants are the merchant store's
+    entries plus the sample statements in ``data_dir``.
+
+    The index and model are built on first use and rebuilt in a background
+    thread when the store changes, so ingests keep using the previous ones
+    instead of waiting for training.
+    """
+
+    def __init__(self, merchant_cache=None, data_dir="./data", fuzzy_threshold=0.8, min_confidence=0.5,
+                 max_training_merchants=10000):
+        """
+        Args:
+            merchant_cache (MerchantCategoryCache): Store of known merchant categories.
+            data_dir (str): Directory of already categorized sample statements.
+            fuzzy_threshold (float): Trigram Dice similarity a fuzzy match needs.
+            min_confidence (float): Model confidence a prediction needs.
+            max_training_merchants (int): Most recently updated known merchants the model trains on.
+        """
+        self.merchant_cache = merchant_cache
+        self.data_dir = data_dir
+        self.fuzzy_threshold = fuzzy_threshold
+        self.min_confidence = min_confidence
+        self.max_training_merchants = max_training_merchants
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._builder = None
+        self._version = None
+        self._bundled = None
+        # (known name -> category, known names, trigram -> known name ids, trigrams per known name)
+        self._index = None
+        self.model = TfidfLinearModel()
+
+    def _build(self, version):
+        with self._build_lock:
+            if self._index is not None and version == self._version:
+                return
+            if self._bundled is None:
+                self._bundled = bundled_examples(self.data_dir)
+            known = dict(self._bundled)
+            if self.merchant_cache is not None:
+                known.update(self.merchant_cache.items())
+
+            by_name = {}
+            for merchant, category in known.items():
+                name = clean_name(merchant)
+                if name:
+                    by_name[name] = category
+            names = list(by_name)
+            trigram_index, counts = {}, []
+            for i, name in enumerate(names):
+                trigrams = _trigrams(name)
+                counts.append(len(trigrams))
+                for trigram in trigrams:
+                    trigram_index.setdefault(trigram, []).append(i)
+
+            # The model only learns labels that map onto the fixed category list
+            training = [(name, next((c for c in CATEGORIES if c in str(category).lower()), None))
+                        for name, category in list(by_name.items())[-self.max_training_merchants:]]
+            training = [(name, label) for name, label in training if label]
+            model = TfidfLinearModel().fit([n for n, _ in training], [label for _, label in training])
+
+            with self._lock:
+                self._index = (by_name, names, trigram_index, counts)
+                self.model = model
+                self._version = version
+        logging.info(f"Merchant classifier: {len(by_name)} known merchants, "
+                     f"model trained on {len(training)} over {len(model.classes)} categories.")
+
+    def refresh(self, wait=True):
+        """
+        Rebuild the known merchants, fuzzy index and model if the store changed.
+
+        Args:
+            wait (bool): Rebuild before returning; otherwise rebuild in a
+                background thread unless nothing was built yet.
+        """
+        version = self.merchant_cache.version() if self.merchant_cache is not None else None
+        with self._lock:
+            if self._index is not None and version == self._version:
+                return
+            if not wait and self._index is not None:
+                if self._builder is None or not self._builder.is_alive():
+                    self._builder = threading.Thread(target=self._build, args=(version,),
+                                                     name="merchant-classifier", daemon=True)
+                    self._builder.start()
+                return
+        self._build(version)
+
+    def _fuzzy_match(self, name, index):
+        """Category and similarity of the most similar known merchant, or (None, 0.0)."""
+        known, names, trigram_index, counts = index
+        category = known.get(name)
+        if category is not None:
+            return category, 1.0
+        if len(name) < 4:
+            return None, 0.0
+        trigrams = _trigrams(name)
+        shared = Counter()
+        for trigram in trigrams:
+            postings = trigram_index.get(trigram, ())
+            if len(postings) <= MAX_POSTINGS:
+                shared.update(postings)
+        best, best_score = None, 0.0
+        for i, common in shared.items():
+            score = 2 * common / (len(trigrams) + counts[i])
+            if score > best_score:
+                best, best_score = i, score
+        if best is None:
+            return None, 0.0
+        return known[names[best]], best_score
+
+    def classify(self, merchants):
+        """
+        Categorize merchants without the LLM.
+
+        Args:
+            merchants (iterable): Merchant names.
+
+        Returns:
+            dict: Merchant -> (category, method, confidence) for the merchants
+            categorized with enough confidence; method is "known", "fuzzy",
+            "rule" or "model". The others are left out for the LLM.
+        """
+        self.refresh(wait=False)
+        with self._lock:
+            index, model = self._index, self.model
+        results, unmatched = {}, []
+        for merchant in dict.fromkeys(merchants):
+            name = clean_name(merchant)
+            if not name:
+                continue
+            category, score = self._fuzzy_match(name, index)
+            if category is not None and score >= self.fuzzy_threshold:
+                results[merchant] = (category, "known" if score == 1.0 else "fuzzy", score)
+                continue
+            category = rule_category(merchant)
+            if category is not None:
+                results[merchant] = (category, "rule", 1.0)
+                continue
+            unmatched.append((merchant, name))
+
+        if unmatched:
+            for (merchant, _), (category, confidence) in zip(
+                    unmatched, model.predict([name for _, name in unmatched])):
+                if category is not None and confidence >= self.min_confidence:
+                    results[merchant] = (category, "model", confidence)
+        return results
@@ -0,0 +1,257 @@
+import math
+import re
+import sqlite3
+import threading
+import time
+
+from apps.tracing import metrics
+
+# Authorizer actions a read-only query may perform
+ALLOWED_ACTIONS = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE}
+EXPLAIN_PATTERN = re.compile(
+    r'^(?P<kind>SCAN|SEARCH) (?P<table>\S+)(?: AS \S+)?(?: USING (?:COVERING )?INDEX \S+ \((?P<terms>[^)]*)\)'
+    r'| USING (?P<pk>INTEGER PRIMARY KEY|PRIMARY KEY))?'
+)
+
+
+class QueryRejected(ValueError):
+    """Raised for queries the guard refuses to run or stops."""
+
+
+class QueryTimeout(QueryRejected):
+    """Raised when a query runs past its time budget."""
+
+
+class QueryResult:
+    """Rows fetched by GuardedExecutor, with whether the caps cut them short."""
+
+    def __init__(self, columns, rows, truncated, elapsed):
+        self.columns = columns
+        self.rows = rows
+        self.truncated = truncated
+        self.elapsed = elapsed
+
+    @staticmethod
+    def _compact(value):
+        if isinstance(value, float):
+            return round(value, 2)
+        if isinstance(value, str) and len(value) > 80:
+            return value[:77] + "..."
+        return value
+
+    def summary(self, max_chars=4000):
+        """
+        Format the rows for the answer prompt, in the ``[(...), ...]`` form of
+        ``SQLDatabase.run``, with floats rounded and long text shortened.
+
+        Args:
+            max_chars (int): Longest summary; rows past it are left out.
+
+        Returns:
+            str: The rows, with a note when some were left out, or "" if there are none.
+        """
+        if not self.rows:
+            return ""
+        parts, length = [], 2
+        for row in self.rows:
+            text = repr(tuple(self._compact(value) for value in row))
+            if parts and length + len(text) + 2 > max_chars:
+                break
+            parts.append(text)
+            length += len(text) + 2
+        summary = "[" + ", ".join(parts) + "]"
+        if len(parts) < len(self.rows) or self.truncated:
+            summary += (f"\n(Only the first {len(parts)} rows are shown; the query returned more. "
+                        f"Columns: {', '.join(self.columns)}.)")
+        return summary
+
+
+class GuardedExecutor:
+    """
+    Runs LLM-generated SQL against the expenses database within fixed bounds.
+
+    Queries run on a read-only connection whose authorizer only allows reads,
+    optionally only of one table or view. The query plan is checked before
+    running, so queries expected to visit too many rows are refused. A progress
+    handler stops queries that run past the timeout, and rows are fetched in
+    batches until the row or byte cap is reached.
+    """
+
+    def __init__(self, db_path='expenses.db', timeout=5.0, max_rows=500, max_bytes=64_000,
+                 max_estimated_rows=5_000_000, fetch_size=100, progress_steps=10_000):
+        """
+        Initialize the executor.
+
+        Args:
+            db_path (str): Path to the SQLite database.
+            timeout (float): Seconds a query may run.
+            max_rows (int): Rows fetched at most.
+            max_bytes (int): Approximate size of the fetched rows at most.
+            max_estimated_rows (int): Rows the query plan may be expected to visit.
+            fetch_size (int): Rows fetched per batch.
+            progress_steps (int): SQLite VM instructions between timeout checks.
+        """
+        self.db_path = db_path
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_estimated_rows = max_estimated_rows
+        self.fetch_size = fetch_size
+        self.progress_steps = progress_steps
+        self._local = threading.local()
+
+    def _connection(self):
+        """Read-only connection for the calling thread, opened on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+            conn.execute("PRAGMA query_only = ON")
+            conn.execute("PRAGMA busy_timeout = 5000")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _authorizer(table):
+        def authorize(action, arg1, arg2, database, source):
+            if action not in ALLOWED_ACTIONS:
+                return sqlite3.SQLITE_DENY
+            # Reads through a view report the view as their source
+            if action == sqlite3.SQLITE_READ and table is not None and table not in (arg1, source):
+                return sqlite3.SQLITE_DENY
+            return sqlite3.SQLITE_OK
+        return authorize
+
+    def _table_rows(self, conn, table, cache):
+        if table not in cache:
+            try:
+                cache[table] = conn.execute(f'SELECT MAX(rowid) FROM "{table}"').fetchone()[0] or 0
+            except sqlite3.DatabaseError:
+                cache[table] = 0
+        return cache[table]
+
+    def _index_rows(self, conn, table, terms, cache):
+        """Expected rows per lookup of an index search, from sqlite_stat1 when ANALYZE has run."""
+        equalities = terms.count("=") - terms.count(">=") - terms.count("<=")
+        rows = self._table_rows(conn, table, cache)
+        if equalities <= 0:
+            # Range search: assume it narrows the table down to a quarter
+            return max(rows // 4, 1)
+        key = ("stat", table, terms)
+        if key not in cache:
+            cache[key] = None
+            try:
+                for (stat,) in conn.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = ?", (table,)):
+                    values = [int(v) for v in stat.split()[1:] if v.isdigit()]
+                    if len(values) >= equalities:
+                        cache[key] = max(values[equalities - 1], cache[key] or 0)
+            except sqlite3.DatabaseError:
+                pass
+        return cache[key] or max(rows // 10, 1)
+
+    def estimate_rows(self, query, conn=None):
+        """
+        Estimate the rows a query will visit from its EXPLAIN QUERY PLAN.
+
+        Nested loops multiply, correlated subqueries run once per outer row,
+        full scans cost the table's size and index searches the expected
+        rows per key.
+
+        Args:
+            query (str): SQL query.
+            conn (sqlite3.Connection): Connection to explain on.
+
+        Returns:
+            int: Estimated rows visited.
+        """
+        conn = conn or self._connection()
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()
+        children = {}
+        for node_id, parent, _, detail in plan:
+            children.setdefault(parent, []).append((node_id, detail))
+        cache = {}
+
+        def node_rows(detail):
+            match = EXPLAIN_PATTERN.match(detail)
+            if not match:
+                return None
+            if match.group("kind") == "SCAN":
+                return max(self._table_rows(conn, match.group("table"), cache), 1)
+            if match.group("pk"):
+                return 1
+            return self._index_rows(conn, match.group("table"), match.group("terms") or "", cache)
+
+        def group_cost(parent):
+            nodes = children.get(parent, [])
+            loops = [rows for rows in (node_rows(detail) for _, detail in nodes) if rows is not None]
+            product = math.prod(loops) if loops else 0
+            cost = product
+            for node_id, detail in nodes:
+                sub = group_cost(node_id)
+                cost += max(product, 1) * sub if "CORRELATED" in detail else sub
+            return cost
+
+        return group_cost(0)
+
+    def run(self, query, table=None):
+        """
+        Run a query within the guard's bounds.
+
+        Args:
+            query (str): A single SQL statement.
+            table (str): Only table or view the query may read; None allows any.
+
+        Returns:
+            QueryResult: Fetched rows.
+
+        Raises:
+            QueryRejected: If the query writes, reads another table, is too
+                expensive, or fails.
+            QueryTimeout: If it runs past the timeout.
+        """
+        if not sqlite3.complete_statement(query) and not sqlite3.complete_statement(query + ";"):
+            raise QueryRejected("Query is not a complete SQL statement.")
+        conn = self._connection()
+        start = time.monotonic()
+        deadline = start + self.timeout
+        conn.set_progress_handler(lambda: time.monotonic() > deadline, self.progress_steps)
+        try:
+            # Planning reads table sizes and statistics, so it runs before the authorizer is installed
+            estimate = self.estimate_rows(query, conn)
+            if estimate > self.max_estimated_rows:
+                metrics.inc("query_rejections", reason="cost")
+                raise QueryRejected(f"Query would visit about {estimate:,} rows; narrow it down.")
+
+            conn.set_authorizer(self._authorizer(table))
+            cursor = conn.execute(query)
+            columns = [column[0] for column in cursor.description or []]
+            rows, size, truncated = [], 0, False
+            while True:
+                batch = cursor.fetchmany(self.fetch_size)
+                if not batch:
+                    break
+                for row in batch:
+                    size += len(repr(row))
+                    if len(rows) >= self.max_rows or size > self.max_bytes:
+                        truncated = True
+                        break
+                    rows.append(row)
+                if truncated:
+                    break
+            cursor.close()
+        except sqlite3.DatabaseError as e:
+            if time.monotonic() > deadline or "interrupted" in str(e):
+                metrics.inc("query_rejections", reason="timeout")
+                raise QueryTimeout(f"Query took longer than {self.timeout:g}s.") from e
+            if "not authorized" in str(e) or "prohibited" in str(e):
+                metrics.inc("query_rejections", reason="unauthorized")
+                raise QueryRejected("Query may only read the selected statement.") from e
+            raise QueryRejected(str(e)) from e
+        finally:
+            conn.set_progress_handler(None, 0)
+            conn.set_authorizer(None)
+            if conn.in_transaction:
+                conn.rollback()
+
+        if truncated:
+            metrics.inc("query_truncated")
+        return QueryResult(columns, rows, truncated, time.monotonic() - start)
@@ -0,0 +1,155 @@
+import re
+
+# Phrases that identify a single category in a question, checked in order
+CATEGORY_KEYWORDS = [
+    ('food delivery', r'food deliver(y|ies)'),
+    ('restaurants and cafes', r'restaurants?|cafes?|cafés?|coffee|dining|eating out'),
+    ('groceries', r'grocer(y|ies)|supermarkets?'),
+    ('fitness', r'fitness|gym'),
+    ('healthcare', r'health ?care|medical|pharmac(y|ies)|doctors?|hospitals?'),
+    ('clothing', r'cloth(es|ing)|apparel|fashion'),
+    ('jewelry', r'jewel(le)?ry'),
+    ('transportation', r'transport(ation)?|taxis?|cabs?|metro|fuel|petrol'),
+    ('phone and internet', r'phone|internet|mobile|telecom'),
+    ('e-commerce', r'e-?commerce|online shopping'),
+    ('miscellaneous', r'miscellaneous|misc'),
+]
+CATEGORY_PATTERNS = [(category, re.compile(rf'\b(?:{pattern})\b')) for category, pattern in CATEGORY_KEYWORDS]
+# Stems matched against the LLM's free-text category, which varies ("Grocery", "groceries and supermarkets")
+CATEGORY_STEMS = {
+    'food delivery': 'food deliver',
+    'restaurants and cafes': 'restaurant',
+    'groceries': 'grocer',
+    'fitness': 'fitness',
+    'healthcare': 'health',
+    'clothing': 'cloth',
+    'jewelry': 'jewel',
+    'transportation': 'transport',
+    'phone and internet': 'phone',
+    'e-commerce': 'commerce',
+    'miscellaneous': 'misc',
+}
+
+# Questions mentioning several things or a time window are left to the LLM
+COMPLEX_PATTERN = re.compile(
+    r'\b(compare|comparison|versus|vs|between|month|week|day|daily|weekly|monthly|year|yesterday|today|last|'
+    r'january|february|march|april|may|june|july|august|september|october|november|december|'
+    r'average|mean|count|how many|times|top|list|where|which|when|except|without|not)\b|\bfood\b(?! deliver)'
+)
+SPEND_PATTERN = re.compile(r'\b(spen[dt]|spending|expen(se|ses|diture)|paid|pay|cost)\b')
+TOTAL_PATTERN = re.compile(r'\b(total|overall|altogether|in total|sum)\b|\bhow much (did|have) i spen[dt]\b')
+SUMMARY_PATTERN = re.compile(r'\b(summary|summari[sz]e|breakdown|break down|report|by category|per category)\b')
+# Words a template question may consist of besides its categories; anything else, such as a
+# merchant or a place ("at carrefour", "in dubai"), narrows the question and is left to the LLM
+INTENT_WORDS_PATTERN = re.compile(
+    r'\b(spen[dt]|spending|expen(se|ses|diture)|paid|pay|costs?|total|overall|altogether|sum|'
+    r'summary|summari[sz]e|breakdown|break down|report|by category|per category|'
+    r'biggest|largest|highest|most expensive|costliest|maximum|max|'
+    r'purchases?|transactions?|payments?|buy|bought)\b'
+)
+FILLER_WORDS = {
+    'i', 'me', 'my', 'we', 'our', 'you', 'your', 'what', "what's", 'whats', 'was', 'is', 'are', 'were', 'the',
+    'a', 'an', 'of', 'on', 'in', 'at', 'for', 'to', 'from', 'with', 'and', 'do', 'does', 'did', 'have', 'has',
+    'had', 'how', 'much', 'give', 'show', 'tell', 'please', 'pls', 'plz', 'can', 'could', 'get', 'all', 'so',
+    'far', 'amount', 'money', 'ever', 'single', 'made', 'whole', 'statement', 'category', 'categories', 'wise',
+    'shopping', 'up',
+}
+BIGGEST_PATTERN = re.compile(
+    r'\b(biggest|largest|highest|most expensive|costliest|maximum|max)\b.*'
+    r'\b(purchase|expense|transaction|spend|payment|buy)\b'
+)
+
+
+def normalize_question(question):
+    """
+    Normalize a question for cache lookups: lower-cased, punctuation dropped, whitespace collapsed.
+
+    Args:
+        question (str): The user's question.
+
+    Returns:
+        str: Normalized question.
+    """
+    question = re.sub(r"[^\w\s\-']", ' ', question.lower())
+    return re.sub(r'\s+', ' ', question).strip()
+
+
+def _quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _quote_literal(value):
+    return "'" + value.replace("'", "''") + "'"
+
+
+SQL_TEMPLATES = {
+    'total': 'SELECT SUM(Amount) AS Total FROM {table};',
+    'summary': (
+        'SELECT Category_freetext, SUM(Amount) AS Total FROM {table} '
+        'GROUP BY Category_freetext ORDER BY Total DESC;'
+    ),
+    'biggest_purchase': 'SELECT Merchant, Date, Amount, Category_freetext FROM {table} ORDER BY Amount DESC LIMIT 1;',
+    'category_total': (
+        'SELECT SUM(Amount) AS Total FROM {table} WHERE Category = {category} OR Category_freetext LIKE {stem};'
+    ),
+}
+
+
+def _has_qualifier(question):
+    """Whether a question has words besides intent words, categories and filler, e.g. a merchant or place."""
+    for _, pattern in CATEGORY_PATTERNS:
+        question = pattern.sub(' ', question)
+    question = INTENT_WORDS_PATTERN.sub(' ', question)
+    return any(word not in FILLER_WORDS for word in question.split())
+
+
+def match_intent(question):
+    """
+    Recognize the common question shapes that don't need the LLM.
+
+    Args:
+        question (str): Normalized question.
+
+    Returns:
+        tuple: (intent name, parameters), or None if the question should go to the LLM.
+    """
+    if COMPLEX_PATTERN.search(question) or _has_qualifier(question):
+        return None
+    categories = [category for category, pattern in CATEGORY_PATTERNS if pattern.search(question)]
+    if len(categories) > 1:
+        return None
+    if BIGGEST_PATTERN.search(question):
+        return None if categories else ('biggest_purchase', {})
+    if categories:
+        if SPEND_PATTERN.search(question) or TOTAL_PATTERN.search(question):
+            return 'category_total', {'category': categories[0], 'stem': f'%{CATEGORY_STEMS[categories[0]]}%'}
+        return None
+    if SUMMARY_PATTERN.search(question):
+        return 'summary', {}
+    if TOTAL_PATTERN.search(question):
+        return 'total', {}
+    return None
+
+
+def rule_based_sql(question, table):
+    """
+    Build SQL for a recognized question without calling the LLM.
+
+    The templates only take the table name and a category drawn from
+    CATEGORY_KEYWORDS with its CATEGORY_STEMS pattern, all quoted before
+    being bound in. Questions naming anything else, such as a merchant or a
+    place, are left to the LLM.
+
+    Args:
+        question (str): The user's question.
+        table (str): Table or view to query.
+
+    Returns:
+        str: SQL query, or None if the question is not recognized.
+    """
+    match = match_intent(normalize_question(question))
+    if match is None:
+        return None
+    intent, params = match
+    bound = {name: _quote_literal(value) for name, value in params.items()}
+    return SQL_TEMPLATES[intent].format(table=_quote_identifier(table), **bound)
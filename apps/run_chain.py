@@ -1,28 +1,86 @@
-import os
+import asyncio
+import logging
 import re
-from dotenv import load_dotenv
-from langchain import PromptTemplate, LLMChain
-from langchain.chat_models import ChatOpenAI
-from langchain.schema import HumanMessage, SystemMessage
-from langchain_community.utilities import SQLDatabase
+import threading
+from collections import OrderedDict
+from apps.categories import CATEGORIES
+from apps.clients import get_backend, get_llm, get_sql_database, load_env
+from apps.query_guard import GuardedExecutor, QueryRejected
+from apps.question_router import normalize_question, rule_based_sql
+from apps.statement_catalog import StatementCatalog
+from apps.tracing import metrics, span, tracer
+
+# Columns of every statement view, used when the table can't be inspected
+STATEMENT_COLUMNS = ["Merchant", "Location", "Date", "Amount", "Category_freetext", "Category"]
+
+SQL_PROMPT = """You are SpendWise, an assistant that writes SQLite queries over a user's expense history.
+Use the table "{table}" with these columns: {columns}.
+Date is text formatted YYYY-MM-DD{dates}. Amounts are in AED.
+Category_freetext takes these values: {categories}.
+- Filter and group on the 'Category_freetext' column, using the values above exactly.
+- For summaries, provide the total expense for each category in descending order.
+- For totals, calculate the sum of all categories.
+- For comparisons, provide results for all mentioned categories in the order specified.
+- For specific items, group all relevant categories (e.g., 'food' includes food delivery, groceries, restaurants and cafes).
+- A follow-up question refers to the earlier questions of the conversation; keep their filters unless it changes them.
+Reply with the SQL query only, without explaining it."""
 
 class SpendWise:
-    def __init__(self, db_path="sqlite:///expenses.db", model="tiiuae/falcon-180B-chat"):
-        load_dotenv()
-        self.api_key = os.getenv("AI71_API_KEY")
-        self.db = SQLDatabase.from_uri(db_path)
-        self.llm = ChatOpenAI(
-            model=model,
-            api_key=self.api_key,
-            base_url="https://api.ai71.ai/v1/",
-            temperature=0,
-        )
+    def __init__(self, db_path="sqlite:///expenses.db", model=None, sql_cache_size=512, llm_backend=None,
+                 max_prompt_categories=40):
+        load_env()
+        # llm_backend is a name from apps.clients.BACKENDS ("ai71", "stub") or an LLMBackend
+        self.llm_backend = get_backend(llm_backend)
+        self.api_key = self.llm_backend.api_key
+        self.db_path = db_path
+        self.model = model or self.llm_backend.model
+        self._db = None
+        self._executor = None
+        self._store = None
+        self._llm = None
         self.file_mapping = {
             "july": "bank_statement_july",
             "august": "bank_statement_august",
             "september": "bank_statement_sep",
             "uploaded_file": "new_file"
         }
+        self.sql_cache_size = sql_cache_size
+        self._sql_cache = OrderedDict()
+        self._sql_cache_lock = threading.Lock()
+        self.max_prompt_categories = max_prompt_categories
+        # (data version, rendered SQL system prompt) per table; the prompt stays byte-identical while the
+        # table's data does, so providers can cache the prefix
+        self._sql_prompts = {}
+
+    @property
+    def db(self):
+        """Shared database handle, opened on first query."""
+        if self._db is None:
+            self._db = get_sql_database(self.db_path)
+        return self._db
+
+    @property
+    def executor(self):
+        """Guarded read-only executor for SQLite databases, None for other database URIs."""
+        if self._executor is None and self.db_path.startswith("sqlite:///"):
+            self._executor = GuardedExecutor(self.db_path[len("sqlite:///"):])
+        return self._executor
+
+    @property
+    def store(self):
+        """Expenses store of a SQLite database, for data versions; None for other database URIs."""
+        if self._store is None and self.db_path.startswith("sqlite:///"):
+            from apps.expense_store import ExpenseStore
+
+            self._store = ExpenseStore(self.db_path[len("sqlite:///"):])
+        return self._store
+
+    @property
+    def llm(self):
+        """Shared chat model client, created on first LLM call."""
+        if self._llm is None:
+            self._llm = get_llm(self.model, backend=self.llm_backend)
+        return self._llm
 
     @staticmethod
     def clean_sql_query(query):
@@ -30,45 +88,184 @@ class SpendWise:
         cleaned_query = re.split(r';\s*', query)[0] + ';'
         return cleaned_query.strip()
 
-    def generate_sql_query(self, question, table_name):
-        """Generates a SQL query using the LLM based on the user's question."""
+    def _table_schema(self, table):
+        """Columns, date range and category values of a table, read from the database."""
+        columns, dates, categories = STATEMENT_COLUMNS, None, CATEGORIES
+        if self.executor is not None:
+            columns = self.executor.run(f'SELECT * FROM "{table}" LIMIT 0', table).columns
+            dates = self.executor.run(f'SELECT MIN(Date), MAX(Date) FROM "{table}"', table).rows[0]
+            categories = [row[0] for row in self.executor.run(
+                f'SELECT Category_freetext FROM "{table}" WHERE Category_freetext IS NOT NULL '
+                f'GROUP BY Category_freetext ORDER BY COUNT(*) DESC LIMIT {self.max_prompt_categories}', table
+            ).rows]
+        return columns, dates, categories
+
+    def sql_prompt(self, table):
+        """
+        Returns the SQL-generation system prompt for a table, rendering it when the table's data changes.
+
+        The prompt lists the table's actual columns, date range and category values, so the LLM
+        filters on values that exist. It is cached per table under the statement's data version,
+        so statements that gain transactions get a fresh prompt. If the table can't be read, the
+        default columns and categories are used and the prompt is rendered again on the next call.
+        """
+        version = self.store.statement_version(table) if self.store is not None else None
+        cached = self._sql_prompts.get(table)
+        if cached is not None and cached[0] == version:
+            prompt = cached[1]
+        else:
+            try:
+                columns, dates, categories = self._table_schema(table)
+            except QueryRejected as e:
+                logging.warning(f"Could not read the schema of '{table}', using the defaults: {e}")
+                columns, dates, categories = STATEMENT_COLUMNS, None, CATEGORIES
+                cache = False
+            else:
+                cache = True
+            prompt = SQL_PROMPT.format(
+                table=table,
+                columns=", ".join(columns),
+                dates=f"; the data runs from {dates[0]} to {dates[1]}" if dates and dates[0] else "",
+                categories=", ".join(categories or CATEGORIES),
+            )
+            if cache:
+                self._sql_prompts[table] = (version, prompt)
+        return prompt
+
+    def _sql_messages(self, table, question, context=None):
+        """Builds the messages asking the LLM for SQL: the table's prompt, any conversation context, the question."""
+        from langchain_core.messages import HumanMessage, SystemMessage
+
+        return [SystemMessage(content=self.sql_prompt(table)), *(context or []),
+                HumanMessage(content=f"Question: {question}\nAnswer:")]
+
+    def _resolve_table(self, table_name):
+        # Uploaded statements are queried through their own view, named after the upload's content hash
         table = self.file_mapping.get(table_name)
+        if not table and StatementCatalog.is_statement(table_name):
+            table = table_name
         if not table:
             raise ValueError(f"Invalid table name: {table_name}")
+        return table
 
-        template = f"""
-        You are an intelligent MySQL chatbot and your name is SpendWise who will talk about expense history. Help the following question with a brilliant answer. Get the expense data from SQL database named 'expenses'.
-        Use the table "{table}" with these columns:
-        Merchant, Location, Date, Amount, Category_freetext, Category. 
-        Categories include: fitness, groceries, restaurants and cafes, healthcare, clothing, jewelry, transportation, phone and internet, miscellaneous, others, e-commerce, food delivery.
-        - Provide SQL queries based only on the 'Category_freetext' column.
-        - For summaries, provide the total expense for each category in descending order.
-        - For totals, calculate the sum of all categories.
-        - For comparisons, provide results for all mentioned categories in the order specified.
-        - For specific items, group all relevant categories (e.g., 'food' includes food delivery, groceries, restaurants and cafes).
-        Do not append any characters or explain the SQL query.
-        Question:{{question}}
-        Answer:"""
-
-        prompt = PromptTemplate(template=template, input_variables=['question'])
-        llm_chain = LLMChain(prompt=prompt, llm=self.llm)
-        response = llm_chain.invoke(question)
-
-        if isinstance(response["text"], str):
-            return self.clean_sql_query(response["text"])
-        else:
+    def _cached_sql(self, key):
+        with self._sql_cache_lock:
+            if key in self._sql_cache:
+                self._sql_cache.move_to_end(key)
+                return self._sql_cache[key]
+        return None
+
+    def _remember_sql(self, key, sql_query):
+        with self._sql_cache_lock:
+            self._sql_cache[key] = sql_query
+            while len(self._sql_cache) > self.sql_cache_size:
+                self._sql_cache.popitem(last=False)
+
+    def _forget_sql(self, sql_query):
+        """Drops a query that failed to execute from the cache, so its questions are asked afresh."""
+        with self._sql_cache_lock:
+            for key in [key for key, cached in self._sql_cache.items() if cached == sql_query]:
+                del self._sql_cache[key]
+
+    def _sql_from_response(self, response, current):
+        self._record_usage(current, response)
+        if not isinstance(response.content, str):
             raise ValueError("Invalid response from LLM.")
+        return self.clean_sql_query(response.content)
 
-    def execute_query(self, query):
-        """Executes a SQL query and returns the result."""
-        try:
-            result = self.db.run(query)
+    def _lookup_sql(self, question, table, current):
+        """Returns the SQL from the cache or the templates, recording which one answered, or None."""
+        key = (normalize_question(question), table)
+        sql_query = self._cached_sql(key)
+        if sql_query is not None:
+            metrics.inc("sql_cache_hits")
+            current.set(source="cache")
+            return key, sql_query
+        sql_query = rule_based_sql(question, table)
+        if sql_query is not None:
+            metrics.inc("sql_template_hits")
+            current.set(source="template")
+            self._remember_sql(key, sql_query)
+        else:
+            metrics.inc("llm_calls", purpose="sql")
+            current.set(source="llm")
+        return key, sql_query
+
+    def generate_sql_query(self, question, table_name, context=None):
+        """
+        Generates a SQL query based on the user's question.
+
+        Common questions (totals, per-category summaries, biggest purchase, spend in one category)
+        are answered from SQL templates; anything else goes to the LLM. Results are cached per
+        normalized question and table until execute_query finds they fail. Questions asked with a conversation context (see
+        apps.chat_session) depend on it, so they always go to the LLM and are not cached.
+        """
+        table = self._resolve_table(table_name)
+        with span("generate_sql", table=table) as current:
+            if context:
+                key, sql_query = None, None
+                metrics.inc("llm_calls", purpose="sql")
+                current.set(source="llm", context=len(context))
+            else:
+                key, sql_query = self._lookup_sql(question, table, current)
+            if sql_query is None:
+                response = self.llm.invoke(self._sql_messages(table, question, context))
+                sql_query = self._sql_from_response(response, current)
+                if key is not None:
+                    self._remember_sql(key, sql_query)
+        return sql_query
+
+    async def agenerate_sql_query(self, question, table_name, context=None):
+        """Async counterpart of generate_sql_query."""
+        table = self._resolve_table(table_name)
+        with span("generate_sql", table=table) as current:
+            if context:
+                key, sql_query = None, None
+                metrics.inc("llm_calls", purpose="sql")
+                current.set(source="llm", context=len(context))
+            else:
+                key, sql_query = self._lookup_sql(question, table, current)
+            if sql_query is None:
+                response = await self.llm.ainvoke(self._sql_messages(table, question, context))
+                sql_query = self._sql_from_response(response, current)
+                if key is not None:
+                    self._remember_sql(key, sql_query)
+        return sql_query
+
+    def execute_query(self, query, table_name=None):
+        """
+        Executes a SQL query and returns a compact summary of its rows.
+
+        On SQLite the query runs through the guarded executor: read-only, limited
+        to the statement's table when table_name is given, refused when its plan
+        is too expensive, stopped at the timeout and capped in rows and bytes.
+        """
+        with span("execute_query") as current:
+            try:
+                if self.executor is not None:
+                    table = self._resolve_table(table_name) if table_name else None
+                    rows = self.executor.run(query, table)
+                    current.set(rows=len(rows.rows), truncated=rows.truncated)
+                    result = rows.summary()
+                else:
+                    result = self.db.run(query)
+            except Exception as e:
+                metrics.inc("query_errors")
+                current.set(failed=True)
+                self._forget_sql(query)
+                return f"Error executing query: {e}"
+            current.set(result_chars=len(result or ""))
             return result if result else "No contents to share at the moment."
-        except Exception as e:
-            return f"Error executing query: {e}"
 
-    def generate_answer(self, question, result):
-        """Generates an answer using the LLM based on the SQL result."""
+    async def aexecute_query(self, query, table_name=None):
+        """Executes a SQL query in a worker thread so the event loop stays free."""
+        return await asyncio.to_thread(self.execute_query, query, table_name)
+
+    @staticmethod
+    def _answer_messages(question, result, context=None):
+        """Builds the messages asking the LLM to answer the question from the SQL result, after any context."""
+        from langchain_core.messages import HumanMessage, SystemMessage
+
         system_message = SystemMessage(content="""
         You are an expense assistant and your name is SpendWise. Given the following user question and the corresponding SQL result, answer the user question based on the data present in SQL result and ignore what you are not provided with. If The result info appears to be an empty tuple, just say that the user has not made any expense. The currency used is AED. If you are asked to get the summary report, get the list of expenses corresponding to each category from SQL result and provide only that in the answer. You must not compute total sum at your end. If user is asking any other questions, give tricky and intelligent responses.""")
 
@@ -77,17 +274,131 @@ class SpendWise:
         SQL Result: {result}
         Answer:
         """)
+        return [system_message, *(context or []), human_message]
+
+    @staticmethod
+    def _record_usage(current, message):
+        """Copies the token usage the LLM reported, if any, onto the span and the token counters."""
+        usage = getattr(message, "usage_metadata", None) or {}
+        for kind in ("input_tokens", "output_tokens"):
+            if usage.get(kind):
+                current.add(kind, usage[kind])
+                metrics.inc("llm_tokens", usage[kind], kind=kind[:-len("_tokens")])
+
+    def generate_answer(self, question, result, context=None):
+        """Generates an answer using the LLM based on the SQL result."""
+        metrics.inc("llm_calls", purpose="answer")
+        with span("generate_answer") as current:
+            response = self.llm.invoke(self._answer_messages(question, result, context))
+            self._record_usage(current, response)
+        return response.content
 
-        response = self.llm.invoke([system_message, human_message])
+    async def agenerate_answer(self, question, result, context=None):
+        """Async counterpart of generate_answer."""
+        metrics.inc("llm_calls", purpose="answer")
+        with span("generate_answer") as current:
+            response = await self.llm.ainvoke(self._answer_messages(question, result, context))
+            self._record_usage(current, response)
         return response.content
 
+    def stream_answer(self, question, result, parent=None, context=None):
+        """
+        Yields the answer's tokens as the LLM produces them.
+
+        The span is opened with tracer.start since it stays open across yields; its ``tokens``
+        attribute counts streamed chunks.
+        """
+        metrics.inc("llm_calls", purpose="answer")
+        current = tracer.start("generate_answer", parent)
+        error = None
+        try:
+            for chunk in self.llm.stream(self._answer_messages(question, result, context)):
+                self._record_usage(current, chunk)
+                if chunk.content:
+                    current.add("tokens")
+                    yield chunk.content
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            tracer.finish(current, error)
+
+    async def astream_answer(self, question, result, parent=None, context=None):
+        """Async counterpart of stream_answer."""
+        metrics.inc("llm_calls", purpose="answer")
+        current = tracer.start("generate_answer", parent)
+        error = None
+        try:
+            async for chunk in self.llm.astream(self._answer_messages(question, result, context)):
+                self._record_usage(current, chunk)
+                if chunk.content:
+                    current.add("tokens")
+                    yield chunk.content
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            tracer.finish(current, error)
+
     def run(self, question, table_name):
         """Runs the complete chain to generate the final answer."""
-        sql_query = self.generate_sql_query(question, table_name)
-        result = self.execute_query(sql_query)
-        final_answer = self.generate_answer(question, result)
+        with span("chat", table=table_name):
+            sql_query = self.generate_sql_query(question, table_name)
+            result = self.execute_query(sql_query, table_name)
+            final_answer = self.generate_answer(question, result)
         return final_answer
 
+    def run_stream(self, question, table_name, show_result=False):
+        """
+        Runs the complete chain, yielding the answer text so far each time a token arrives.
+
+        With show_result, the SQL result is yielded first, before the answer starts.
+        """
+        trace = tracer.start("chat", table=table_name)
+        error = None
+        try:
+            with tracer.activate(trace):
+                sql_query = self.generate_sql_query(question, table_name)
+                result = self.execute_query(sql_query, table_name)
+            text = f"SQL result: {result}\n\n" if show_result else ""
+            if text:
+                yield text
+            for token in self.stream_answer(question, result, parent=trace):
+                text += token
+                yield text
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            tracer.finish(trace, error)
+
+    async def arun(self, question, table_name):
+        """Async counterpart of run."""
+        with span("chat", table=table_name):
+            sql_query = await self.agenerate_sql_query(question, table_name)
+            result = await self.aexecute_query(sql_query, table_name)
+            return await self.agenerate_answer(question, result)
+
+    async def arun_stream(self, question, table_name, show_result=False):
+        """Async counterpart of run_stream."""
+        trace = tracer.start("chat", table=table_name)
+        error = None
+        try:
+            with tracer.activate(trace):
+                sql_query = await self.agenerate_sql_query(question, table_name)
+                result = await self.aexecute_query(sql_query, table_name)
+            text = f"SQL result: {result}\n\n" if show_result else ""
+            if text:
+                yield text
+            async for token in self.astream_answer(question, result, parent=trace):
+                text += token
+                yield text
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            tracer.finish(trace, error)
+
 if __name__ == "__main__":
     spendwise_instance = SpendWise()  # Create an instance of SpendWise
     result = spendwise_instance.run("Total expenditure", "july")  # Call the `run` method
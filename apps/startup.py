@@ -0,0 +1,68 @@
+import json
+import subprocess
+import sys
+
+# Seconds allowed for importing app and constructing SpendWiseApp in a fresh interpreter
+STARTUP_BUDGET_SECONDS = 1.5
+# Modules that must only be imported when first used
+DEFERRED_MODULES = [
+    "gradio", "langchain", "langchain_openai", "langchain_community", "openai", "plotly", "pdfplumber", "sqlalchemy",
+]
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.SpendWiseApp()
+constructed = time.perf_counter()
+print(json.dumps({
+    "import_seconds": imported - start,
+    "construct_seconds": constructed - imported,
+    "loaded": [name for name in %r if name in sys.modules],
+}))
+"""
+
+
+def measure_startup(cwd=None):
+    """
+    Measure cold start in a fresh interpreter.
+
+    Args:
+        cwd (str): Directory containing app.py; defaults to the current one.
+
+    Returns:
+        dict: import_seconds, construct_seconds, total_seconds and the deferred
+        modules that were loaded anyway.
+    """
+    output = subprocess.run(
+        [sys.executable, "-c", _PROBE % (DEFERRED_MODULES,)],
+        cwd=cwd, capture_output=True, text=True, check=True,
+    ).stdout
+    report = json.loads(output.strip().splitlines()[-1])
+    report["total_seconds"] = report["import_seconds"] + report["construct_seconds"]
+    return report
+
+
+def check_startup(budget=STARTUP_BUDGET_SECONDS, cwd=None):
+    """
+    Check cold start against the budget.
+
+    Args:
+        budget (float): Seconds allowed for import plus construction.
+        cwd (str): Directory containing app.py.
+
+    Returns:
+        tuple: (True if within budget and no deferred module was loaded, report).
+    """
+    report = measure_startup(cwd)
+    return report["total_seconds"] <= budget and not report["loaded"], report
+
+
+if __name__ == "__main__":
+    ok, report = check_startup()
+    print(f"import: {report['import_seconds']:.3f}s, construct: {report['construct_seconds']:.3f}s, "
+          f"budget: {STARTUP_BUDGET_SECONDS:.1f}s")
+    if report["loaded"]:
+        print(f"Loaded at startup but should be deferred: {', '.join(report['loaded'])}")
+    sys.exit(0 if ok else 1)
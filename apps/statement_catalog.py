@@ -0,0 +1,183 @@
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from apps.expense_store import ExpenseStore
+
+
+class StatementCatalog:
+    """
+    Registry of the statements each user or session has uploaded.
+
+    Uploaded PDFs are stored once under their content hash, and the statement
+    (table/view) name is derived from that hash, so the same file uploaded
+    twice, by one user or by several, is stored and ingested once and simply
+    listed in each owner's catalog.
+    """
+
+    TABLE = "statement_catalog"
+    STATEMENT_PATTERN = re.compile(r"^stmt_[0-9a-f]{16}$")
+
+    def __init__(self, db_path='expenses.db', storage_dir='./upload_data/statements'):
+        """
+        Initialize the catalog and create its table if needed.
+
+        Args:
+            db_path (str): Path to the SQLite database.
+            storage_dir (str): Directory holding the content-addressed PDFs.
+        """
+        self.db_path = db_path
+        self.storage_dir = storage_dir
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.TABLE} ("
+                "owner TEXT NOT NULL, statement TEXT NOT NULL, label TEXT NOT NULL, "
+                "file_hash TEXT NOT NULL, uploaded_at REAL NOT NULL, PRIMARY KEY (owner, statement))"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path)
+        ExpenseStore.configure_connection(conn)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def statement_name(file_hash):
+        """
+        Derive the statement name of a file from its content hash.
+
+        Args:
+            file_hash (str): SHA-256 of the file.
+
+        Returns:
+            str: Statement name, also used as its table/view name.
+        """
+        return f"stmt_{file_hash[:16]}"
+
+    @classmethod
+    def is_statement(cls, name):
+        """
+        Check whether a name has the shape of a catalog statement.
+
+        Args:
+            name (str): Candidate statement name.
+
+        Returns:
+            bool: True if the name could come from statement_name.
+        """
+        return isinstance(name, str) and bool(cls.STATEMENT_PATTERN.match(name))
+
+    def _store_file(self, file_path, statement):
+        """Copy a file into content-addressed storage unless it is already there."""
+        os.makedirs(self.storage_dir, exist_ok=True)
+        target_path = os.path.join(self.storage_dir, f"{statement}.pdf")
+        if not os.path.exists(target_path):
+            # Copy then rename, so concurrent uploads of the same file never see a partial copy
+            fd, tmp_path = tempfile.mkstemp(dir=self.storage_dir, suffix=".part")
+            os.close(fd)
+            shutil.copyfile(file_path, tmp_path)
+            os.replace(tmp_path, target_path)
+        return target_path
+
+    def add(self, owner, file_path, label=None):
+        """
+        Register an uploaded statement in an owner's catalog.
+
+        Args:
+            owner (str): User name or session id.
+            file_path (str): Path to the uploaded PDF.
+            label (str): Name shown in the dropdown; defaults to the file name.
+
+        Returns:
+            dict: statement, label, stored path, and whether the owner already had it.
+        """
+        file_hash = ExpenseStore.file_hash(file_path)
+        statement = self.statement_name(file_hash)
+        label = label or os.path.splitext(os.path.basename(file_path))[0]
+
+        # Under the lock, so expire can't delete the stored file before it is listed
+        with self._lock, self._connect() as conn:
+            stored_path = self._store_file(file_path, statement)
+            row = conn.execute(
+                f"SELECT label FROM {self.TABLE} WHERE owner = ? AND statement = ?", (owner, statement)
+            ).fetchone()
+            if row:
+                return {"statement": statement, "label": row[0], "path": stored_path, "duplicate": True}
+            taken = {r[0] for r in conn.execute(f"SELECT label FROM {self.TABLE} WHERE owner = ?", (owner,))}
+            unique_label, n = label, 2
+            while unique_label in taken:
+                unique_label, n = f"{label} ({n})", n + 1
+            conn.execute(
+                f"INSERT INTO {self.TABLE} VALUES (?, ?, ?, ?, ?)",
+                (owner, statement, unique_label, file_hash, time.time())
+            )
+        return {"statement": statement, "label": unique_label, "path": stored_path, "duplicate": False}
+
+    def list(self, owner):
+        """
+        List an owner's statements, newest first.
+
+        Args:
+            owner (str): User name or session id.
+
+        Returns:
+            list: (label, statement) pairs.
+        """
+        with self._connect() as conn:
+            return conn.execute(
+                f"SELECT label, statement FROM {self.TABLE} WHERE owner = ? ORDER BY uploaded_at DESC", (owner,)
+            ).fetchall()
+
+    def owns(self, owner, statement):
+        """
+        Check whether a statement is in an owner's catalog.
+
+        Args:
+            owner (str): User name or session id.
+            statement (str): Statement name.
+
+        Returns:
+            bool: True if the owner uploaded this statement.
+        """
+        with self._connect() as conn:
+            return conn.execute(
+                f"SELECT 1 FROM {self.TABLE} WHERE owner = ? AND statement = ?", (owner, statement)
+            ).fetchone() is not None
+
+    def expire(self, owner_prefix, max_age):
+        """
+        Drop catalog entries of owners under a prefix, such as anonymous browser sessions, once they are old.
+
+        Stored PDFs no owner lists any more are deleted too. Their transactions stay in the
+        expenses database, so uploading the same file again is not ingested twice.
+
+        Args:
+            owner_prefix (str): Prefix of the owners to expire, e.g. "session:".
+            max_age (float): Seconds since upload after which an entry is dropped.
+
+        Returns:
+            int: Number of catalog entries dropped.
+        """
+        cutoff = time.time() - max_age
+        with self._lock, self._connect() as conn:
+            dropped = conn.execute(
+                f"DELETE FROM {self.TABLE} WHERE substr(owner, 1, ?) = ? AND uploaded_at < ?",
+                (len(owner_prefix), owner_prefix, cutoff)
+            ).rowcount
+            listed = {row[0] for row in conn.execute(f"SELECT DISTINCT statement FROM {self.TABLE}")}
+            if dropped and os.path.isdir(self.storage_dir):
+                for file_name in os.listdir(self.storage_dir):
+                    statement, ext = os.path.splitext(file_name)
+                    if ext == ".pdf" and self.is_statement(statement) and statement not in listed:
+                        os.remove(os.path.join(self.storage_dir, file_name))
+        return dropped
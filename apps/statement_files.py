@@ -0,0 +1,177 @@
+import logging
+import os
+
+import pandas as pd
+
+# Storage formats for parsed statements; the columnar ones need pyarrow
+FORMATS = {"csv": ".csv", "parquet": ".parquet", "feather": ".feather"}
+# Columns the dashboard reads
+DASHBOARD_COLUMNS = ["Date", "Amount", "Category_freetext", "Merchant", "Location"]
+# Low-cardinality text columns, stored as categoricals
+CATEGORICAL_COLUMNS = ["Location", "Category_freetext", "Category"]
+
+
+def columnar_available():
+    """
+    Check whether the columnar formats can be used.
+
+    Returns:
+        bool: True if pyarrow is installed.
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def resolve_format(storage_format):
+    """
+    Pick the format statements are actually written in.
+
+    Args:
+        storage_format (str): Requested format, one of FORMATS.
+
+    Returns:
+        str: The requested format, or "csv" when pyarrow is missing.
+    """
+    if storage_format not in FORMATS:
+        raise ValueError(f"Unknown storage format: {storage_format}")
+    if storage_format != "csv" and not columnar_available():
+        logging.warning(f"pyarrow is not installed, storing statements as CSV instead of {storage_format}.")
+        return "csv"
+    return storage_format
+
+
+def typed_statement(df):
+    """
+    Give a statement's columns their real types: dates as datetimes, amounts as
+    floats and repetitive text as categoricals.
+
+    Args:
+        df (pd.DataFrame): Statement transactions.
+
+    Returns:
+        pd.DataFrame: Typed copy of the statement.
+    """
+    df = df.copy()
+    if "Date" in df:
+        df["Date"] = pd.to_datetime(df["Date"])
+    if "Amount" in df:
+        df["Amount"] = pd.to_numeric(df["Amount"])
+    for column in CATEGORICAL_COLUMNS:
+        if column in df:
+            df[column] = df[column].astype("category")
+    return df
+
+
+def statement_path(base_path, storage_format):
+    """
+    Path of a statement file in a given format.
+
+    Args:
+        base_path (str): Statement path with or without extension.
+        storage_format (str): One of FORMATS.
+
+    Returns:
+        str: base_path with the format's extension.
+    """
+    return os.path.splitext(base_path)[0] + FORMATS[storage_format]
+
+
+def write_statement(df, base_path, storage_format="csv", export_csv=True):
+    """
+    Write a parsed statement.
+
+    Args:
+        df (pd.DataFrame): Statement transactions.
+        base_path (str): Statement path; the extension is replaced by the format's.
+        storage_format (str): One of FORMATS.
+        export_csv (bool): Also write the CSV copy when storing in a columnar format.
+
+    Returns:
+        str: Path of the file in storage_format.
+    """
+    storage_format = resolve_format(storage_format)
+    csv_path = statement_path(base_path, "csv")
+    if storage_format == "csv" or export_csv:
+        df.to_csv(csv_path)
+    if storage_format == "csv":
+        return csv_path
+
+    path = statement_path(base_path, storage_format)
+    typed = typed_statement(df).reset_index(drop=True)
+    tmp_path = path + ".part"
+    if storage_format == "parquet":
+        typed.to_parquet(tmp_path, index=False)
+    else:
+        typed.to_feather(tmp_path)
+    # Readers never see a half-written file
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_statement(path, columns=None):
+    """
+    Read a statement file, loading only the requested columns.
+
+    Feather files are memory-mapped, and columnar files keep the types they were
+    written with, so dates are not parsed again.
+
+    Args:
+        path (str): Statement file in one of FORMATS.
+        columns (list): Columns to load; None loads all of them.
+
+    Returns:
+        pd.DataFrame: Statement transactions with a datetime Date column.
+    """
+    extension = os.path.splitext(path)[1]
+    if extension == FORMATS["parquet"]:
+        return pd.read_parquet(path, columns=columns)
+    if extension == FORMATS["feather"]:
+        from pyarrow import feather
+        return feather.read_table(path, columns=columns, memory_map=True).to_pandas()
+
+    usecols = (lambda column: column in columns) if columns else None
+    data = pd.read_csv(path, usecols=usecols)
+    if "Date" in data:
+        data["Date"] = pd.to_datetime(data["Date"])
+    return data
+
+
+def find_statement(csv_path):
+    """
+    Find the fastest copy of a statement: a columnar file next to the CSV that is
+    at least as new as it, or the CSV itself.
+
+    Args:
+        csv_path (str): Path of the statement's CSV file.
+
+    Returns:
+        str: Path to read the statement from.
+    """
+    try:
+        csv_mtime = os.stat(csv_path).st_mtime_ns
+    except FileNotFoundError:
+        csv_mtime = None
+    for storage_format in ("feather", "parquet"):
+        path = statement_path(csv_path, storage_format)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            continue
+        if csv_mtime is None or mtime >= csv_mtime:
+            return path
+    return csv_path
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert statement CSV files to a columnar format.")
+    parser.add_argument("csv_files", nargs="+")
+    parser.add_argument("--format", choices=["parquet", "feather"], default="parquet")
+    args = parser.parse_args()
+    for csv_file in args.csv_files:
+        data = pd.read_csv(csv_file, index_col=0)
+        print(write_statement(data, csv_file, args.format, export_csv=False))
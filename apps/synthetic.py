@@ -0,0 +1,198 @@
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+from apps.categories import CATEGORIES
+from apps.upload_file import UAE_CITIES
+
+# Raw statement table columns, as pdfplumber extracts them from a bank statement
+RAW_COLUMNS = ["Date", "Description", "Debits", "Credits", "Balance"]
+CARD_NUMBER = "4439********1246"
+
+# Page layout of generated PDFs, in points
+PAGE_WIDTH, PAGE_HEIGHT = 850, 1200
+MARGIN_TOP = 60
+ROW_HEIGHT = 24
+COLUMN_EDGES = [30, 110, 590, 670, 750, 830]
+FONT_SIZE = 7
+
+
+def bundled_merchants(data_dir="./data"):
+    """
+    Merchants and categories of the bundled sample statements.
+
+    Args:
+        data_dir (str): Directory holding the sample CSV files.
+
+    Returns:
+        pd.DataFrame: Unique Merchant, Location and Category_freetext rows.
+    """
+    frames = [pd.read_csv(path) for path in sorted(glob.glob(os.path.join(data_dir, "bank_statement_*.csv")))]
+    if not frames:
+        return pd.DataFrame(columns=["Merchant", "Location", "Category_freetext"])
+    merchants = pd.concat(frames)[["Merchant", "Location", "Category_freetext"]].dropna()
+    return merchants.drop_duplicates("Merchant").reset_index(drop=True)
+
+
+def merchant_pool(size, seed=0, data_dir="./data"):
+    """
+    Build a pool of merchants: the bundled ones first, then synthetic ones.
+
+    Args:
+        size (int): Number of merchants.
+        seed (int): Random seed.
+        data_dir (str): Directory holding the sample CSV files.
+
+    Returns:
+        pd.DataFrame: Merchant, Location and Category_freetext columns.
+    """
+    rng = np.random.default_rng(seed)
+    pool = bundled_merchants(data_dir).head(size)
+    extra = size - len(pool)
+    if extra > 0:
+        pool = pd.concat([pool, pd.DataFrame({
+            "Merchant": [f"store {i:06d}" for i in range(extra)],
+            "Location": rng.choice(UAE_CITIES, extra),
+            "Category_freetext": rng.choice(CATEGORIES, extra),
+        })], ignore_index=True)
+    return pool
+
+
+def make_transactions(rows, merchants=None, seed=0, start="2023-01-01", days=365):
+    """
+    Generate parsed, categorized transactions shaped like those PDFProcessor stores.
+
+    Args:
+        rows (int): Number of transactions.
+        merchants (int): Size of the merchant pool; defaults to one merchant per 20 rows.
+        seed (int): Random seed; the same arguments always give the same frame.
+        start (str): First transaction date.
+        days (int): Days the transactions are spread over.
+
+    Returns:
+        pd.DataFrame: Merchant, Location, Date, Amount, Transaction ID,
+        Category_freetext and Category columns, oldest first.
+    """
+    rng = np.random.default_rng(seed)
+    pool = merchant_pool(merchants or max(rows // 20, 15), seed=seed)
+    picks = rng.integers(0, len(pool), rows)
+    dates = pd.Timestamp(start) + pd.to_timedelta(np.sort(rng.integers(0, days, rows)), unit="D")
+    df = pd.DataFrame({
+        "Merchant": pool["Merchant"].to_numpy()[picks],
+        "Location": pool["Location"].to_numpy()[picks],
+        "Date": dates,
+        "Amount": np.round(rng.lognormal(3.5, 1.0, rows), 2),
+        "Transaction ID": [f"{i:09d}" for i in range(rows)],
+        "Category_freetext": pool["Category_freetext"].to_numpy()[picks],
+    })
+    df["Category"] = df["Category_freetext"]
+    return df
+
+
+def make_raw_statement(rows, merchants=None, seed=0, start="2023-01-01", days=365):
+    """
+    Generate a raw statement table, as extract_table_from_pdf writes it, whose card
+    transactions parse back into make_transactions(rows, merchants, seed, start, days).
+
+    Args:
+        rows (int): Number of card transactions.
+        merchants (int): Size of the merchant pool.
+        seed (int): Random seed.
+        start (str): First transaction date.
+        days (int): Days the transactions are spread over.
+
+    Returns:
+        pd.DataFrame: Date, Description, Debits, Credits and Balance columns.
+    """
+    tx = make_transactions(rows, merchants, seed, start, days)
+    amounts = tx["Amount"].map("{:.2f}".format)
+    description = (
+        f"CARD NO.{CARD_NUMBER} " + tx["Merchant"].str.title() + " " + tx["Location"].str.upper() + ":AE "
+        + tx["Transaction ID"] + " " + tx["Date"].dt.strftime("%d-%m-%Y") + " " + amounts + ",AED"
+    )
+    balance = np.round(1_000_000 - tx["Amount"].cumsum(), 2)
+    return pd.DataFrame({
+        "Date": (tx["Date"] + pd.Timedelta(days=2)).dt.strftime("%d %b %Y"),
+        "Description": description,
+        "Debits": "-" + amounts,
+        "Credits": balance.map("{:.2f} Cr".format),
+        "Balance": "",
+    })
+
+
+def _pdf_text(value):
+    return "(" + str(value).replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ")"
+
+
+def _page_stream(rows):
+    """Content stream of one page: a ruled table with a header row."""
+    table = [RAW_COLUMNS] + rows
+    top = PAGE_HEIGHT - MARGIN_TOP
+    bottom = top - ROW_HEIGHT * len(table)
+    ops = ["0.5 w"]
+    for i in range(len(table) + 1):
+        y = top - ROW_HEIGHT * i
+        ops.append(f"{COLUMN_EDGES[0]} {y} m {COLUMN_EDGES[-1]} {y} l S")
+    for x in COLUMN_EDGES:
+        ops.append(f"{x} {top} m {x} {bottom} l S")
+    ops.append(f"BT /F1 {FONT_SIZE} Tf")
+    for i, row in enumerate(table):
+        y = top - ROW_HEIGHT * (i + 1) + (ROW_HEIGHT - FONT_SIZE) / 2
+        for x, value in zip(COLUMN_EDGES, row):
+            if value:
+                ops.append(f"1 0 0 1 {x + 3} {y} Tm {_pdf_text(value)} Tj")
+    ops.append("ET")
+    return "\n".join(ops).encode("latin-1")
+
+
+def write_statement_pdf(path, rows, rows_per_page=40, merchants=None, seed=0, start="2023-01-01", days=365):
+    """
+    Write a synthetic bank statement PDF that extract_table_from_pdf can read.
+
+    The PDF is written directly, with one ruled table per page, so no PDF
+    library is needed.
+
+    Args:
+        path (str): Destination path.
+        rows (int): Number of card transactions.
+        rows_per_page (int): Table rows per page; 40 fill a page.
+        merchants (int): Size of the merchant pool.
+        seed (int): Random seed.
+        start (str): First transaction date.
+        days (int): Days the transactions are spread over.
+
+    Returns:
+        int: Number of pages written.
+    """
+    raw = make_raw_statement(rows, merchants, seed, start, days)[RAW_COLUMNS].values.tolist()
+    pages = [raw[i:i + rows_per_page] for i in range(0, len(raw), rows_per_page)] or [[]]
+
+    # Objects 1-3 are the catalog, page tree and font; each page adds a page and a content object
+    page_ids = [4 + 2 * i for i in range(len(pages))]
+    offsets = []
+    with open(path, "wb") as pdf:
+        def write_object(number, body):
+            offsets.append(pdf.tell())
+            pdf.write(f"{number} 0 obj\n".encode() + body + b"\nendobj\n")
+
+        pdf.write(b"%PDF-1.4\n")
+        write_object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+        write_object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>".encode())
+        write_object(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+        for page_id, page_rows in zip(page_ids, pages):
+            write_object(page_id, (
+                f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+                f"/Resources << /Font << /F1 3 0 R >> >> /Contents {page_id + 1} 0 R >>"
+            ).encode())
+            stream = _page_stream(page_rows)
+            write_object(page_id + 1, f"<< /Length {len(stream)} >>\nstream\n".encode() + stream + b"\nendstream")
+
+        xref = pdf.tell()
+        pdf.write(f"xref\n0 {len(offsets) + 1}\n0000000000 65535 f \n".encode())
+        for offset in offsets:
+            pdf.write(f"{offset:010d} 00000 n \n".encode())
+        pdf.write(f"trailer\n<< /Size {len(offsets) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return len(pages)
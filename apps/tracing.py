@@ -0,0 +1,385 @@
+import bisect
+import contextvars
+import cProfile
+import io
+import logging
+import os
+import pstats
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Upper bounds, in seconds, of the stage duration histogram buckets
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+_current_span = contextvars.ContextVar("spendwise_span", default=None)
+
+
+class Span:
+    """One timed stage of a request, with its attributes and child stages."""
+
+    __slots__ = ("name", "attrs", "children", "start", "duration", "error", "root", "profiler")
+
+    def __init__(self, name, attrs, root=False):
+        self.name = name
+        self.root = root
+        self.profiler = None
+        self.attrs = attrs
+        self.children = []
+        self.start = time.perf_counter()
+        self.duration = None
+        self.error = None
+
+    def set(self, **attrs):
+        """Set attributes, e.g. ``span.set(rows=120)``."""
+        self.attrs.update(attrs)
+
+    def add(self, name, amount=1):
+        """Add to a numeric attribute, e.g. ``span.add("tokens")`` per streamed token."""
+        self.attrs[name] = self.attrs.get(name, 0) + amount
+
+    def to_dict(self):
+        """
+        Convert the span and its children to plain data.
+
+        Returns:
+            dict: name, duration in milliseconds, attributes, error and children.
+        """
+        data = {"name": self.name, "ms": round((self.duration or 0) * 1000, 3), **self.attrs}
+        if self.error:
+            data["error"] = self.error
+        if self.children:
+            data["children"] = [child.to_dict() for child in self.children]
+        return data
+
+    def describe(self):
+        """
+        Summarize the span on one line.
+
+        Returns:
+            str: e.g. ``chat 812.4ms [generate_sql 3.1ms source=template, execute_query 5.2ms, ...]``.
+        """
+        attrs = "".join(f" {key}={value}" for key, value in self.attrs.items())
+        text = f"{self.name} {(self.duration or 0) * 1000:.1f}ms{attrs}"
+        if self.children:
+            text += " [" + ", ".join(child.describe() for child in self.children) + "]"
+        return text
+
+
+class Metrics:
+    """
+    Process-wide counters and stage duration histograms.
+
+    Counters and histograms are keyed by name plus optional labels, and can be
+    exported as a dictionary or in the Prometheus text format.
+    """
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = list(buckets)
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return (name, tuple(sorted(labels.items())))
+
+    def inc(self, name, amount=1, **labels):
+        """
+        Increase a counter.
+
+        Args:
+            name (str): Counter name, e.g. ``llm_calls``.
+            amount (int): Amount to add.
+            **labels: Label values, e.g. ``purpose="sql"``.
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        """
+        Record a duration in a histogram.
+
+        Args:
+            name (str): Histogram name, e.g. ``stage_seconds``.
+            value (float): Observed value in seconds.
+            **labels: Label values, e.g. ``stage="parse"``.
+        """
+        key = self._key(name, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"count": 0, "sum": 0.0, "max": 0.0,
+                                                     "buckets": [0] * (len(self.buckets) + 1)}
+            histogram["count"] += 1
+            histogram["sum"] += value
+            histogram["max"] = max(histogram["max"], value)
+            histogram["buckets"][index] += 1
+
+    def counter(self, name, **labels):
+        """
+        Read a counter.
+
+        Returns:
+            int: Current value, 0 if never increased.
+        """
+        with self._lock:
+            return self._counters.get(self._key(name, labels), 0)
+
+    @staticmethod
+    def _label_text(labels):
+        return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}" if labels else ""
+
+    def snapshot(self):
+        """
+        Export every counter and histogram.
+
+        Returns:
+            dict: "counters" and "histograms", keyed like ``llm_calls{purpose="sql"}``.
+        """
+        with self._lock:
+            counters = {name + self._label_text(labels): value for (name, labels), value in self._counters.items()}
+            histograms = {
+                name + self._label_text(labels): {
+                    "count": h["count"], "sum": round(h["sum"], 6), "max": round(h["max"], 6),
+                    "mean": round(h["sum"] / h["count"], 6),
+                }
+                for (name, labels), h in self._histograms.items()
+            }
+        return {"counters": dict(sorted(counters.items())), "histograms": dict(sorted(histograms.items()))}
+
+    def to_prometheus(self, prefix="spendwise_"):
+        """
+        Export every counter and histogram in the Prometheus text format.
+
+        Args:
+            prefix (str): Prepended to every metric name.
+
+        Returns:
+            str: Exposition text.
+        """
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, dict(h, buckets=list(h["buckets"]))) for key, h in self._histograms.items())
+        for (name, labels), value in counters:
+            lines.append(f"{prefix}{name}_total{self._label_text(labels)} {value}")
+        for (name, labels), h in histograms:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ["+Inf"], h["buckets"]):
+                cumulative += count
+                lines.append(f"{prefix}{name}_bucket{self._label_text(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{prefix}{name}_sum{self._label_text(labels)} {h['sum']}")
+            lines.append(f"{prefix}{name}_count{self._label_text(labels)} {h['count']}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        """Drop every counter and histogram."""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+class Tracer:
+    """
+    Records nested per-stage spans for each request.
+
+    The outermost span of a request is its trace. Finished traces are kept in
+    a bounded buffer, logged at debug level, and every span's duration feeds
+    the ``stage_seconds`` histogram. A span costs a couple of clock reads and
+    a dictionary, so tracing stays on in production; cProfile is only run for
+    requests explicitly marked with profile_next.
+    """
+
+    def __init__(self, metrics, max_traces=200, slow_seconds=5.0):
+        """
+        Args:
+            metrics (Metrics): Receives the stage durations.
+            max_traces (int): Finished traces kept for recent_traces.
+            slow_seconds (float): Traces slower than this are logged at warning level.
+        """
+        self.metrics = metrics
+        self.slow_seconds = slow_seconds
+        self._traces = deque(maxlen=max_traces)
+        self._lock = threading.Lock()
+        self._profile_requests = {}
+        self._profile_lock = threading.Lock()
+        self.profiles = deque(maxlen=20)
+
+    def start(self, name, parent=None, **attrs):
+        """
+        Open a span without making it the current one, for stages that span
+        ``yield``s, such as streamed answers. Close it with finish.
+
+        Args:
+            name (str): Stage name.
+            parent (Span): Parent span; defaults to the current span. Without
+                either the span starts a new trace.
+            **attrs: Initial attributes.
+
+        Returns:
+            Span: The open span.
+        """
+        parent = parent or _current_span.get()
+        span = Span(name, attrs, root=parent is None)
+        if parent is not None:
+            parent.children.append(span)
+        else:
+            span.profiler = self._start_profile(name)
+        return span
+
+    def finish(self, span, error=None):
+        """
+        Close a span opened with start.
+
+        Args:
+            span (Span): The span.
+            error (BaseException): Exception that ended the stage, if any.
+        """
+        if span.duration is not None:
+            return
+        span.duration = time.perf_counter() - span.start
+        if error is not None:
+            span.error = type(error).__name__
+        self.metrics.observe("stage_seconds", span.duration, stage=span.name)
+        if span.profiler is not None:
+            self._finish_profile(span)
+        if span.root:
+            self._finish_trace(span)
+
+    @contextmanager
+    def span(self, name, parent=None, **attrs):
+        """
+        Time a stage. Spans opened inside it become its children; a span opened
+        outside any other starts a new trace.
+
+        Args:
+            name (str): Stage name, e.g. ``execute_query``.
+            parent (Span): Parent span; defaults to the current span.
+            **attrs: Initial attributes.
+
+        Yields:
+            Span: Set row and token counts on it while the stage runs.
+        """
+        span = self.start(name, parent, **attrs)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            self.finish(span, e)
+            raise
+        finally:
+            _current_span.reset(token)
+            self.finish(span)
+
+    @contextmanager
+    def activate(self, span):
+        """
+        Make an open span the current one for a block, without timing it again.
+        Used between the ``yield``s of generators whose span came from start.
+
+        Args:
+            span (Span): Span opened with start.
+        """
+        token = _current_span.set(span)
+        try:
+            yield span
+        finally:
+            _current_span.reset(token)
+
+    @staticmethod
+    def current():
+        """
+        The innermost open span of the running request.
+
+        Returns:
+            Span: The span, or None outside any span.
+        """
+        return _current_span.get()
+
+    def _finish_trace(self, span):
+        with self._lock:
+            self._traces.append(span)
+        if span.duration >= self.slow_seconds:
+            logging.warning(f"Slow request: {span.describe()}")
+        elif logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(f"Trace: {span.describe()}")
+
+    def recent_traces(self, limit=20, name=None):
+        """
+        Return the latest finished traces.
+
+        Args:
+            limit (int): Maximum number of traces.
+            name (str): Only traces whose root span has this name.
+
+        Returns:
+            list: Trace dictionaries, newest first.
+        """
+        with self._lock:
+            traces = [span for span in reversed(self._traces) if name is None or span.name == name]
+        return [span.to_dict() for span in traces[:limit]]
+
+    def profile_next(self, name, output_dir=None):
+        """
+        Run the next request whose trace is named ``name`` under cProfile.
+
+        The profile's top functions are kept in ``profiles``; with
+        ``output_dir`` the raw stats are also written there for snakeviz or
+        pstats. Async requests are profiled along with whatever else the event
+        loop's thread runs meanwhile.
+
+        Args:
+            name (str): Trace name, e.g. ``chat`` or ``upload``.
+            output_dir (str): Directory for ``<name>-<timestamp>.prof`` files.
+        """
+        with self._profile_lock:
+            self._profile_requests[name] = output_dir
+
+    def _start_profile(self, name):
+        if name not in self._profile_requests:
+            return None
+        with self._profile_lock:
+            if name not in self._profile_requests:
+                return None
+            output_dir = self._profile_requests.pop(name)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            # Another profiler is already running in this thread
+            logging.warning(f"Could not profile {name}: {e}")
+            return None
+        profiler.output_dir = output_dir
+        return profiler
+
+    def _finish_profile(self, span):
+        profiler, name = span.profiler, span.name
+        profiler.disable()
+        path = None
+        if profiler.output_dir:
+            os.makedirs(profiler.output_dir, exist_ok=True)
+            path = os.path.join(profiler.output_dir, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.prof")
+            profiler.dump_stats(path)
+        text = io.StringIO()
+        pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(25)
+        self.profiles.append({"name": name, "ms": round(span.duration * 1000, 3), "path": path,
+                              "stats": text.getvalue()})
+        logging.info(f"Profiled {name} ({span.duration * 1000:.1f}ms)" + (f", saved to {path}" if path else ""))
+
+
+metrics = Metrics()
+tracer = Tracer(metrics)
+
+
+def span(name, parent=None, **attrs):
+    """Shorthand for ``tracer.span``."""
+    return tracer.span(name, parent, **attrs)
+
+
+def current_span():
+    """Shorthand for ``tracer.current``."""
+    return tracer.current()
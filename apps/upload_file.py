@@ -1,32 +1,293 @@
 import requests
 import json
 import pandas as pd
-from dotenv import load_dotenv
 import os
-import sqlite3
 import shutil
-import pdfplumber
 import logging
 import re
+from apps.merchant_cache import MerchantCategoryCache
+from apps.merchant_classifier import MerchantClassifier
+from apps.expense_store import ExpenseStore
+from apps.categories import CATEGORIES
+from apps.clients import get_backend, load_env
+from apps.statement_files import resolve_format, write_statement
+from apps.tracing import metrics, span
+import csv
+import numpy as np
+import tempfile
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+UAE_CITIES = ['Dubai', 'Abu Dhabi', 'Sharjah', 'Ajman', 'Ras Al Khaimah', 'Fujairah', 'Umm Al Quwain', 'Al Ain']
+CARD_PATTERN = re.compile(r'CARD NO\.(\d+\*{8}\d{4}) (.+):([A-Z]{2}) (\d+) (\d{2}-\d{2}-\d{4}) ([\d\.]+),([A-Z]+)')
+CITY_PATTERN = re.compile(
+    '^(?:' + '|'.join(f'(?=.*?({re.escape(city)}))' for city in UAE_CITIES) + ')', re.IGNORECASE
+)
+CITY_REMOVAL_PATTERNS = {city: re.compile(re.escape(city), re.IGNORECASE) for city in UAE_CITIES}
+
+
+class IngestionCancelled(Exception):
+    """Raised from a progress callback to abandon an ingest."""
+
+
+def _extract_page_range(pdf_path, start, stop):
+    """
+    Extract the tables of pages [start, stop) of a PDF.
+
+    Runs inside a worker process, so it opens its own handle on the file.
+
+    Args:
+        pdf_path (str): The path to the PDF file.
+        start (int): Index of the first page (0-based).
+        stop (int): Index one past the last page.
+
+    Returns:
+        list: Tables found on those pages, in page order.
+    """
+    import pdfplumber
+
+    tables = []
+    with pdfplumber.open(pdf_path, pages=range(start + 1, stop + 1)) as pdf:
+        for page in pdf.pages:
+            page_tables = page.extract_tables()
+            if page_tables:
+                tables.extend(page_tables)
+            page.close()
+    return tables
+
+
+def _iter_pdf_tables(pdf_path, workers=None, max_in_flight=None, pages_per_task=4, progress=None):
+    """
+    Yield the tables of a PDF page by page, in page order.
+
+    With ``workers`` unset the pages are read in this process; otherwise
+    page ranges are fanned out to a process pool. At most ``max_in_flight``
+    pages are being extracted or waiting to be consumed at any time.
+
+    Args:
+        pdf_path (str): The path to the PDF file.
+        workers (int): Number of worker processes, or None for in-process.
+        max_in_flight (int): Upper bound on pages held by the pool.
+        pages_per_task (int): Pages handed to a worker per task.
+        progress (callable): Called as ``progress("pages_extracted", pages)`` as pages complete.
+
+    Yields:
+        list: One table (a list of rows) at a time.
+    """
+    import pdfplumber
+
+    if not workers or workers <= 1:
+        with pdfplumber.open(pdf_path) as pdf:
+            for page_number, page in enumerate(pdf.pages, start=1):
+                yield from page.extract_tables() or []
+                # Drop the page's parsed layout so memory stays flat on long statements
+                page.close()
+                if progress:
+                    progress("pages_extracted", page_number)
+        return
+
+    with pdfplumber.open(pdf_path) as pdf:
+        page_count = len(pdf.pages)
+
+    max_in_flight = max(max_in_flight or workers * pages_per_task * 2, 1)
+    pages_per_task = max(min(pages_per_task, max_in_flight), 1)
+    ranges = deque((start, min(start + pages_per_task, page_count))
+                   for start in range(0, page_count, pages_per_task))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        in_flight = 0
+        pages_done = 0
+        try:
+            while ranges or pending:
+                while ranges and (not pending or in_flight + pages_per_task <= max_in_flight):
+                    start, stop = ranges.popleft()
+                    pending.append((stop - start, executor.submit(_extract_page_range, pdf_path, start, stop)))
+                    in_flight += stop - start
+                size, future = pending.popleft()
+                tables = future.result()
+                in_flight -= size
+                pages_done += size
+                yield from tables
+                if progress:
+                    progress("pages_extracted", pages_done)
+        finally:
+            # Don't let an abandoned extraction run its queued pages to completion
+            for _, future in pending:
+                future.cancel()
+
+
+def _write_tables_csv(tables, csv_file_path):
+    """
+    Stream tables into a CSV file as they arrive.
+
+    The output matches ``pd.concat`` of one DataFrame per table written with
+    ``to_csv(index=False)``: columns are the union of all table headers in
+    order of first appearance, and rows lacking a column are left empty.
+    Rows are spooled to disk as they come in, so only the current table is
+    held in memory.
+
+    Args:
+        tables (iterable): Tables, each a header row followed by data rows.
+        csv_file_path (str): Destination path of the CSV file.
+
+    Returns:
+        bool: False if no table was found, True otherwise.
+    """
+    columns = []
+    positions = {}
+    found = False
+    directory = os.path.dirname(csv_file_path) or "."
+
+    with tempfile.TemporaryFile("w+", newline="", dir=directory) as spool:
+        writer = csv.writer(spool, lineterminator="\n")
+        for table in tables:
+            if not table:
+                continue
+            found = True
+            header = ["" if name is None else name for name in table[0]]
+            if not columns:
+                columns = list(header)
+                positions = {name: i for i, name in enumerate(columns)}
+            elif header != columns[:len(header)]:
+                if len(set(header)) != len(header) or len(positions) != len(columns):
+                    raise ValueError(f"Cannot combine tables with duplicate columns: {header}")
+                for name in header:
+                    if name not in positions:
+                        positions[name] = len(columns)
+                        columns.append(name)
+
+            if header == columns[:len(header)]:
+                rows = table[1:]
+            else:
+                index = [positions[name] for name in header]
+                width = max(index) + 1
+                rows = []
+                for row in table[1:]:
+                    mapped = [None] * width
+                    for i, value in zip(index, row):
+                        mapped[i] = value
+                    rows.append(mapped)
+            writer.writerows(rows)
+
+        if not found:
+            return False
+
+        # Pad rows written before later tables introduced new columns
+        spool.seek(0)
+        with open(csv_file_path, "w", newline="") as out:
+            out_writer = csv.writer(out, lineterminator="\n")
+            out_writer.writerow(columns)
+            for row in csv.reader(spool):
+                row.extend([""] * (len(columns) - len(row)))
+                out_writer.writerow(row)
+    return True
+
+
+def _parse_statement(pdf_path, workers=None, max_in_flight=None, progress=None):
+    """
+    Extract and parse the transactions of a statement PDF.
+
+    Module-level so apps.batch_ingest can run it in its worker processes.
+    Uploads call it in-process; with ``workers``, page extraction (the
+    CPU-heavy part) still fans out to a process pool.
+
+    Args:
+        pdf_path (str): The path to the PDF file.
+        workers (int): Number of page-extraction processes, or None for in-process.
+        max_in_flight (int): Upper bound on pages being extracted at once.
+        progress (callable): Receives ``pages_extracted`` and ``rows_parsed`` updates.
+
+    Returns:
+        tuple: (path of the extracted CSV, parsed DataFrame), or ("", None) if
+        the PDF has no tables.
+    """
+    with span("extract") as current:
+        def track_pages(stage, count):
+            current.set(pages=count)
+            if progress:
+                progress(stage, count)
+
+        csv_path = PDFProcessor.extract_table_from_pdf(
+            pdf_path, workers=workers, max_in_flight=max_in_flight, progress=track_pages
+        )
+    if not csv_path:
+        return "", None
+    with span("parse") as current:
+        df = PDFProcessor.parse_transactions(pd.read_csv(csv_path))
+        df['Merchant'] = df['Merchant'].str.strip().str.lower()
+        current.set(rows=len(df))
+    if progress:
+        progress("rows_parsed", len(df))
+    return csv_path, df
+
 
 class PDFProcessor:
-    def __init__(self, db_path='expenses.db'):
+    def __init__(self, db_path='expenses.db', extract_workers=None, max_pages_in_flight=None,
+                 merchant_cache=None, classify_url=None, classify_chunk_size=40,
+                 classify_concurrency=4, classify_retries=3, classify_timeout=60,
+                 storage_format="csv", llm_backend=None, merchant_classifier=None, local_categorize=True):
         """
         Initialize the PDFProcessor.
 
         Args:
             db_path (str): Path to the SQLite database.
+            extract_workers (int): Processes used to extract PDF pages; None reads them in-process.
+            max_pages_in_flight (int): Upper bound on pages being extracted at once.
+            merchant_cache (MerchantCategoryCache): Store of known merchant categories;
+                defaults to one kept in ``db_path``.
+            classify_url (str): Chat completions endpoint used to classify merchants;
+                defaults to the LLM backend's.
+            classify_chunk_size (int): Merchants sent per classification request.
+            classify_concurrency (int): Classification requests in flight at once.
+            classify_retries (int): Extra attempts for chunks that failed.
+            classify_timeout (float): Seconds to wait for one classification request.
+            storage_format (str): Format of the categorized statement file: "csv", or "parquet"
+                or "feather" (typed columns, needs pyarrow) with a CSV copy exported alongside.
+            llm_backend (str | LLMBackend): LLM backend classifying merchants, e.g. "stub" for
+                the local stand-in; defaults to the SPENDWISE_LLM_BACKEND environment variable.
+            merchant_classifier (MerchantClassifier): Local categorizer tried before the LLM;
+                defaults to one learning from ``merchant_cache``.
+            local_categorize (bool): Categorize merchants locally first, sending only the
+                low-confidence ones to the LLM.
         """
         self.db_path = db_path
-        load_dotenv()
+        self.merchant_cache = merchant_cache or MerchantCategoryCache(db_path)
+        self.merchant_classifier = None
+        if local_categorize:
+            self.merchant_classifier = merchant_classifier or MerchantClassifier(self.merchant_cache)
+        self.store = ExpenseStore(db_path)
+        self.extract_workers = extract_workers
+        self.max_pages_in_flight = max_pages_in_flight
+        self.llm_backend = get_backend(llm_backend)
+        self.classify_url = classify_url or self.llm_backend.chat_url
+        self.classify_chunk_size = classify_chunk_size
+        self.classify_concurrency = classify_concurrency
+        self.classify_retries = classify_retries
+        self.classify_timeout = classify_timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=classify_concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.storage_format = resolve_format(storage_format)
+        load_env()
 
     @staticmethod
-    def extract_table_from_pdf(pdf_path):
+    def extract_table_from_pdf(pdf_path, workers=None, max_in_flight=None, progress=None):
         """
         Extract tables from a PDF file and save them as a CSV file.
 
+        Pages are streamed into the CSV as they are extracted. Passing
+        ``workers`` fans the pages out to a process pool, with at most
+        ``max_in_flight`` pages outstanding.
+
         Args:
             pdf_path (str): The path to the PDF file.
+            workers (int): Number of worker processes, or None for in-process.
+            max_in_flight (int): Upper bound on pages being extracted at once.
+            progress (callable): Called as ``progress("pages_extracted", pages)`` as pages complete.
 
         Returns:
             str: The path to the saved CSV file.
@@ -36,23 +297,16 @@ class PDFProcessor:
             directory = os.path.dirname(pdf_path)
             csv_file_path = os.path.join(directory, f"{base_name}.csv")
 
-            with pdfplumber.open(pdf_path) as pdf:
-                all_tables = []
-                for page in pdf.pages:
-                    tables = page.extract_tables()
-                    if tables:
-                        all_tables.extend(tables)
-
-            if not all_tables:
+            tables = _iter_pdf_tables(pdf_path, workers=workers, max_in_flight=max_in_flight, progress=progress)
+            if not _write_tables_csv(tables, csv_file_path):
                 logging.warning(f"No tables found in the PDF file: {pdf_path}")
                 return ""
 
-            df_list = [pd.DataFrame(table[1:], columns=table[0]) for table in all_tables if table]
-            final_df = pd.concat(df_list, ignore_index=True)
-            final_df.to_csv(csv_file_path, index=False)
             logging.info(f"Tables extracted and saved to '{csv_file_path}'.")
             return csv_file_path
 
+        except IngestionCancelled:
+            raise
         except Exception as e:
             logging.error(f"An error occurred: {e}")
             return ""
@@ -62,6 +316,9 @@ class PDFProcessor:
         """
         Parse and clean transaction data from a DataFrame.
 
+        Card transactions are parsed column-wise with ``Series.str.extract``;
+        rows that are not card transactions are dropped.
+
         Args:
             df (pd.DataFrame): DataFrame containing transaction data.
 
@@ -70,75 +327,35 @@ class PDFProcessor:
         """
         df = df.rename(columns={'Date': 'Date0'})
         df = df.dropna(how='all')
-        df['Description'] = df['Description'].str.replace('\n', ' ')
-        uae_cities = ['Dubai', 'Abu Dhabi', 'Sharjah', 'Ajman', 'Ras Al Khaimah', 'Fujairah', 'Umm Al Quwain', 'Al Ain']
-
-        def extract_city_name(name):
-            for city in uae_cities:
-                if city.lower() in name.lower():
-                    return city
-            return ''
-
-        def replace_ignore_case(original_str, old_substr, new_substr):
-            pattern = re.compile(re.escape(old_substr), re.IGNORECASE)
-            return pattern.sub(new_substr, original_str)
-
-        def parse_transaction(transaction):
-            pattern_card = re.compile(r'CARD NO\.(\d+\*{8}\d{4}) (.+):([A-Z]{2}) (\d+) (\d{2}-\d{2}-\d{4}) ([\d\.]+),([A-Z]+)')
-            pattern_ipi = re.compile(r'IPI TT REF: (\w+) ([^\d\s]+ [^\d\s]+ [^\d\s]+) (.+)$')
-
-            card_match = pattern_card.search(transaction)
-            ipi_match = pattern_ipi.search(transaction)
-
-            if card_match:
-                merchant_and_city = card_match.group(2).strip()
-                city = extract_city_name(merchant_and_city)
-                merchant = replace_ignore_case(merchant_and_city, city, "")
-                return {
-                    "Card Number": card_match.group(1),
-                    "Merchant": merchant,
-                    "Location": city,
-                    "Country Code": card_match.group(3).strip(),
-                    "Transaction ID": card_match.group(4),
-                    "Date": card_match.group(5),
-                    "Amount": card_match.group(6),
-                    "Currency": card_match.group(7)
-                }
-            elif ipi_match:
-                return {
-                    'Card Number': None,
-                    'Merchant': None,
-                    "Location": None,
-                    "Country Code": None,
-                    "Transaction ID": None,
-                    'Date': None,
-                    'Amount': None,
-                    'Currency': None,
-                    'Reference': ipi_match.group(1),
-                    'Details': ipi_match.group(2)
-                }
-            return {
-                'Card Number': None,
-                'Merchant': None,
-                "Location": None,
-                "Country Code": None,
-                "Transaction ID": None,
-                'Date': None,
-                'Amount': None,
-                'Currency': None,
-                'Reference': None,
-                'Details': None
-            }
-
-        df_parsed = df['Description'].apply(parse_transaction).apply(pd.Series)
-        df_final = pd.concat([df, df_parsed], axis=1)
-        df_final['Date'] = pd.to_datetime(df_final['Date'], dayfirst=True)
-        df_final['Amount'] = pd.to_numeric(df_final['Amount'])
-        df_final.fillna({'Debits': 0, 'Credits': 0, 'Balance': 0, 'Amount': 0}, inplace=True)
-        df_final.dropna(how='all', inplace=True)
-        df_final.dropna(subset=['Merchant'], inplace=True)
-
-        return df_final[['Merchant', 'Location', 'Date', 'Amount']]
+        description = df['Description'].str.replace('\n', ' ')
+
+        # Text columns keep pandas' default string dtype, as the row-wise parser's did
+        card = description.str.extract(CARD_PATTERN)
+        card = card[card[0].notna()]
+        merchant_and_city = card[1].str.strip()
+
+        # Each UAE_CITIES entry is a lookahead group; the first one that matches wins,
+        # which keeps the list order as the priority when a name mentions two cities
+        city_hits = merchant_and_city.str.extract(CITY_PATTERN).notna().to_numpy()
+        cities = pd.Series(
+            np.where(city_hits.any(axis=1), np.array(UAE_CITIES)[city_hits.argmax(axis=1)], ''),
+            index=card.index
+        ).astype(merchant_and_city.dtype)
+
+        merchant = merchant_and_city.copy()
+        for city in UAE_CITIES:
+            mask = cities == city
+            if mask.any():
+                merchant[mask] = merchant_and_city[mask].str.replace(CITY_REMOVAL_PATTERNS[city], '', regex=True)
+
+        return pd.DataFrame({
+            'Merchant': merchant,
+            'Location': cities,
+            'Date': pd.to_datetime(card[4], format='%d-%m-%Y'),
+            # Always float, even when every amount on the statement is whole
+            'Amount': pd.to_numeric(card[5]).astype(float),
+            'Transaction ID': card[3],
+        })
 
     @staticmethod
     def find_first_match(text, categories):
@@ -152,29 +369,24 @@ class PDFProcessor:
         Returns:
             str: Matched category or None.
         """
+        if not isinstance(text, str):
+            return None
         for category in categories:
             if category in text.lower():
                 return category
         return None
 
-    def classify_company(self, user_content):
+    def _classification_request(self, user_content):
         """
-        Classify company names using an AI API.
+        Build the headers and body of a classification request.
 
         Args:
             user_content (str): Company names as input.
 
         Returns:
-            dict: Mapping of company names to categories.
+            tuple: (headers, JSON payload).
         """
-        url = "https://api.ai71.ai/v1/chat/completions"
-        AI71_TOKEN = os.getenv("AI71_API_KEY")
-
-        categories = [
-            'fitness', 'groceries', 'restaurants and cafes', 'healthcare', 'clothing', 'jewelry',
-            'transportation', 'phone and internet', 'miscellaneous', 'others', 'e-commerce', 'food delivery'
-        ]
-        categories_str = ', '.join(categories)
+        categories_str = ', '.join(CATEGORIES)
 
         role_content = (
             f"You will be provided with company names, and your task is to classify them to one of the following "
@@ -182,7 +394,7 @@ class PDFProcessor:
         )
 
         payload = json.dumps({
-            "model": "tiiuae/falcon-180b-chat",
+            "model": self.llm_backend.model,
             "messages": [
                 {"role": "system", "content": role_content},
                 {"role": "user", "content": user_content}
@@ -191,68 +403,357 @@ class PDFProcessor:
 
         headers = {
             'Content-Type': 'application/json',
-            'Authorization': f'Bearer {AI71_TOKEN}'
+            'Authorization': f'Bearer {self.llm_backend.api_key}'
         }
+        return headers, payload
+
+    @staticmethod
+    def _record_usage(response_json):
+        """
+        Add the token usage of a chat completions response to the token counters.
+
+        Args:
+            response_json (dict): Decoded chat completions response.
+
+        Returns:
+            dict: The response, unchanged.
+        """
+        usage = response_json.get('usage') or {}
+        for kind in ('prompt', 'completion'):
+            if usage.get(f'{kind}_tokens'):
+                metrics.inc("llm_tokens", usage[f'{kind}_tokens'], kind='input' if kind == 'prompt' else 'output')
+        return response_json
+
+    @staticmethod
+    def _parse_classification(response_json):
+        """
+        Decode the model's JSON reply to a classification request.
+
+        Args:
+            response_json (dict): Decoded chat completions response.
+
+        Returns:
+            dict: Mapping of company names to categories.
+
+        Raises:
+            ValueError: If the reply is not a JSON object.
+        """
+        choices = response_json.get('choices', [])
+        if not choices:
+            raise ValueError("Classification reply has no choices.")
+        content = choices[0].get('message', {}).get('content') or ''
+        # The model sometimes wraps the JSON object in prose or a code fence
+        start, end = content.find('{'), content.rfind('}')
+        if start == -1 or end < start:
+            raise ValueError(f"Classification reply is not JSON: {content[:200]!r}")
+        result = json.loads(content[start:end + 1])
+        if not isinstance(result, dict):
+            raise ValueError("Classification reply is not a JSON object.")
+        return result
+
+    def _request_categories(self, user_content):
+        """
+        Send one classification request and decode the model's JSON reply.
 
-        response = requests.post(url, headers=headers, data=payload)
+        Args:
+            user_content (str): Company names as input.
+
+        Returns:
+            dict: Mapping of company names to categories.
+
+        Raises:
+            requests.RequestException: If the request fails.
+            ValueError: If the reply is not a JSON object.
+        """
+        headers, payload = self._classification_request(user_content)
+        metrics.inc("llm_calls", purpose="classify")
+        response = self.session.post(self.classify_url, headers=headers, data=payload, timeout=self.classify_timeout)
+        response.raise_for_status()
+        return self._parse_classification(self._record_usage(response.json()))
+
+    def classify_company(self, user_content):
+        """
+        Classify company names using an AI API.
+
+        Args:
+            user_content (str): Company names as input.
+
+        Returns:
+            dict: Mapping of company names to categories.
+        """
         try:
-            response_json = response.json()
-            choices = response_json.get('choices', [])
-            if choices:
-                return json.loads(choices[0].get('message', {}).get('content', '{}'))
-        except ValueError:
-            pass
-        return {}
+            return self._request_categories(user_content)
+        except (requests.RequestException, ValueError) as e:
+            logging.error(f"Company classification failed: {e}")
+            return {}
 
-    def generate_sqldb(self, file_path):
+    def _classify_chunk(self, merchants):
         """
-        Process a PDF file and store the data in an SQLite database.
+        Classify one chunk of merchants.
 
         Args:
-            file_path (str): Path to the PDF file.
+            merchants (list): Normalized merchant names.
+
+        Returns:
+            tuple: (mapping of the merchants that were classified, merchants still missing).
         """
-        csv_path = self.extract_table_from_pdf(file_path)
-        if not csv_path:
-            logging.error("No CSV generated from the PDF file.")
-            return
-
-        df = pd.read_csv(csv_path)
-        df = self.parse_transactions(df)
-        merchants = df.Merchant.drop_duplicates()
-        merchants_str = ', '.join(merchants)
-        category_map = self.classify_company(merchants_str)
-        categories = [
-            'fitness', 'groceries', 'restaurants and cafes', 'healthcare', 'clothing', 'jewelry',
-            'transportation', 'phone and internet', 'miscellaneous', 'others', 'e-commerce', 'food delivery'
-        ]
+        try:
+            result = self._request_categories(', '.join(merchants))
+        except (requests.RequestException, ValueError) as e:
+            metrics.inc("llm_errors", purpose="classify")
+            logging.warning(f"Classification of {len(merchants)} merchants failed: {e}")
+            return {}, merchants
+        return self._split_classified(merchants, result)
 
-        df['Merchant'] = df['Merchant'].str.strip().str.lower()
-        category_map = {k.lower(): v for k, v in category_map.items()}
+    @staticmethod
+    def _split_classified(merchants, result):
+        """
+        Match a classification reply against the merchants that were asked for.
+
+        Args:
+            merchants (list): Normalized merchant names sent in the request.
+            result (dict): Decoded reply.
+
+        Returns:
+            tuple: (mapping of the merchants that were classified, merchants still missing).
+        """
+        result = {k.strip().lower(): v for k, v in result.items() if isinstance(v, str)}
+        classified = {merchant: result[merchant] for merchant in merchants if merchant in result}
+        return classified, [merchant for merchant in merchants if merchant not in result]
+
+    def classify_merchants(self, merchants, progress=None):
+        """
+        Classify merchants in concurrent chunks, retrying only what failed.
+
+        The list is split into chunks of ``classify_chunk_size`` that are sent
+        over the shared session with at most ``classify_concurrency`` requests
+        in flight. Chunks that error out or come back with merchants missing
+        are sent again, up to ``classify_retries`` more times.
+
+        Args:
+            merchants (iterable): Normalized merchant names.
+            progress (callable): Called as ``progress("merchants_classified", count)``
+                after every chunk.
+
+        Returns:
+            dict: Mapping of merchant names to categories; merchants that could
+            not be classified are left out.
+        """
+        pending = list(dict.fromkeys(merchants))
+        category_map = {}
+        with ThreadPoolExecutor(max_workers=self.classify_concurrency) as executor:
+            for attempt in range(self.classify_retries + 1):
+                if not pending:
+                    break
+                if attempt:
+                    time.sleep(min(2 ** (attempt - 1), 10))
+                    logging.info(f"Retrying classification of {len(pending)} merchants (attempt {attempt + 1}).")
+                chunks = [pending[i:i + self.classify_chunk_size]
+                          for i in range(0, len(pending), self.classify_chunk_size)]
+                futures = [executor.submit(self._classify_chunk, chunk) for chunk in chunks]
+                pending = []
+                try:
+                    for future in futures:
+                        classified, missing = future.result()
+                        category_map.update(classified)
+                        pending.extend(missing)
+                        if progress:
+                            progress("merchants_classified", len(category_map))
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+
+        if pending:
+            logging.error(f"Could not classify {len(pending)} merchants: {', '.join(pending[:10])}")
+        return category_map
+
+    def _cached_categories(self, merchants):
+        """
+        Look up merchants in the merchant cache.
+
+        Args:
+            merchants (iterable): Normalized merchant names, duplicates allowed.
+
+        Returns:
+            tuple: (mapping of cached merchants to categories, merchants to classify).
+        """
+        with span("merchant_cache") as current:
+            merchants = list(dict.fromkeys(merchants))
+            category_map = self.merchant_cache.get_many(merchants)
+            misses = [merchant for merchant in merchants if merchant not in category_map]
+            current.set(hits=len(category_map), misses=len(misses))
+        metrics.inc("merchant_cache_hits", len(category_map))
+        metrics.inc("merchant_cache_misses", len(misses))
+        logging.info(f"Merchant categories: {len(merchants) - len(misses)} cached, {len(misses)} to classify.")
+        return category_map, misses
+
+    def _local_categories(self, merchants):
+        """
+        Categorize merchants the cache missed with the local classifier.
+
+        Local results are not written to the merchant cache, so the classifier
+        only ever learns from LLM categories.
+
+        Args:
+            merchants (list): Normalized merchant names.
+
+        Returns:
+            tuple: (mapping of merchants categorized locally, merchants left for the LLM).
+        """
+        if self.merchant_classifier is None or not merchants:
+            return {}, merchants
+        with span("local_classify", merchants=len(merchants)) as current:
+            results = self.merchant_classifier.classify(merchants)
+            methods = Counter(method for _, method, _ in results.values())
+            current.set(classified=len(results), **methods)
+        for method, count in methods.items():
+            metrics.inc("merchants_categorized_locally", count, method=method)
+        remaining = [merchant for merchant in merchants if merchant not in results]
+        logging.info(f"Merchant categories: {len(results)} categorized locally "
+                     f"({', '.join(f'{count} {method}' for method, count in methods.items()) or 'none'}), "
+                     f"{len(remaining)} left for the LLM.")
+        return {merchant: category for merchant, (category, _, _) in results.items()}, remaining
+
+    def categorize_merchants(self, merchants, progress=None):
+        """
+        Categorize merchants from the merchant cache, then the local classifier, then the LLM.
+
+        Categories the LLM returns are added to the merchant cache.
+
+        Args:
+            merchants (iterable): Normalized merchant names, duplicates allowed.
+            progress (callable): Called as ``progress("merchants_classified", count)``.
+
+        Returns:
+            dict: Merchant -> category; merchants nothing could classify are left out.
+        """
+        category_map, misses = self._cached_categories(merchants)
+        local, misses = self._local_categories(misses)
+        category_map.update(local)
+        if progress:
+            progress("merchants_classified", len(category_map))
+        if misses:
+            with span("classify", merchants=len(misses)) as classify:
+                classified = self.classify_merchants(misses, progress=(
+                    (lambda stage, count: progress(stage, count + len(category_map))) if progress else None
+                ))
+                classify.set(classified=len(classified))
+            self.merchant_cache.set_many(classified)
+            category_map.update(classified)
+        return category_map
+
+    def apply_categories(self, df, category_map):
+        """
+        Fill in the category columns of parsed transactions.
+
+        Args:
+            df (pd.DataFrame): Parsed transactions; modified in place.
+            category_map (dict): Merchant -> category.
+
+        Returns:
+            pd.DataFrame: df, with Category_freetext and Category set.
+        """
         df['Category_freetext'] = df['Merchant'].map(category_map)
-        df['Category'] = df['Category_freetext'].apply(lambda x: self.find_first_match(x, categories))
+        # Match each distinct category once rather than once per transaction
+        categories = {value: self.find_first_match(value, CATEGORIES)
+                      for value in df['Category_freetext'].dropna().unique()}
+        df['Category'] = df['Category_freetext'].map(categories)
+        return df
 
-        cols = df.columns.to_list() + ['Category']
-        df.to_csv(csv_path)
+    def _store_statement(self, df, category_map, csv_path, file_path, file_hash):
+        """
+        Categorize parsed transactions and append them to the expenses database.
 
-        conn = sqlite3.connect(self.db_path)
-        base_name = os.path.splitext(os.path.basename(file_path))[0]
-        df.to_sql(base_name, conn, if_exists='replace', index=False)
-        conn.commit()
-        conn.close()
+        Args:
+            df (pd.DataFrame): Parsed transactions.
+            category_map (dict): Merchant -> category.
+            csv_path (str): CSV file extracted from the statement.
+            file_path (str): Path to the PDF file.
+            file_hash (str): SHA-256 of the PDF file.
 
-    def upload_file(self, file_path, new_file_name="new_file.pdf"):
+        Returns:
+            int: Number of transactions added.
         """
-        Upload a file, rename it, and process it.
+        self.apply_categories(df, category_map)
+
+        base_name = os.path.splitext(os.path.basename(file_path))[0]
+        with span("store", rows=len(df)) as current:
+            added = self.store.ingest(df, base_name, file_hash, file_name=os.path.basename(file_path))
+            current.set(added=added)
+        metrics.inc("rows_ingested", added)
+        logging.info(f"Added {added} of {len(df)} transactions to '{base_name}'.")
+
+        # The statement file mirrors everything ingested under this statement name so far
+        with span("write_statement_file"):
+            write_statement(self.store.read_statement(base_name), csv_path, self.storage_format)
+        return added
+
+    def generate_sqldb(self, file_path, progress=None):
+        """
+        Process a PDF file and store the data in an SQLite database.
+
+        Statements are appended to the unified transactions table; a PDF whose
+        content was already ingested is skipped without being parsed.
 
         Args:
-            file_path (str): Path to the file.
-            new_file_name (str): New file name.
+            file_path (str): Path to the PDF file.
+            progress (callable): Called as ``progress(stage, count)`` for the
+                ``pages_extracted``, ``rows_parsed``, ``merchants_classified``
+                and ``rows_written`` stages. It may raise IngestionCancelled to
+                stop the ingest until the write starts; once rows are written
+                the ingest completes.
+
+        Returns:
+            int: Number of transactions added.
         """
+        with span("upload", file=os.path.basename(file_path)) as current:
+            file_hash = self.store.file_hash(file_path)
+            if self.store.is_ingested(file_hash):
+                metrics.inc("statements_skipped")
+                current.set(skipped=True)
+                logging.info(f"'{file_path}' was already ingested, skipping.")
+                return 0
+
+            csv_path, df = _parse_statement(file_path, self.extract_workers, self.max_pages_in_flight, progress)
+            if df is None:
+                logging.error("No CSV generated from the PDF file.")
+                return 0
+
+            category_map = self.categorize_merchants(df.Merchant, progress)
+            if progress:
+                progress("rows_written", 0)
+            added = self._store_statement(df, category_map, csv_path, file_path, file_hash)
+            metrics.inc("statements_ingested")
+            if progress:
+                # The rows are committed by now, so a cancel arriving this late is ignored
+                try:
+                    progress("rows_written", added)
+                except IngestionCancelled:
+                    pass
+            return added
+
+    def _copy_upload(self, file_path, new_file_name):
         save_dir = "./upload_data"
         os.makedirs(save_dir, exist_ok=True)
         target_path = os.path.join(save_dir, new_file_name)
         shutil.copy(file_path, target_path)
-        self.generate_sqldb(target_path)
+        return target_path
+
+    def upload_file(self, file_path, new_file_name="new_file.pdf", progress=None):
+        """
+        Upload a file, rename it, and process it.
+
+        Args:
+            file_path (str): Path to the file.
+            new_file_name (str): New file name.
+            progress (callable): Stage progress callback, see generate_sqldb.
+
+        Returns:
+            int: Number of transactions added.
+        """
+        target_path = self._copy_upload(file_path, new_file_name)
+        return self.generate_sqldb(target_path, progress=progress)
 
 # Example usage:
 if __name__ == "__main__":
@@ -0,0 +1,27 @@
+import os
+import shutil
+
+import pytest
+
+from app import SpendWiseApp
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    # The app keeps its database and reads the samples relative to the working directory
+    shutil.copytree(DATA_DIR, tmp_path / "data")
+    monkeypatch.chdir(tmp_path)
+    return SpendWiseApp(llm_backend="stub")
+
+
+def test_samples_are_ingested_once_for_the_range_dashboard(app):
+    assert app.ingest_samples() > 0
+    assert app.ingest_samples() == 0
+    months = [statement for _, statement in app.statement_choices("session:a")]
+    totals = app.plot_generator.range_totals(months=months, preset="all_time")
+    assert totals["span_days"] > 1
+    # Chat on the samples queries their views
+    assert "Error" not in app.spendwise_instance.execute_query(
+        "SELECT SUM(Amount) FROM bank_statement_july", "july")
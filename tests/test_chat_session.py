@@ -0,0 +1,41 @@
+from apps.chat_session import ChatSession
+
+
+class FakeSpendWise:
+    """Answers every question with the statement it was asked against."""
+
+    def generate_sql_query(self, question, table_name, context=None):
+        return f"SELECT * FROM {table_name}"
+
+    def execute_query(self, query, table_name):
+        return table_name
+
+    def generate_answer(self, question, result, context=None):
+        return f"answered from {result}"
+
+
+def session():
+    statements = {"july": "july", "august": "august", "groceries": "stmt_0123456789abcdef"}
+    return ChatSession(FakeSpendWise(), "july", statements=statements)
+
+
+def test_follow_up_naming_a_statement_is_answered_from_it_and_says_so():
+    chat = session()
+    assert chat.ask("How much did I spend on fitness?") == "answered from july"
+    assert chat.ask("and in August?") == "(From your august statement.)\n\nanswered from august"
+    # Further follow-ups stay on it
+    assert chat.ask("and the biggest one?") == "(From your august statement.)\n\nanswered from august"
+
+
+def test_standalone_questions_go_back_to_the_selected_statement():
+    chat = session()
+    chat.ask("How much did I spend on fitness?")
+    chat.ask("and in August?")
+    assert chat.ask("What was my biggest purchase?") == "answered from july"
+    assert chat.table_name == "july"
+
+
+def test_statement_labels_only_switch_follow_ups():
+    chat = session()
+    assert chat.ask("How much did I spend on groceries?") == "answered from july"
+    assert chat.ask("What about august?").endswith("answered from august")
@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+from apps import llm_stub
+from apps.llm_stub import StubLLMServer, stub_category
+from apps.upload_file import PDFProcessor
+
+MERCHANTS = [f"merchant {i}" for i in range(25)]
+
+
+@pytest.fixture
+def server():
+    with StubLLMServer(port=0, latency=0, error_rate=0.3, seed=7) as server:
+        yield server
+
+
+def processor(tmp_path, server):
+    return PDFProcessor(db_path=str(tmp_path / "expenses.db"), llm_backend="stub",
+                        classify_url=server.base_url + "chat/completions", classify_chunk_size=4,
+                        classify_concurrency=3, classify_retries=8)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr("apps.upload_file.time.sleep", lambda seconds: None)
+
+
+def test_every_merchant_is_classified_despite_failed_chunks(tmp_path, server):
+    categories = processor(tmp_path, server).classify_merchants(MERCHANTS + MERCHANTS[:5])
+    assert categories == {merchant: stub_category(merchant) for merchant in MERCHANTS}
+    # 7 chunks, and the 503s on top of them were retried
+    assert server.requests > 7
+
+
+def test_incomplete_replies_are_retried_for_the_missing_merchants_only(tmp_path, server, monkeypatch):
+    server.error_rate = 0
+    sent, dropped = [], set()
+    reply = llm_stub.stub_reply
+
+    def drop_first_merchant_once(messages):
+        categories = json.loads(reply(messages))
+        sent.extend(categories)
+        first = next(iter(categories))
+        if first not in dropped:
+            dropped.add(first)
+            del categories[first]
+        return json.dumps(categories)
+
+    monkeypatch.setattr(llm_stub, "stub_reply", drop_first_merchant_once)
+    categories = processor(tmp_path, server).classify_merchants(MERCHANTS)
+    assert categories == {merchant: stub_category(merchant) for merchant in MERCHANTS}
+    # Only the merchants missing from a reply were sent again
+    assert sorted(sent) == sorted(MERCHANTS + list(dropped))
@@ -0,0 +1,74 @@
+import sqlite3
+
+import pandas as pd
+
+from apps.expense_store import ExpenseStore
+
+
+def transactions(ids):
+    return pd.DataFrame({
+        "Merchant": [f"merchant {i}" for i in ids],
+        "Location": "Dubai",
+        "Date": pd.Timestamp("2024-07-01"),
+        "Amount": [10.0 + i for i in ids],
+        "Transaction ID": [str(100 + i) for i in ids],
+        "Category_freetext": "groceries",
+        "Category": "groceries",
+    })
+
+
+def test_overlapping_statements_keep_all_their_rows(tmp_path):
+    store = ExpenseStore(str(tmp_path / "expenses.db"))
+    assert store.ingest(transactions(range(0, 10)), "stmt_a", "hash_a") == 10
+    assert store.ingest(transactions(range(5, 16)), "stmt_b", "hash_b") == 11
+    assert len(store.read_statement("stmt_b")) == 11
+    # Fully overlapping statements, e.g. the same transactions uploaded by another owner
+    assert store.ingest(transactions(range(0, 10)), "stmt_c", "hash_c") == 10
+    assert store.read_rollups("stmt_c") is not None
+
+
+def test_reingesting_a_statement_skips_known_rows(tmp_path):
+    store = ExpenseStore(str(tmp_path / "expenses.db"))
+    store.ingest(transactions(range(0, 10)), "stmt_a", "hash_a")
+    assert store.ingest(transactions(range(5, 12)), "stmt_a", "hash_a2") == 2
+    assert len(store.read_statement("stmt_a")) == 12
+
+
+def test_migrates_the_global_natural_key(tmp_path):
+    db_path = str(tmp_path / "expenses.db")
+    store = ExpenseStore(db_path)
+    store.ingest(transactions(range(0, 10)), "stmt_a", "hash_a")
+    # Recreate the table with the version 3 key, which left Statement out
+    with sqlite3.connect(db_path) as conn:
+        # Keep the statement views pointing at "transactions" while the table is swapped
+        conn.execute("PRAGMA legacy_alter_table = ON")
+        columns = ", ".join(f'"{c}" {t}' for c, t in ExpenseStore.COLUMN_TYPES.items())
+        conn.execute(f'CREATE TABLE transactions_v3 ({columns}, UNIQUE ("Transaction ID", Date, Amount))')
+        conn.execute("INSERT INTO transactions_v3 SELECT * FROM transactions")
+        conn.execute("DROP TABLE transactions")
+        conn.execute("ALTER TABLE transactions_v3 RENAME TO transactions")
+        conn.execute("PRAGMA user_version = 3")
+
+    store = ExpenseStore(db_path)
+    assert len(store.read_statement("stmt_a")) == 10
+    assert store.ingest(transactions(range(0, 10)), "stmt_b", "hash_b") == 10
+
+
+def test_rollups_match_the_raw_transactions(tmp_path):
+    store = ExpenseStore(str(tmp_path / "expenses.db"))
+    df = transactions(range(0, 6))
+    df["Date"] = pd.to_datetime(["2024-07-01", "2024-07-01", "2024-07-02", "2024-07-02", "2024-07-02", "2024-07-05"])
+    df["Location"] = ["Dubai", "Dubai", "Sharjah", "Dubai", "Sharjah", "Dubai"]
+    store.ingest(df, "stmt_a", "hash_a")
+    store.ingest(transactions(range(100, 102)), "stmt_b", "hash_b")
+
+    rollups = store.read_rollups("stmt_a")
+    assert rollups["daily"].to_dict() == {pd.Timestamp("2024-07-01"): 21.0, pd.Timestamp("2024-07-02"): 39.0,
+                                          pd.Timestamp("2024-07-05"): 15.0}
+    assert rollups["location"].to_dict() == {"Dubai": 49.0, "Sharjah": 26.0}
+    assert rollups["category"].to_dict() == {"groceries": 75.0}
+    assert len(rollups["merchant"]) == 6
+    # Rows added later are folded into the statement's rollups
+    store.ingest(transactions(range(6, 8)), "stmt_a", "hash_a2")
+    assert store.read_rollups("stmt_a")["category"].to_dict() == {"groceries": 108.0}
+    assert store.read_rollups("stmt_missing") is None
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+
+from apps.expense_store import ExpenseStore
+from apps.generate_plot import PlotGenerator, lttb
+
+
+def test_lttb_keeps_the_endpoints_and_one_point_per_bucket():
+    rng = np.random.default_rng(0)
+    x = np.arange(10_000)
+    y = rng.normal(size=len(x))
+    kept = lttb(x, y, 100)
+    assert len(kept) == 100
+    assert kept[0] == 0 and kept[-1] == len(x) - 1
+    assert (np.diff(kept) > 0).all()
+    edges = np.linspace(1, len(x) - 1, 99).astype(int)
+    assert all(start <= index < stop for index, start, stop in zip(kept[1:-1], edges[:-1], edges[1:]))
+
+
+def test_lttb_keeps_peaks_and_dips():
+    y = np.zeros(5_000)
+    y[1234], y[3210] = 500.0, -300.0
+    kept = lttb(np.arange(len(y)), y, 50)
+    assert 1234 in kept and 3210 in kept
+
+
+def test_lttb_leaves_short_series_alone():
+    assert list(lttb([0, 1, 2], [5, 6, 7], 10)) == [0, 1, 2]
+    assert list(lttb(range(10), range(10), 2)) == list(range(10))
+
+
+def test_long_daily_series_are_downsampled_to_max_points():
+    days = pd.date_range("2020-01-01", periods=2_000, freq="D")
+    daily = pd.Series(np.arange(2_000, dtype=float), index=days)
+    amounts, downsampled = PlotGenerator(max_points=300)._amounts(daily, "day")
+    assert downsampled and len(amounts) == 300
+    assert amounts.index[0] == days[0] and amounts.index[-1] == days[-1]
+    monthly, downsampled = PlotGenerator(max_points=300)._amounts(daily, "month")
+    assert not downsampled and monthly.sum() == daily.sum()
+
+
+def test_unchanged_panels_are_not_sent_again():
+    panels = {"total": ("a", "total figure"), "merchants": ("b", "merchants figure")}
+    figures, digests = PlotGenerator._changed_panels(panels, {"total": "a", "merchants": "old"})
+    assert figures == {"total": None, "merchants": "merchants figure"}
+    assert digests == {"total": "a", "merchants": "b"}
+
+
+def test_figures_are_cached_until_the_statement_changes(tmp_path):
+    db_path = str(tmp_path / "expenses.db")
+    store = ExpenseStore(db_path)
+
+    def ingest(ids, file_hash):
+        store.ingest(pd.DataFrame({
+            "Merchant": [f"merchant {i}" for i in ids], "Location": "Dubai",
+            "Date": pd.Timestamp("2024-07-01") + pd.to_timedelta(list(ids), unit="D"),
+            "Amount": [10.0 + i for i in ids], "Transaction ID": [str(i) for i in ids],
+            "Category_freetext": "groceries", "Category": "groceries",
+        }), "stmt_0123456789abcdef", file_hash)
+
+    ingest(range(0, 5), "hash_a")
+    plots = PlotGenerator(db_path=db_path)
+    first = plots.generate_plot("stmt_0123456789abcdef")
+    assert plots.generate_plot("stmt_0123456789abcdef") is first
+    ingest(range(5, 8), "hash_b")
+    assert plots.generate_plot("stmt_0123456789abcdef") is not first
@@ -0,0 +1,82 @@
+import os
+import shutil
+import threading
+
+from apps.ingest_jobs import IngestionJobManager
+from apps.upload_file import PDFProcessor
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+class BlockingProcessor:
+    """Stands in for PDFProcessor: reports progress, then waits until released."""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def generate_sqldb(self, file_path, progress=None):
+        self.calls += 1
+        progress("pages_extracted", 1)
+        self.started.set()
+        self.release.wait(5)
+        progress("rows_parsed", 3)
+        return 3
+
+
+def finish(manager, job_id):
+    manager.get(job_id).future.result(timeout=30)
+    return manager.get(job_id)
+
+
+def test_cancelled_running_job_stops_at_its_next_progress_update():
+    processor = BlockingProcessor()
+    manager = IngestionJobManager(processor, max_workers=1)
+    done = []
+    job_id = manager.submit("statement.pdf", new_file_name=None, on_done=done.append)
+    assert processor.started.wait(5)
+    assert manager.cancel(job_id)
+    processor.release.set()
+    job = finish(manager, job_id)
+    assert job.status == "cancelled"
+    assert job.rows_added is None and done == []
+    assert not manager.cancel(job_id)
+    manager.shutdown()
+
+
+def test_cancelled_queued_job_never_starts():
+    processor = BlockingProcessor()
+    manager = IngestionJobManager(processor, max_workers=1)
+    running = manager.submit("first.pdf", new_file_name=None)
+    assert processor.started.wait(5)
+    queued = manager.submit("second.pdf", new_file_name=None)
+    assert manager.cancel(queued)
+    assert manager.get(queued).status == "cancelled"
+    processor.release.set()
+    assert finish(manager, running).status == "done"
+    assert processor.calls == 1
+    manager.shutdown()
+
+
+def test_cancel_after_the_write_started_lets_the_job_finish(tmp_path):
+    pdf_path = str(tmp_path / "bank_statement_july.pdf")
+    shutil.copy(os.path.join(DATA_DIR, "bank_statement_july.pdf"), pdf_path)
+    processor = PDFProcessor(db_path=str(tmp_path / "expenses.db"), llm_backend="stub")
+    processor.categorize_merchants = lambda merchants, progress=None: {}
+    manager = IngestionJobManager(processor, max_workers=1)
+
+    store_statement = processor._store_statement
+
+    def store_then_cancel(*args):
+        added = store_statement(*args)
+        for job in manager.jobs():
+            manager.cancel(job["id"])
+        return added
+
+    processor._store_statement = store_then_cancel
+    done = []
+    job = finish(manager, manager.submit(pdf_path, new_file_name=None, on_done=done.append))
+    assert job.status == "done"
+    assert job.rows_added > 0 and done == [job]
+    manager.shutdown()
@@ -0,0 +1,30 @@
+import time
+
+from apps.merchant_cache import MerchantCategoryCache
+
+
+def test_categories_are_looked_up_by_normalized_name(tmp_path):
+    cache = MerchantCategoryCache(str(tmp_path / "expenses.db"))
+    cache.set_many({" Carrefour ": "groceries", "talabat": "food delivery"})
+    assert cache.get_many(["carrefour", "TALABAT", "noon"]) == {"carrefour": "groceries", "talabat": "food delivery"}
+    assert cache.stats() == {"hits": 2, "misses": 1, "size": 2}
+    # Persisted in the database, not the instance
+    assert MerchantCategoryCache(str(tmp_path / "expenses.db")).get_many(["carrefour"]) == {"carrefour": "groceries"}
+
+
+def test_expired_entries_are_misses(tmp_path):
+    cache = MerchantCategoryCache(str(tmp_path / "expenses.db"), ttl=60)
+    cache.set_many({"carrefour": "groceries"})
+    with cache._connect() as conn:
+        conn.execute(f"UPDATE {cache.TABLE} SET updated_at = ?", (time.time() - 120,))
+    assert cache.get_many(["carrefour"]) == {}
+    assert cache.evict() == 1
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = MerchantCategoryCache(str(tmp_path / "expenses.db"), max_entries=2)
+    cache.set_many({"carrefour": "groceries", "talabat": "food delivery"})
+    with cache._connect() as conn:
+        conn.execute(f"UPDATE {cache.TABLE} SET last_used = last_used - 10 WHERE merchant = 'talabat'")
+    cache.set_many({"noon": "e-commerce"})
+    assert set(cache.items()) == {"carrefour", "noon"}
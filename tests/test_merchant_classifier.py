@@ -0,0 +1,28 @@
+import pytest
+
+from apps.merchant_cache import MerchantCategoryCache
+from apps.merchant_classifier import MerchantClassifier, rule_category
+
+
+@pytest.mark.parametrize("merchant, category", [
+    ("careem food", "food delivery"),
+    ("careem", "transportation"),
+    ("gold's gym", "fitness"),
+    ("malabar gold", "jewelry"),
+    ("carrefour city centre", "groceries"),
+    ("marketing solutions llc", None),
+])
+def test_keyword_rules(merchant, category):
+    assert rule_category(merchant) == category
+
+
+def test_known_and_similar_merchants_are_categorized_locally(tmp_path):
+    cache = MerchantCategoryCache(str(tmp_path / "expenses.db"))
+    cache.set_many({"al maya supermarket jlt": "groceries", "xyzzy trading": "e-commerce"})
+    classifier = MerchantClassifier(cache, data_dir=str(tmp_path))
+    results = classifier.classify(["xyzzy trading", "xyzzy tradin", "starbucks mall", "qqqq"])
+    assert results["xyzzy trading"][:2] == ("e-commerce", "known")
+    assert results["xyzzy tradin"][:2] == ("e-commerce", "fuzzy")
+    assert results["starbucks mall"][:2] == ("restaurants and cafes", "rule")
+    # Nothing to go on, so it is left for the LLM
+    assert "qqqq" not in results
@@ -0,0 +1,97 @@
+import glob
+import os
+import re
+import shutil
+
+import pandas as pd
+import pytest
+
+from apps.upload_file import PDFProcessor
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+# Bundled statements in another layout than the card statements the parser reads
+OTHER_LAYOUTS = ["statement.pdf"]
+CARD_STATEMENTS = [os.path.basename(path) for path in sorted(glob.glob(os.path.join(DATA_DIR, "*.pdf")))
+                   if os.path.basename(path) not in OTHER_LAYOUTS]
+
+
+def baseline_parse_transactions(df):
+    """The row-wise parser parse_transactions replaced, kept as the reference output."""
+    df = df.rename(columns={'Date': 'Date0'})
+    df = df.dropna(how='all')
+    df['Description'] = df['Description'].str.replace('\n', ' ')
+    uae_cities = ['Dubai', 'Abu Dhabi', 'Sharjah', 'Ajman', 'Ras Al Khaimah', 'Fujairah', 'Umm Al Quwain', 'Al Ain']
+
+    def extract_city_name(name):
+        for city in uae_cities:
+            if city.lower() in name.lower():
+                return city
+        return ''
+
+    def replace_ignore_case(original_str, old_substr, new_substr):
+        pattern = re.compile(re.escape(old_substr), re.IGNORECASE)
+        return pattern.sub(new_substr, original_str)
+
+    def parse_transaction(transaction):
+        pattern_card = re.compile(r'CARD NO\.(\d+\*{8}\d{4}) (.+):([A-Z]{2}) (\d+) (\d{2}-\d{2}-\d{4}) ([\d\.]+),([A-Z]+)')
+        card_match = pattern_card.search(transaction)
+        if card_match:
+            merchant_and_city = card_match.group(2).strip()
+            city = extract_city_name(merchant_and_city)
+            return {
+                "Merchant": replace_ignore_case(merchant_and_city, city, ""),
+                "Location": city,
+                "Date": card_match.group(5),
+                "Amount": card_match.group(6),
+            }
+        return {'Merchant': None, "Location": None, 'Date': None, 'Amount': None}
+
+    df_parsed = df['Description'].apply(parse_transaction).apply(pd.Series)
+    df_final = pd.concat([df, df_parsed], axis=1)
+    df_final['Date'] = pd.to_datetime(df_final['Date'], dayfirst=True)
+    df_final['Amount'] = pd.to_numeric(df_final['Amount'])
+    df_final.fillna({'Amount': 0}, inplace=True)
+    df_final.dropna(subset=['Merchant'], inplace=True)
+    return df_final[['Merchant', 'Location', 'Date', 'Amount']]
+
+
+def extract_table(name, tmp_path):
+    # Extraction writes its CSV next to the PDF, so work on a copy
+    pdf_path = tmp_path / name
+    shutil.copy(os.path.join(DATA_DIR, name), pdf_path)
+    return pd.read_csv(PDFProcessor.extract_table_from_pdf(str(pdf_path)))
+
+
+def test_card_statements_are_bundled():
+    assert "bank_statement_july.pdf" in CARD_STATEMENTS
+
+
+@pytest.mark.parametrize("name", CARD_STATEMENTS)
+def test_matches_baseline_on_bundled_statement(name, tmp_path):
+    table = extract_table(name, tmp_path)
+    expected = baseline_parse_transactions(table)
+    parsed = PDFProcessor.parse_transactions(table)
+    assert len(expected) > 0
+    pd.testing.assert_frame_equal(parsed[expected.columns], expected)
+
+
+@pytest.mark.parametrize("name", OTHER_LAYOUTS)
+def test_other_layouts_yield_no_card_transactions(name, tmp_path):
+    table = extract_table(name, tmp_path)
+    # The row-wise parser fails on their empty descriptions; the vectorized one skips them
+    with pytest.raises(TypeError):
+        baseline_parse_transactions(table)
+    assert PDFProcessor.parse_transactions(table).empty
+
+
+def test_matches_baseline_with_whole_amounts_and_cities():
+    descriptions = [
+        "CARD NO.4000********1234 CARREFOUR DUBAI:AE 123456 01-07-2024 50,AED",
+        "CARD NO.4000********1234 Lulu Abu Dhabi Mall:AE 123457 02-07-2024 12,AED",
+        "CARD NO.4000********1234 Sharjah Coop\nDubai:AE 123458 03-07-2024 7,AED",
+        "IPI TT REF: ABC123 SALARY TRANSFER FROM EMPLOYER",
+    ]
+    table = pd.DataFrame({"Date": ["x"] * len(descriptions), "Description": descriptions})
+    expected = baseline_parse_transactions(table)
+    parsed = PDFProcessor.parse_transactions(table)
+    pd.testing.assert_frame_equal(parsed[expected.columns], expected)
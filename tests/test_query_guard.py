@@ -0,0 +1,69 @@
+import sqlite3
+
+import pytest
+
+from apps.query_guard import GuardedExecutor, QueryRejected, QueryTimeout
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "expenses.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE transactions (Statement TEXT, Merchant TEXT, Amount REAL)")
+    conn.executemany("INSERT INTO transactions VALUES (?, ?, ?)",
+                     [("july" if i % 2 else "august", f"merchant {i}", float(i)) for i in range(1000)])
+    conn.execute("CREATE VIEW july AS SELECT Merchant, Amount FROM transactions WHERE Statement = 'july'")
+    conn.execute("CREATE VIEW august AS SELECT Merchant, Amount FROM transactions WHERE Statement = 'august'")
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_reads_the_selected_statement(db_path):
+    result = GuardedExecutor(db_path).run("SELECT COUNT(*), SUM(Amount) FROM july", "july")
+    assert result.columns == ["COUNT(*)", "SUM(Amount)"]
+    assert result.rows == [(500, 250000.0)] and not result.truncated
+
+
+@pytest.mark.parametrize("query", [
+    "DELETE FROM july",
+    "DROP VIEW july",
+    "UPDATE transactions SET Amount = 0",
+    "ATTACH DATABASE ':memory:' AS other",
+    "PRAGMA writable_schema = ON",
+])
+def test_refuses_writes(db_path, query):
+    with pytest.raises(QueryRejected):
+        GuardedExecutor(db_path).run(query, "july")
+    assert GuardedExecutor(db_path).run("SELECT COUNT(*) FROM july", "july").rows == [(500,)]
+
+
+def test_refuses_other_statements(db_path):
+    executor = GuardedExecutor(db_path)
+    with pytest.raises(QueryRejected, match="selected statement"):
+        executor.run("SELECT SUM(Amount) FROM august", "july")
+    with pytest.raises(QueryRejected):
+        executor.run("SELECT SUM(Amount) FROM transactions", "july")
+
+
+def test_refuses_incomplete_and_expensive_queries(db_path):
+    executor = GuardedExecutor(db_path, max_estimated_rows=10_000)
+    with pytest.raises(QueryRejected, match="complete"):
+        executor.run("SELECT 'unterminated", "july")
+    with pytest.raises(QueryRejected, match="rows"):
+        executor.run("SELECT COUNT(*) FROM july a, july b, july c", "july")
+
+
+def test_stops_queries_past_the_timeout(db_path):
+    executor = GuardedExecutor(db_path, timeout=0.05, progress_steps=1000)
+    endless = "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT COUNT(*) FROM n"
+    with pytest.raises(QueryTimeout):
+        executor.run(endless)
+
+
+def test_caps_rows_and_bytes(db_path):
+    result = GuardedExecutor(db_path, max_rows=10).run("SELECT * FROM july", "july")
+    assert len(result.rows) == 10 and result.truncated
+    assert "Only the first 10 rows" in result.summary()
+    result = GuardedExecutor(db_path, max_bytes=100).run("SELECT * FROM july", "july")
+    assert 0 < len(result.rows) < 10 and result.truncated
@@ -0,0 +1,43 @@
+import sqlite3
+
+import pytest
+
+from apps.question_router import match_intent, normalize_question, rule_based_sql
+
+
+@pytest.mark.parametrize("question, intent", [
+    ("How much did I spend on groceries?", "category_total"),
+    ("What was my biggest purchase", "biggest_purchase"),
+    ("Give me a summary report of my expenses", "summary"),
+    ("Total expenditure pls?", "total"),
+    ("How much have I spent in total?", "total"),
+    ("Total spent on gym", "category_total"),
+])
+def test_common_questions_use_templates(question, intent):
+    assert match_intent(normalize_question(question))[0] == intent
+
+
+@pytest.mark.parametrize("question", [
+    "How much did I spend at carrefour?",
+    "How much did I spend on talabat",
+    "How much did I spend in Dubai?",
+    "Total spent on noon",
+    "Summary of my spending at lulu",
+    "biggest purchase in Abu Dhabi",
+    "How much did I spend on groceries at carrefour?",
+])
+def test_merchant_and_location_questions_go_to_the_llm(question):
+    assert rule_based_sql(question, "t") is None
+
+
+def test_category_total_matches_free_text_variants():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE t (Merchant TEXT, Amount REAL, Category_freetext TEXT, Category TEXT)")
+    conn.executemany("INSERT INTO t VALUES (?, ?, ?, ?)", [
+        ("carrefour", 10.0, "Groceries", "groceries"),
+        ("spinneys", 5.0, "grocery", None),
+        ("lulu", 2.5, "groceries and supermarkets", "groceries"),
+        ("talabat", 40.0, "food delivery", "food delivery"),
+    ])
+    sql = rule_based_sql("How much did I spend on groceries?", "t")
+    assert conn.execute(sql).fetchone()[0] == 17.5
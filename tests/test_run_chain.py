@@ -0,0 +1,51 @@
+from types import SimpleNamespace
+
+import pandas as pd
+
+from apps.expense_store import ExpenseStore
+from apps.run_chain import SpendWise
+
+STATEMENT = "stmt_0123456789abcdef"
+QUESTION = "Which merchants did I visit more than once?"
+
+
+class FakeLLM:
+    """Replies with the queued SQL, one reply per call."""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.calls = 0
+
+    def invoke(self, messages):
+        self.calls += 1
+        return SimpleNamespace(content=self.replies.pop(0))
+
+
+def spendwise(tmp_path, replies):
+    db_path = str(tmp_path / "expenses.db")
+    ExpenseStore(db_path).ingest(pd.DataFrame({
+        "Merchant": ["carrefour", "carrefour", "talabat"],
+        "Location": "Dubai",
+        "Date": pd.Timestamp("2024-07-01"),
+        "Amount": [10.0, 20.0, 30.0],
+        "Transaction ID": ["1", "2", "3"],
+        "Category_freetext": "groceries",
+        "Category": "groceries",
+    }), STATEMENT, "hash")
+    instance = SpendWise(db_path=f"sqlite:///{db_path}", llm_backend="stub")
+    instance._llm = FakeLLM(replies)
+    return instance
+
+
+def ask(instance):
+    return instance.execute_query(instance.generate_sql_query(QUESTION, STATEMENT), STATEMENT)
+
+
+def test_sql_that_fails_to_execute_is_not_replayed(tmp_path):
+    good_sql = f"SELECT Merchant FROM {STATEMENT} GROUP BY Merchant HAVING COUNT(*) > 1"
+    instance = spendwise(tmp_path, [f"SELECT Shop FROM {STATEMENT}", good_sql])
+    assert ask(instance).startswith("Error executing query")
+    assert "carrefour" in ask(instance)
+    assert "carrefour" in ask(instance)
+    # The failed query was asked again; the working one is served from the cache
+    assert instance._llm.calls == 2
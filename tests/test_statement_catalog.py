@@ -0,0 +1,37 @@
+import os
+
+from apps.statement_catalog import StatementCatalog
+
+
+def make_catalog(tmp_path):
+    return StatementCatalog(str(tmp_path / "expenses.db"), storage_dir=str(tmp_path / "statements"))
+
+
+def make_pdf(tmp_path, name, content):
+    path = tmp_path / name
+    path.write_bytes(content)
+    return str(path)
+
+
+def test_same_file_is_stored_once_and_listed_per_owner(tmp_path):
+    catalog = make_catalog(tmp_path)
+    first = catalog.add("alice", make_pdf(tmp_path, "july.pdf", b"july"))
+    again = catalog.add("alice", make_pdf(tmp_path, "copy.pdf", b"july"))
+    other = catalog.add("bob", make_pdf(tmp_path, "july.pdf", b"july"))
+    assert again["duplicate"] and again["statement"] == first["statement"] == other["statement"]
+    assert catalog.list("alice") == [("july", first["statement"])]
+    assert catalog.owns("bob", first["statement"]) and not catalog.owns("carol", first["statement"])
+    assert os.listdir(catalog.storage_dir) == [f"{first['statement']}.pdf"]
+
+
+def test_expire_drops_old_session_entries_and_their_unlisted_files(tmp_path):
+    catalog = make_catalog(tmp_path)
+    shared = catalog.add("session:a", make_pdf(tmp_path, "july.pdf", b"july"))
+    catalog.add("alice", make_pdf(tmp_path, "july.pdf", b"july"))
+    orphan = catalog.add("session:a", make_pdf(tmp_path, "august.pdf", b"august"))
+
+    assert catalog.expire("session:", max_age=3600) == 0
+    assert catalog.expire("session:", max_age=-1) == 2
+    assert catalog.list("session:a") == []
+    assert catalog.owns("alice", shared["statement"])
+    assert os.path.exists(shared["path"]) and not os.path.exists(orphan["path"])